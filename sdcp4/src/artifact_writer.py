@@ -0,0 +1,88 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+#plot a hot pixel density histogram (see compute_lane_line_base_density_histogram) and return the plot as an rgb image
+#each call draws on its own figure and canvas (nothing goes through pyplot's global figure), so plots can be rendered from any thread or process at once
+#(matplotlib is imported here, only when a plot is rendered, so nothing that merely imports this file pays for it)
+def render_hot_pixel_density_histogram(hot_pixel_density_histogram, figure_size=(8, 6), dpi=80):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=figure_size, dpi=dpi)
+    canvas = FigureCanvasAgg(figure)
+    axes = figure.add_subplot(1, 1, 1)
+    axes.plot(hot_pixel_density_histogram, color='b', linewidth=1)
+    axes.set_xlabel('Pixel position', fontsize=14)
+    axes.set_ylabel('Hot pixel density', fontsize=14)
+    canvas.draw()
+    #drop the alpha channel of the rendered rgba buffer
+    return np.array(canvas.buffer_rgba())[:, :, :3]
+
+#determine whether an artifact was selected (by its name or its stage, the part of the name before the first underscore), None selects everything
+def is_artifact_selected(artifact_name, selected_artifacts):
+    return ((selected_artifacts is None) or (artifact_name in selected_artifacts) or (artifact_name.split("_", 1)[0] in selected_artifacts))
+
+#writes debug artifacts (rgb images) to an output directory on a pool of background threads, so encoding doesn't hold up the stages producing them
+#(jpeg encoding in opencv releases the gil, so the threads encode in parallel)
+#an artifact named e.g., 'stage1_warped' for the image 'test1' is written to <output_directory>/stage1_warped_test1.jpg
+#selected_artifacts limits which artifacts are written, each entry is either an artifact name or a stage (e.g., 'stage3' selects every stage 3 artifact),
+#None selects everything, producers should check is_artifact_selected before rendering an artifact to skip the work entirely
+#at most max_pending_writes artifacts are queued at once (submitting another waits for the oldest to be written, bounding memory use)
+class ArtifactWriter:
+    __slots__ = ("output_directory", "selected_artifacts", "max_pending_writes", "executor", "pending_writes", "num_artifacts_written")
+
+    def __init__(self, output_directory="output_images", selected_artifacts=None, num_threads=4, max_pending_writes=64):
+        os.makedirs(output_directory, exist_ok=True)
+        self.output_directory = output_directory
+        self.selected_artifacts = (None if (selected_artifacts is None) else frozenset(selected_artifacts))
+        self.max_pending_writes = max_pending_writes
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+        #futures of submitted writes, oldest (leftmost) first
+        self.pending_writes = deque()
+        self.num_artifacts_written = 0
+
+    #determine whether an artifact was selected
+    def is_artifact_selected(self, artifact_name):
+        return is_artifact_selected(artifact_name, self.selected_artifacts)
+
+    #queue an artifact to be written (unless it wasn't selected), returns the path it will be written to (or None)
+    #the image must not be modified after it's submitted
+    def submit_artifact(self, artifact_name, image_name, image):
+        if (not self.is_artifact_selected(artifact_name)):
+            return None
+        path_to_artifact = os.path.join(self.output_directory, "{0}_{1}.jpg".format(artifact_name, image_name))
+        #wait for the oldest write once the queue is full (this also surfaces write errors promptly)
+        while (len(self.pending_writes) >= self.max_pending_writes):
+            self.finish_oldest_write()
+        self.pending_writes.append(self.executor.submit(write_rgb_image, path_to_artifact, image))
+        return path_to_artifact
+
+    #wait for the oldest queued write to complete
+    def finish_oldest_write(self):
+        self.pending_writes.popleft().result()
+        self.num_artifacts_written += 1
+
+    #wait for every queued write to complete and stop the pool, returns the number of artifacts written
+    def close(self):
+        try:
+            while (len(self.pending_writes) > 0):
+                self.finish_oldest_write()
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.num_artifacts_written
+
+#encode an rgb image and write it to the supplied path (the format follows the path's extension)
+def write_rgb_image(path_to_image, image):
+    if (not cv2.imwrite(path_to_image, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))):
+        raise IOError("unable to write {0}".format(path_to_image))
\ No newline at end of file
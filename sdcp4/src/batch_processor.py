@@ -0,0 +1,201 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import main
+from geometry_processor import generate_geometry_spec
+from production_pipeline import execute_production_pipeline, initialize_worker
+
+#process a batch of videos against a single (shared) calibration, e.g.:
+#   python batch_processor.py recordings/ --output-dir processed/ --jobs 4
+#(add --dry-run to list each input and the output it would be written to without processing anything)
+#calibration and perspective transform components are built once, then videos are scheduled across a pool of worker processes (one video per worker at a time)
+#each video is written to a temporary file that is only renamed into place once complete, and recorded in a manifest in the output directory,
+#so an interrupted batch can be rerun with the same arguments and will only process the videos that weren't completed
+
+#video file extensions picked up when a directory is supplied as an input
+video_file_extensions = (".mp4", ".mov", ".avi", ".mkv")
+
+#layout version of the manifest (bump to force every video to be reprocessed)
+batch_manifest_version = 1
+
+#expand the supplied inputs (video files, directories of videos, or glob patterns) into a sorted list of unique video paths
+def generate_input_video_paths(inputs):
+    input_video_paths = set()
+    for cur_input in inputs:
+        if (os.path.isdir(cur_input)):
+            input_video_paths.update(os.path.join(cur_input, file_name) for file_name in os.listdir(cur_input) if file_name.lower().endswith(video_file_extensions))
+        elif (os.path.isfile(cur_input)):
+            input_video_paths.add(cur_input)
+        else:
+            input_video_paths.update(glob.glob(cur_input))
+    return sorted(os.path.abspath(input_video_path) for input_video_path in input_video_paths)
+
+#pair every input video with its output path, outputs mirror the layout of the inputs below the directory they have in common (so inputs with the
+#same file name in different directories, e.g., day1/clip.mp4 and day2/clip.mp4, are written to day1/processed_clip.mp4 and day2/processed_clip.mp4)
+def generate_output_video_paths(input_video_paths, output_directory):
+    if (len(input_video_paths) == 0):
+        return []
+    input_root_directory = os.path.commonpath([os.path.dirname(path_to_input_video) for path_to_input_video in input_video_paths])
+    output_video_paths = []
+    for path_to_input_video in input_video_paths:
+        input_subdirectory, input_file_name = os.path.split(os.path.relpath(path_to_input_video, input_root_directory))
+        output_video_paths.append(os.path.abspath(os.path.join(output_directory, input_subdirectory, "processed_" + input_file_name)))
+    return output_video_paths
+
+#compute the fingerprint of an input video used to detect whether it changed since it was processed (size + modification time)
+def compute_input_video_fingerprint(path_to_input_video):
+    input_video_stat = os.stat(path_to_input_video)
+    return [input_video_stat.st_size, input_video_stat.st_mtime_ns]
+
+#load the batch manifest (input video path --> completed job record), returns an empty manifest if there isn't one yet or it's from a different version
+def load_batch_manifest(path_to_manifest):
+    if (not os.path.isfile(path_to_manifest)):
+        return {}
+    try:
+        with open(path_to_manifest, "r") as manifest_file:
+            manifest = json.load(manifest_file)
+    except ValueError:
+        return {}
+    if (manifest.get("version") != batch_manifest_version):
+        return {}
+    return manifest.get("videos", {})
+
+#save the batch manifest (written to a temporary file first, so an interrupted save never leaves a truncated manifest behind)
+def save_batch_manifest(path_to_manifest, manifest):
+    path_to_temp_manifest = path_to_manifest + ".tmp"
+    with open(path_to_temp_manifest, "w") as manifest_file:
+        json.dump({"version": batch_manifest_version, "videos": manifest}, manifest_file, indent=2, sort_keys=True)
+    os.replace(path_to_temp_manifest, path_to_manifest)
+
+#determine whether a video was already processed with the current settings (its record matches and its output still exists)
+def is_video_already_processed(manifest, path_to_input_video, path_to_output_video, pipeline_settings):
+    job_record = manifest.get(path_to_input_video)
+    if (job_record is None):
+        return False
+    return ((job_record["output"] == path_to_output_video) and (job_record["fingerprint"] == compute_input_video_fingerprint(path_to_input_video)) and
+            (job_record["settings"] == pipeline_settings) and os.path.isfile(path_to_output_video))
+
+#process a single video (runs in a batch worker process), writing to a temporary file that's renamed into place once the video is complete
+#returns (number of frames processed, elapsed seconds)
+def process_batch_video(calibration_components, perspective_transform_components, path_to_input_video, path_to_output_video, pipeline_settings):
+    output_directory, output_file_name = os.path.split(path_to_output_video)
+    os.makedirs(output_directory, exist_ok=True)
+    #keep the extension last so ffmpeg still recognizes the container
+    path_to_partial_output_video = os.path.join(output_directory, ".partial." + output_file_name)
+    start_time = time.perf_counter()
+    try:
+        num_frames_processed = execute_production_pipeline(calibration_components, perspective_transform_components, path_to_input_video, path_to_partial_output_video,
+                                                           num_workers=1, use_raw_pipe=pipeline_settings["use_raw_pipe"], use_region_of_interest_thresholding=pipeline_settings["use_region_of_interest_thresholding"],
+                                                           use_fixed_point_maps=pipeline_settings["use_fixed_point_maps"], use_motion_model=pipeline_settings["use_motion_model"],
+                                                           processing_scale=pipeline_settings["processing_scale"])
+    except BaseException:
+        #don't leave partial output behind
+        if (os.path.isfile(path_to_partial_output_video)):
+            os.remove(path_to_partial_output_video)
+        raise
+    os.replace(path_to_partial_output_video, path_to_output_video)
+    return (num_frames_processed, time.perf_counter() - start_time)
+
+#process a batch of videos across a pool of num_jobs worker processes, skipping videos the manifest records as complete (unless force is set)
+#dry_run only lists what would be processed (and where each output would be written)
+#returns the number of videos that failed
+def execute_batch(calibration_components, perspective_transform_components, input_video_paths, output_directory, pipeline_settings, num_jobs=None, path_to_manifest=None, force=False,
+                  dry_run=False):
+    os.makedirs(output_directory, exist_ok=True)
+    if (path_to_manifest is None):
+        path_to_manifest = os.path.join(output_directory, "batch_manifest.json")
+    manifest = load_batch_manifest(path_to_manifest)
+
+    #pair every input video with its output, skipping those already completed
+    pending_jobs = []
+    for path_to_input_video, path_to_output_video in zip(input_video_paths, generate_output_video_paths(input_video_paths, output_directory)):
+        if ((not force) and is_video_already_processed(manifest, path_to_input_video, path_to_output_video, pipeline_settings)):
+            print("skipping {0} (already processed)".format(path_to_input_video))
+            continue
+        pending_jobs.append((path_to_input_video, path_to_output_video))
+    if (len(pending_jobs) == 0):
+        print("nothing to process")
+        return 0
+    #every job must have an output of its own (two jobs writing to the same output would clobber each other's partial file)
+    if (len(set(path_to_output_video for (_, path_to_output_video) in pending_jobs)) != len(pending_jobs)):
+        raise ValueError("more than one input video maps to the same output video")
+    if (dry_run):
+        for path_to_input_video, path_to_output_video in pending_jobs:
+            print("{0} -> {1}".format(path_to_input_video, path_to_output_video))
+        return 0
+
+    #process the pending videos, recording each one in the manifest as soon as it completes
+    num_failed_videos = 0
+    total_frames_processed = 0
+    batch_start_time = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=num_jobs, initializer=initialize_worker, initargs=(pipeline_settings["gaussian_blur_strategy"],)) as executor:
+        job_futures = {executor.submit(process_batch_video, calibration_components, perspective_transform_components, path_to_input_video, path_to_output_video, pipeline_settings): (path_to_input_video, path_to_output_video)
+                       for (path_to_input_video, path_to_output_video) in pending_jobs}
+        for num_jobs_finished, job_future in enumerate(as_completed(job_futures), 1):
+            path_to_input_video, path_to_output_video = job_futures[job_future]
+            try:
+                num_frames_processed, elapsed_seconds = job_future.result()
+            except Exception as error:
+                num_failed_videos += 1
+                print("[{0}/{1}] {2} failed: {3}: {4}".format(num_jobs_finished, len(pending_jobs), path_to_input_video, type(error).__name__, (str(error).splitlines() or [""])[0]))
+                continue
+            frames_per_second = num_frames_processed / max(elapsed_seconds, 1e-9)
+            total_frames_processed += num_frames_processed
+            print("[{0}/{1}] {2} -> {3}: {4} frames in {5:.1f}s ({6:.1f} fps)".format(num_jobs_finished, len(pending_jobs), path_to_input_video, path_to_output_video, num_frames_processed, elapsed_seconds, frames_per_second))
+            manifest[path_to_input_video] = {"output": path_to_output_video, "fingerprint": compute_input_video_fingerprint(path_to_input_video), "settings": pipeline_settings,
+                                             "frames": num_frames_processed, "seconds": elapsed_seconds, "fps": frames_per_second}
+            save_batch_manifest(path_to_manifest, manifest)
+
+    #report overall throughput
+    batch_elapsed_seconds = time.perf_counter() - batch_start_time
+    print("processed {0} of {1} videos: {2} frames in {3:.1f}s ({4:.1f} fps overall)".format(len(pending_jobs) - num_failed_videos, len(pending_jobs), total_frames_processed, batch_elapsed_seconds,
+                                                                                           total_frames_processed / max(batch_elapsed_seconds, 1e-9)))
+    return num_failed_videos
+
+#parse the command line arguments (defaults come from the settings in main)
+def parse_batch_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Process a batch of videos against a shared camera calibration.")
+    parser.add_argument("inputs", nargs="+", help="input videos, directories of videos, or glob patterns")
+    parser.add_argument("--output-dir", default="output_video", help="directory processed videos (and the manifest) are written to")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of videos processed at once")
+    parser.add_argument("--manifest", default=None, help="manifest used to resume a batch (defaults to batch_manifest.json in the output directory)")
+    parser.add_argument("--force", action="store_true", help="reprocess videos the manifest records as complete")
+    parser.add_argument("--dry-run", action="store_true", help="list the videos that would be processed (and their outputs) without processing them")
+    main.add_pipeline_arguments(parser)
+    return parser.parse_args(argv)
+
+#run the batch command
+def execute_batch_command(argv=None):
+    arguments = parse_batch_arguments(argv)
+    input_video_paths = generate_input_video_paths(arguments.inputs)
+    if (len(input_video_paths) == 0):
+        print("no input videos found")
+        return 1
+    #build the calibration and perspective transform components once for the whole batch
+    calibration_components = main.generate_camera_calibration_components(arguments.calibration_images, arguments.calibration_cache)
+    perspective_transform_components = main.generate_road_perspective_transform_components()
+    #everything that affects the output of a video (a change to any of these reprocesses completed videos)
+    pipeline_settings = {"geometry_key": generate_geometry_spec(calibration_components, perspective_transform_components, main.camera_image_size, arguments.use_fixed_point_maps,
+                                                           arguments.processing_scale)[0],
+                         "gaussian_blur_strategy": arguments.blur_strategy, "use_region_of_interest_thresholding": arguments.use_region_of_interest_thresholding,
+                         "use_fixed_point_maps": arguments.use_fixed_point_maps, "use_raw_pipe": arguments.use_raw_pipe,
+                         "use_motion_model": arguments.use_motion_model, "processing_scale": arguments.processing_scale}
+    num_failed_videos = execute_batch(calibration_components, perspective_transform_components, input_video_paths, arguments.output_dir, pipeline_settings,
+                                      num_jobs=arguments.jobs, path_to_manifest=arguments.manifest, force=arguments.force, dry_run=arguments.dry_run)
+    return (1 if (num_failed_videos > 0) else 0)
+
+if __name__ == "__main__":
+    sys.exit(execute_batch_command())
\ No newline at end of file
@@ -0,0 +1,556 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+import cv2
+import threshold_processor
+from threshold_processor import (compute_hot_pixel_density_across_x_axis, apply_gaussian_blur, apply_gradient_filter, apply_hls_channel_color_thresholding,
+                                 apply_l_channel_gradient_thresholding, apply_s_channel_gradient_and_value_thresholding,
+                                 perform_thresholding, perform_fused_thresholding, perform_region_of_interest_thresholding, gaussian_blur_strategies)
+from perspective_processor import generate_perspective_transform_components, perform_perspective_transform
+from calibration_processor import detect_chessboard_corners, compute_calibration_components, generate_cached_calibration_components, perform_undistort
+from lane_processor import (generate_hot_pixel_index, estimate_index_of_lane_line_base, perform_blind_lane_line_pixel_search, perform_educated_lane_line_pixel_search,
+                            compute_lane_line_coefficients, compute_curvature_of_lane_lines, compute_vehicle_offset, generate_lane_line_search_regions)
+from lane_tracker import LaneTracker
+from buffer_pool import FrameBufferPool
+from instrumentation_processor import StageAllocations
+from lane_motion_model import compute_lane_line_displacement
+from frame_io import generate_frame_source
+
+#offline speed benchmark: times the public stages of the pipeline (and the end-to-end pipeline) on deterministic synthetic road frames,
+#so it needs no sample images or videos, e.g.:
+#   python benchmark.py --update-baselines     (record baselines on this machine)
+#   python benchmark.py                        (exits non-zero if any benchmark is slower than its baseline beyond the tolerance)
+#   python benchmark.py --accuracy-report      (lane estimates at reduced processing scales vs full resolution)
+#   python benchmark.py --allocation-check     (exits non-zero if a steady state frame makes an image sized allocation)
+
+#road scenarios rendered for every resolution
+synthetic_road_scenarios = ("straight", "curved", "dashed", "shadowed", "noisy")
+
+#resolutions (cols, rows) benchmarked by default
+default_benchmark_resolutions = ((640, 360), (1280, 720), (1920, 1080))
+
+#perspective transform vertices of the 1280x720 camera (see main), scaled to each resolution
+reference_image_size = (1280, 720)
+reference_src_vertices = np.float32([(517, 478), (0, 720), (1280, 720), (762, 478)])
+reference_dest_vertices = np.float32([(0, 0), (0, 720), (1280, 720), (1280, 0)])
+
+#inside corner count of the synthetic chessboards (same as the real calibration images)
+num_column_points = 9
+num_row_points = 6
+
+#################################
+## SYNTHETIC FRAME GENERATION  ##
+#################################
+
+#compute the polynomial coefficients (f(y) = A(y^2) + By + C, in warped pixels) of the left and right lane lines of a synthetic road
+#lines are x = base + bend * cols * ((rows - y) / rows)^2, i.e., straight up from the base of the image and bending towards the top
+def compute_synthetic_lane_line_coefficients(frame_size, scenario):
+    cols, rows = frame_size
+    bend = 0.12 if (scenario == "curved") else 0.0
+    lane_line_coeff = []
+    for base in (0.22 * cols, 0.78 * cols):
+        lane_line_coeff.append(np.array([(bend * cols) / (rows ** 2), (-2 * bend * cols) / rows, base + (bend * cols)]))
+    return tuple(lane_line_coeff)
+
+#render a synthetic bird's eye (warped) rgb road frame for the scenario: asphalt, a solid yellow left line and a white right line (dashed in the dashed scenario),
+#with bands of shadow across the road in the shadowed scenario and heavy pixel noise and speckle in the noisy scenario
+#returns the frame and the coefficients of the lane lines drawn on it
+def generate_synthetic_warped_road_frame(frame_size, scenario, seed=0):
+    cols, rows = frame_size
+    random_generator = np.random.default_rng(seed)
+    #asphalt with a little texture
+    frame = np.clip(random_generator.normal((95, 95, 100), 6, (rows, cols, 3)), 0, 255).astype(np.uint8)
+    left_lane_line_coeff, right_lane_line_coeff = compute_synthetic_lane_line_coefficients(frame_size, scenario)
+    y_samples = np.arange(rows, dtype=np.float64)
+    line_thickness = max(4, cols // 40)
+    for lane_line_coeff, line_color in ((left_lane_line_coeff, (225, 190, 40)), (right_lane_line_coeff, (235, 235, 235))):
+        line_x = (lane_line_coeff[0] * (y_samples ** 2)) + (lane_line_coeff[1] * y_samples) + lane_line_coeff[2]
+        line_points = np.int32(np.round(np.dstack((line_x, y_samples))))
+        #the right line is dashed in the dashed scenario (dash a quarter of the image tall, every half image)
+        if ((scenario == "dashed") and (lane_line_coeff is right_lane_line_coeff)):
+            dash_length = rows // 4
+            for dash_start in range(rows // 8, rows, 2 * dash_length):
+                cv2.polylines(frame, [line_points[:, dash_start:(dash_start + dash_length)]], False, line_color, line_thickness)
+        else:
+            cv2.polylines(frame, [line_points], False, line_color, line_thickness)
+    #tree shadows across the road
+    if (scenario == "shadowed"):
+        for shadow_start, shadow_end in ((0.15, 0.3), (0.55, 0.7)):
+            shadow_rows = slice(int(shadow_start * rows), int(shadow_end * rows))
+            frame[shadow_rows] = (frame[shadow_rows] * 0.45).astype(np.uint8)
+    #sensor noise and bright speckle
+    if (scenario == "noisy"):
+        frame = np.clip(frame + random_generator.normal(0, 25, frame.shape), 0, 255).astype(np.uint8)
+        speckle = random_generator.random((rows, cols)) < 0.005
+        frame[speckle] = 255
+    return (frame, (left_lane_line_coeff, right_lane_line_coeff))
+
+#generate the perspective transform components of a resolution (the reference vertices scaled to it)
+def generate_synthetic_perspective_transform_components(frame_size):
+    scale = np.float32([frame_size[0] / reference_image_size[0], frame_size[1] / reference_image_size[1]])
+    return generate_perspective_transform_components(reference_src_vertices * scale, reference_dest_vertices * scale)
+
+#generate distortion free calibration components for a resolution (a plain pinhole camera)
+def generate_synthetic_calibration_components(frame_size):
+    camera_matrix = np.array([[frame_size[0], 0, frame_size[0] / 2], [0, frame_size[0], frame_size[1] / 2], [0, 0, 1]], dtype=np.float64)
+    return (camera_matrix, np.zeros((1, 5)))
+
+#render a synthetic camera (unwarped) frame by projecting a warped road frame back into the camera's perspective (sky fills the rest)
+def generate_synthetic_camera_frame(warped_frame, perspective_transform_components):
+    return cv2.warpPerspective(warped_frame, perspective_transform_components[1], (warped_frame.shape[1], warped_frame.shape[0]), flags=cv2.INTER_LINEAR,
+                               borderMode=cv2.BORDER_CONSTANT, borderValue=(135, 180, 230))
+
+#render synthetic chessboard calibration images (the same board seen from several angles) into directory, returns their paths
+def generate_synthetic_chessboard_images(directory, image_size=reference_image_size, num_views=6):
+    square_size = 60
+    board = np.full(((num_row_points + 3) * square_size, (num_column_points + 3) * square_size), 255, dtype=np.uint8)
+    for row in range(num_row_points + 1):
+        for col in range(num_column_points + 1):
+            if (((row + col) % 2) == 0):
+                board[((row + 1) * square_size):((row + 2) * square_size), ((col + 1) * square_size):((col + 2) * square_size)] = 0
+    board_corners = np.float32([(0, 0), (board.shape[1], 0), (board.shape[1], board.shape[0]), (0, board.shape[0])])
+    random_generator = np.random.default_rng(1)
+    image_paths = []
+    for view_index in range(num_views):
+        #place the board in the middle of the image, tilted by jittering each of its corners
+        center = np.float32(image_size) / 2
+        half_extent = np.float32((0.3 * image_size[0], 0.3 * image_size[1]))
+        view_corners = np.float32([center + (half_extent * direction) for direction in ((-1, -1), (1, -1), (1, 1), (-1, 1))])
+        view_corners += random_generator.uniform(-0.08, 0.08, (4, 2)).astype(np.float32) * np.float32(image_size)
+        view_homography = cv2.getPerspectiveTransform(board_corners, view_corners)
+        view_image = cv2.warpPerspective(board, view_homography, image_size, flags=cv2.INTER_LINEAR, borderValue=160)
+        image_path = os.path.join(directory, "synthetic_chessboard{0}.png".format(view_index))
+        cv2.imwrite(image_path, view_image)
+        image_paths.append(image_path)
+    return image_paths
+
+#####################
+## TIMING HARNESS  ##
+#####################
+
+#minimum duration of each timed repeat (fast functions are called in a loop until a repeat takes at least this long)
+min_repeat_seconds = 0.005
+
+#time a callable: one (timed) warm up call, then num_repeats timed repeats of as many calls as fill min_repeat_seconds
+#returns the (median, minimum) duration of a single call in milliseconds
+def time_benchmark(benchmark_function, num_repeats):
+    start_time = time.perf_counter()
+    benchmark_function()
+    num_calls_per_repeat = max(1, int(min_repeat_seconds / max(time.perf_counter() - start_time, 1e-9)))
+    call_durations = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        for _ in range(num_calls_per_repeat):
+            benchmark_function()
+        call_durations.append((time.perf_counter() - start_time) / num_calls_per_repeat)
+    return (float(np.median(call_durations)) * 1000, float(np.min(call_durations)) * 1000)
+
+#generate the (name, callable) benchmarks of a resolution
+def generate_resolution_benchmarks(frame_size):
+    resolution_name = "{0}x{1}".format(frame_size[0], frame_size[1])
+    perspective_transform_components = generate_synthetic_perspective_transform_components(frame_size)
+    calibration_components = generate_synthetic_calibration_components(frame_size)
+    benchmarks = []
+
+    #stage inputs for every scenario
+    scenario_inputs = {}
+    for scenario_index, scenario in enumerate(synthetic_road_scenarios):
+        warped_frame, lane_line_coeff = generate_synthetic_warped_road_frame(frame_size, scenario, seed=scenario_index)
+        binary_frame = perform_fused_thresholding(warped_frame)
+        scenario_inputs[scenario] = (warped_frame, lane_line_coeff, binary_frame, generate_synthetic_camera_frame(warped_frame, perspective_transform_components))
+
+    #threshold_processor (color/gradient thresholding on the shadowed frame, the hardest of the common cases)
+    warped_frame, (left_lane_line_coeff, right_lane_line_coeff), binary_frame, camera_frame = scenario_inputs["shadowed"]
+    hls = cv2.cvtColor(warped_frame, cv2.COLOR_RGB2HLS)
+    l_channel = np.ascontiguousarray(hls[:, :, 1])
+    s_channel = np.ascontiguousarray(hls[:, :, 2])
+    search_regions = generate_lane_line_search_regions(warped_frame.shape, left_lane_line_coeff, right_lane_line_coeff, num_strips=4)
+    benchmarks.append(("threshold_processor.perform_thresholding", lambda: perform_thresholding(warped_frame)))
+    benchmarks.append(("threshold_processor.perform_fused_thresholding", lambda: perform_fused_thresholding(warped_frame)))
+    benchmarks.append(("threshold_processor.perform_region_of_interest_thresholding", lambda: perform_region_of_interest_thresholding(warped_frame, search_regions)))
+    benchmarks.append(("threshold_processor.apply_hls_channel_color_thresholding", lambda: apply_hls_channel_color_thresholding(hls[:, :, 0], hls[:, :, 1], hls[:, :, 2])))
+    benchmarks.append(("threshold_processor.apply_l_channel_gradient_thresholding", lambda: apply_l_channel_gradient_thresholding(l_channel)))
+    benchmarks.append(("threshold_processor.apply_s_channel_gradient_and_value_thresholding", lambda: apply_s_channel_gradient_and_value_thresholding(s_channel)))
+    benchmarks.append(("threshold_processor.apply_gradient_filter", lambda: apply_gradient_filter(l_channel, orient='x', threshold=(45, 255))))
+    for strategy in gaussian_blur_strategies:
+        benchmarks.append(("threshold_processor.apply_gaussian_blur/" + strategy, lambda strategy=strategy: apply_gaussian_blur(l_channel, 45, strategy)))
+    benchmarks.append(("threshold_processor.compute_hot_pixel_density_across_x_axis", lambda: compute_hot_pixel_density_across_x_axis(binary_frame, 0, 10)))
+
+    #perspective_processor and calibration_processor (per frame functions)
+    benchmarks.append(("perspective_processor.perform_perspective_transform", lambda: perform_perspective_transform(camera_frame, perspective_transform_components[0])))
+    benchmarks.append(("calibration_processor.perform_undistort", lambda: perform_undistort(camera_frame, calibration_components)))
+
+    #lane_processor (searches on every scenario, the rest on the curved frame)
+    for scenario in synthetic_road_scenarios:
+        _, (scenario_left_lane_line_coeff, scenario_right_lane_line_coeff), scenario_binary_frame, _ = scenario_inputs[scenario]
+        benchmarks.append(("lane_processor.perform_blind_lane_line_pixel_search/" + scenario, lambda scenario_binary_frame=scenario_binary_frame: perform_blind_lane_line_pixel_search(scenario_binary_frame)))
+        benchmarks.append(("lane_processor.perform_educated_lane_line_pixel_search/" + scenario,
+                           lambda scenario_binary_frame=scenario_binary_frame, left_coeff=scenario_left_lane_line_coeff, right_coeff=scenario_right_lane_line_coeff:
+                               perform_educated_lane_line_pixel_search(scenario_binary_frame, left_coeff, right_coeff)))
+    _, (left_lane_line_coeff, right_lane_line_coeff), binary_frame, _ = scenario_inputs["curved"]
+    left_lane_pixel_coordinates, right_lane_pixel_coordinates, _ = perform_educated_lane_line_pixel_search(binary_frame, left_lane_line_coeff, right_lane_line_coeff)
+    benchmarks.append(("lane_processor.generate_hot_pixel_index", lambda: generate_hot_pixel_index(binary_frame)))
+    benchmarks.append(("lane_processor.estimate_index_of_lane_line_base", lambda: estimate_index_of_lane_line_base(binary_frame)))
+    benchmarks.append(("lane_processor.compute_lane_line_coefficients", lambda: compute_lane_line_coefficients(left_lane_pixel_coordinates, right_lane_pixel_coordinates)))
+    benchmarks.append(("lane_processor.compute_curvature_of_lane_lines", lambda: compute_curvature_of_lane_lines(binary_frame.shape, left_lane_line_coeff, right_lane_line_coeff)))
+    benchmarks.append(("lane_processor.compute_vehicle_offset", lambda: compute_vehicle_offset(binary_frame.shape, left_lane_line_coeff, right_lane_line_coeff)))
+    benchmarks.append(("lane_processor.generate_lane_line_search_regions", lambda: generate_lane_line_search_regions(binary_frame.shape, left_lane_line_coeff, right_lane_line_coeff)))
+
+    #end-to-end: per frame cost of a tracker that has already locked on (the first frame's blind search is done before timing)
+    for scenario in synthetic_road_scenarios:
+        scenario_camera_frame = scenario_inputs[scenario][3]
+        lane_tracker = LaneTracker(calibration_components, perspective_transform_components, frame_size)
+        lane_tracker.process_frame(scenario_camera_frame)
+        benchmarks.append(("lane_tracker.process_frame/" + scenario, lambda lane_tracker=lane_tracker, scenario_camera_frame=scenario_camera_frame: lane_tracker.process_frame(scenario_camera_frame)))
+
+    #prefix every benchmark with its resolution
+    return [(resolution_name + "/" + benchmark_name, benchmark_function) for (benchmark_name, benchmark_function) in benchmarks]
+
+#generate the (name, callable) benchmarks of calibration (resolution independent, runs on synthetic chessboards written to directory)
+def generate_calibration_benchmarks(directory):
+    image_paths = generate_synthetic_chessboard_images(directory)
+    detection_results = [detect_chessboard_corners(image_path, num_column_points, num_row_points) for image_path in image_paths]
+    image_points = [corners for (allcornersfound, corners) in detection_results if allcornersfound]
+    path_to_calibration_images = os.path.join(directory, "synthetic_chessboard*.png")
+    path_to_calibration_cache = os.path.join(directory, "calibration_cache.npz")
+    #populate the cache, so the cached benchmark measures a warm start
+    generate_cached_calibration_components(num_column_points, num_row_points, path_to_calibration_images, reference_image_size, path_to_calibration_cache, num_workers=1)
+    return [("calibration/calibration_processor.detect_chessboard_corners", lambda: detect_chessboard_corners(image_paths[0], num_column_points, num_row_points)),
+            ("calibration/calibration_processor.compute_calibration_components", lambda: compute_calibration_components(num_column_points, num_row_points, image_points, reference_image_size)),
+            ("calibration/calibration_processor.generate_cached_calibration_components", lambda: generate_cached_calibration_components(num_column_points, num_row_points, path_to_calibration_images,
+                                                                                                                                         reference_image_size, path_to_calibration_cache, num_workers=1))]
+
+#run every benchmark whose name contains benchmark_filter (all if None), returns {name: {"median_ms", "min_ms"}}
+def execute_benchmarks(frame_sizes=default_benchmark_resolutions, num_repeats=7, benchmark_filter=None):
+    benchmark_results = {}
+    temp_directory = tempfile.mkdtemp(prefix="sdcp4_benchmark_")
+    try:
+        benchmarks = generate_calibration_benchmarks(temp_directory)
+        for frame_size in frame_sizes:
+            benchmarks += generate_resolution_benchmarks(frame_size)
+        for benchmark_name, benchmark_function in benchmarks:
+            if ((benchmark_filter is not None) and (benchmark_filter not in benchmark_name)):
+                continue
+            median_ms, min_ms = time_benchmark(benchmark_function, num_repeats)
+            benchmark_results[benchmark_name] = {"median_ms": median_ms, "min_ms": min_ms}
+            print("{0:<90} {1:>10.3f} ms (min {2:.3f})".format(benchmark_name, median_ms, min_ms))
+    finally:
+        shutil.rmtree(temp_directory, ignore_errors=True)
+    return benchmark_results
+
+###############################
+## PROCESSING SCALE ACCURACY ##
+###############################
+
+#processing scales compared against full resolution by default
+default_accuracy_report_scales = (0.5, 0.25)
+
+#generate the synthetic sequences of the accuracy report: num_frames camera frames of each scenario (the road texture and noise differ from frame to frame)
+#returns [(sequence_name, camera_frames, true_lane_line_coeff)] where the true coefficients are in full resolution warped pixels
+def generate_synthetic_accuracy_sequences(frame_size, perspective_transform_components, num_frames=8):
+    accuracy_sequences = []
+    for scenario_index, scenario in enumerate(synthetic_road_scenarios):
+        camera_frames = []
+        for frame_index in range(num_frames):
+            warped_frame, true_lane_line_coeff = generate_synthetic_warped_road_frame(frame_size, scenario, seed=(1000 * scenario_index) + frame_index)
+            camera_frames.append(generate_synthetic_camera_frame(warped_frame, perspective_transform_components))
+        accuracy_sequences.append((scenario, camera_frames, np.stack(true_lane_line_coeff)))
+    return accuracy_sequences
+
+#read up to max_frames frames of a video as an accuracy report sequence (no ground truth)
+def read_video_accuracy_sequence(path_to_video, max_frames=100):
+    frame_source = generate_frame_source(path_to_video)
+    try:
+        camera_frames = []
+        frame = frame_source[2]()
+        while ((frame is not None) and (len(camera_frames) < max_frames)):
+            camera_frames.append(np.array(frame))
+            frame = frame_source[2]()
+    finally:
+        frame_source[3]()
+    return (os.path.basename(path_to_video), camera_frames, None)
+
+#track a sequence of camera frames at a processing scale, returns the lane estimate drawn on each frame (see LaneTracker.last_lane_estimate)
+#and the mean time per frame in milliseconds
+def track_accuracy_sequence(camera_frames, calibration_components, perspective_transform_components, processing_scale, use_motion_model=False):
+    frame_size = (camera_frames[0].shape[1], camera_frames[0].shape[0])
+    lane_tracker = LaneTracker(calibration_components, perspective_transform_components, frame_size, use_motion_model=use_motion_model, processing_scale=processing_scale)
+    lane_estimates = []
+    start_time = time.perf_counter()
+    for camera_frame in camera_frames:
+        lane_tracker.process_frame(camera_frame)
+        lane_estimates.append(lane_tracker.last_lane_estimate)
+    return (lane_estimates, ((time.perf_counter() - start_time) / len(camera_frames)) * 1000)
+
+#compare the lane estimates of a sequence tracked at each processing scale with the same sequence tracked at full resolution
+#lane line error is the mean horizontal distance between the two estimates of a lane line down the height of the image (full resolution warped pixels,
+#the worse of the two lane lines on each frame), curvature error is relative and offset error is in meters, when the true lane lines are known
+#(synthetic sequences) each scale's lane line error against them is reported too
+#returns {sequence_name: {scale: metrics}} and prints a table of it
+def generate_processing_scale_accuracy_report(accuracy_sequences, calibration_components, perspective_transform_components, processing_scales=default_accuracy_report_scales, use_motion_model=False):
+    accuracy_report = {}
+    print("{0:<24} {1:>6} {2:>10} {3:>8} {4:>14} {5:>13} {6:>13} {7:>12} {8:>11}".format("sequence", "scale", "ms/frame", "speedup", "line err mean", "line err max", "curvature err", "offset err", "truth err"))
+    for sequence_name, camera_frames, true_lane_line_coeff in accuracy_sequences:
+        image_height = camera_frames[0].shape[0]
+        full_lane_estimates, full_ms_per_frame = track_accuracy_sequence(camera_frames, calibration_components, perspective_transform_components, 1.0, use_motion_model)
+        sequence_report = {}
+        for processing_scale in (1.0,) + tuple(processing_scales):
+            if (processing_scale == 1.0):
+                lane_estimates, ms_per_frame = (full_lane_estimates, full_ms_per_frame)
+            else:
+                lane_estimates, ms_per_frame = track_accuracy_sequence(camera_frames, calibration_components, perspective_transform_components, processing_scale, use_motion_model)
+            lane_line_errors = np.array([np.max(compute_lane_line_displacement(image_height, np.stack(lane_estimate[:2]), np.stack(full_lane_estimate[:2])))
+                                         for (lane_estimate, full_lane_estimate) in zip(lane_estimates, full_lane_estimates)])
+            curvature_errors = np.array([abs(lane_estimate[2] - full_lane_estimate[2]) / full_lane_estimate[2] for (lane_estimate, full_lane_estimate) in zip(lane_estimates, full_lane_estimates)])
+            offset_errors = np.array([abs(lane_estimate[3] - full_lane_estimate[3]) for (lane_estimate, full_lane_estimate) in zip(lane_estimates, full_lane_estimates)])
+            scale_report = {"ms_per_frame": ms_per_frame, "speedup": full_ms_per_frame / ms_per_frame,
+                            "lane_line_error_mean_px": float(np.mean(lane_line_errors)), "lane_line_error_max_px": float(np.max(lane_line_errors)),
+                            "curvature_error_median": float(np.median(curvature_errors)), "offset_error_mean_m": float(np.mean(offset_errors))}
+            if (true_lane_line_coeff is not None):
+                scale_report["truth_lane_line_error_mean_px"] = float(np.mean([np.max(compute_lane_line_displacement(image_height, np.stack(lane_estimate[:2]), true_lane_line_coeff))
+                                                                               for lane_estimate in lane_estimates]))
+            sequence_report[processing_scale] = scale_report
+            print("{0:<24} {1:>6.3g} {2:>10.2f} {3:>7.2f}x {4:>11.2f} px {5:>10.2f} px {6:>13.2%} {7:>10.3f} m {8:>11}".format(
+                sequence_name, processing_scale, ms_per_frame, scale_report["speedup"], scale_report["lane_line_error_mean_px"], scale_report["lane_line_error_max_px"],
+                scale_report["curvature_error_median"], scale_report["offset_error_mean_m"],
+                "{0:.2f} px".format(scale_report["truth_lane_line_error_mean_px"]) if ("truth_lane_line_error_mean_px" in scale_report) else "-"))
+        accuracy_report[sequence_name] = sequence_report
+    return accuracy_report
+
+######################
+## ALLOCATION CHECK ##
+######################
+
+#stages whose working arrays are image sized and come from the stream's buffer pool (these must not allocate an image sized array once warmed up)
+#the searches and the fit allocate in proportion to the number of hot pixels instead, so they're reported but not checked
+#(the stateless stages are traced as a group and attributed to undistort, see StageAllocations)
+buffer_pooled_stages = ("undistort", "warp", "threshold", "smoothing", "curvature_offset", "render")
+
+#stages that allocate an image sized array on every frame without a buffer pool (if tracing an unpooled tracker doesn't see them, the measurement
+#itself is broken, and a clean pooled result would prove nothing)
+unpooled_allocating_stages = ("undistort", "warp", "threshold")
+
+#track num_frames frames of every synthetic scenario with a buffer pooled tracker (or an unpooled one, for comparison) while tracing allocations
+#an allocation is large if it's at least the size of one full resolution image plane (rows x cols bytes), and the first num_warm_up_frames frames
+#of each scenario are skipped (they fill the pool and the output ring)
+#returns {stage name: (frames with a large allocation, max peak bytes)} over every scenario
+#raises a RuntimeError if an unpooled tracker's unpooled_allocating_stages are measured without a large allocation on every frame
+def measure_steady_state_allocations(frame_size, num_frames=16, num_warm_up_frames=4, use_region_of_interest_thresholding=False, use_buffer_pool=True):
+    perspective_transform_components = generate_synthetic_perspective_transform_components(frame_size)
+    calibration_components = generate_synthetic_calibration_components(frame_size)
+    accuracy_sequences = generate_synthetic_accuracy_sequences(frame_size, perspective_transform_components, num_frames)
+    large_allocation_bytes = frame_size[0] * frame_size[1]
+    large_allocation_counts = {}
+    for _, camera_frames, _ in accuracy_sequences:
+        stage_allocations = StageAllocations(len(camera_frames))
+        try:
+            lane_tracker = LaneTracker(calibration_components, perspective_transform_components, frame_size, use_region_of_interest_thresholding=use_region_of_interest_thresholding,
+                                       stage_timings=stage_allocations, buffer_pool=(FrameBufferPool(num_output_buffers=2) if use_buffer_pool else None))
+            for camera_frame in camera_frames:
+                stage_allocations.start_stage_trace()
+                lane_tracker.process_frame(camera_frame)
+        finally:
+            stage_allocations.finish()
+        #combine with the previous scenarios
+        for stage_name, (num_large_allocations, max_peak_bytes) in stage_allocations.count_large_allocations(large_allocation_bytes, num_warm_up_frames).items():
+            prev_num_large_allocations, prev_max_peak_bytes = large_allocation_counts.get(stage_name, (0, 0))
+            large_allocation_counts[stage_name] = (prev_num_large_allocations + num_large_allocations, max(prev_max_peak_bytes, max_peak_bytes))
+    if (not use_buffer_pool):
+        num_measured_frames = len(accuracy_sequences) * max(num_frames - num_warm_up_frames, 0)
+        undetected_stages = [stage_name for stage_name in unpooled_allocating_stages if (large_allocation_counts.get(stage_name, (0, 0))[0] < num_measured_frames)]
+        if (len(undetected_stages) > 0):
+            raise RuntimeError("image sized allocations of unpooled stages weren't detected: {0}".format(", ".join(undetected_stages)))
+    return large_allocation_counts
+
+#check that steady state frames make no image sized allocation in the buffer pooled stages, at each resolution with and without region of interest thresholding
+#(the same frames tracked without a buffer pool are printed alongside for comparison), returns the number of failed stages and prints a table of them
+def execute_allocation_check(frame_sizes=default_benchmark_resolutions, num_frames=16, num_warm_up_frames=4):
+    num_failed_stages = 0
+    print("{0:<34} {1:<18} {2:>12} {3:>14} {4:>16} {5:>6}".format("configuration", "stage", "large allocs", "max peak", "unpooled peak", ""))
+    for frame_size in frame_sizes:
+        for use_region_of_interest_thresholding in (False, True):
+            configuration_name = "{0}x{1}{2}".format(frame_size[0], frame_size[1], "/region_of_interest" if use_region_of_interest_thresholding else "")
+            pooled_allocation_counts = measure_steady_state_allocations(frame_size, num_frames, num_warm_up_frames, use_region_of_interest_thresholding, use_buffer_pool=True)
+            unpooled_allocation_counts = measure_steady_state_allocations(frame_size, num_frames, num_warm_up_frames, use_region_of_interest_thresholding, use_buffer_pool=False)
+            for stage_name, (num_large_allocations, max_peak_bytes) in pooled_allocation_counts.items():
+                is_checked = (stage_name in buffer_pooled_stages)
+                has_failed = (is_checked and (num_large_allocations > 0))
+                num_failed_stages += int(has_failed)
+                print("{0:<34} {1:<18} {2:>12} {3:>11.1f} KiB {4:>12.1f} KiB {5:>6}".format(configuration_name, stage_name, num_large_allocations, max_peak_bytes / 1024,
+                                                                                          unpooled_allocation_counts.get(stage_name, (0, 0))[1] / 1024,
+                                                                                          ("FAIL" if has_failed else "ok") if is_checked else "-"))
+    return num_failed_stages
+
+##########################
+## IMPORT BUDGET CHECK  ##
+##########################
+
+#the core detection path (thresholding, searching, fitting and tracking) may import only numpy and opencv (plus the standard library and this project)
+core_detection_modules = ("packed_mask", "buffer_pool", "fit_processor", "geometry_processor", "threshold_processor", "lane_processor", "lane_motion_model", "overlay_processor", "lane_tracker")
+core_detection_dependencies = ("numpy", "cv2")
+
+#entry points may import more, but never the dependencies only video i/o, plotting and diagnostics need (those are imported when first used)
+entry_point_modules = ("production_pipeline", "lane_service", "batch_processor", "stage_cache", "parameter_sweep", "test_pipeline", "main", "lane_telemetry")
+deferred_dependencies = ("moviepy", "imageio", "imageio_ffmpeg", "matplotlib", "PIL", "tqdm", "scipy")
+
+#import budget of a single module (seconds, in a fresh interpreter, including numpy and opencv)
+default_import_budget_seconds = 0.5
+
+#run in a fresh interpreter to import a module, prints [seconds taken, top level packages imported] as json
+#(only packages loaded from files are listed, not the in-memory modules extensions register, e.g., cython_runtime)
+import_probe_script = """
+import sys, time, json, importlib
+preloaded_modules = set(sys.modules)
+start_time = time.perf_counter()
+importlib.import_module(sys.argv[1])
+import_seconds = time.perf_counter() - start_time
+imported_packages = set(module_name.split('.')[0] for module_name in set(sys.modules) - preloaded_modules)
+print(json.dumps([import_seconds, sorted(package for package in imported_packages if getattr(sys.modules.get(package), '__file__', None) is not None)]))
+"""
+
+#import a module of this project in a fresh interpreter (so nothing is already loaded), returns (seconds taken, third party packages imported)
+#packages of the standard library and modules of this project aren't counted
+def measure_module_import(module_name):
+    project_directory = os.path.dirname(os.path.abspath(__file__))
+    probe_output = subprocess.run([sys.executable, "-c", import_probe_script, module_name], cwd=project_directory, check=True, capture_output=True, text=True).stdout
+    import_seconds, imported_packages = json.loads(probe_output.splitlines()[-1])
+    project_modules = set(os.path.splitext(file_name)[0] for file_name in os.listdir(project_directory) if file_name.endswith(".py"))
+    return (import_seconds, [package for package in imported_packages if ((package not in sys.stdlib_module_names) and (package not in project_modules) and (not package.startswith("_")))])
+
+#check that the core detection modules import nothing beyond numpy and opencv, that no entry point imports a deferred dependency, and that every
+#module imports within import_budget_seconds, returns the number of failed modules and prints a table of them
+def execute_import_check(import_budget_seconds=default_import_budget_seconds):
+    num_failed_modules = 0
+    print("{0:<22} {1:>10} {2:<40} {3:>6}".format("module", "import ms", "third party packages", ""))
+    for module_name in core_detection_modules + entry_point_modules:
+        import_seconds, imported_packages = measure_module_import(module_name)
+        if (module_name in core_detection_modules):
+            disallowed_packages = [package for package in imported_packages if (package not in core_detection_dependencies)]
+        else:
+            disallowed_packages = [package for package in imported_packages if (package in deferred_dependencies)]
+        has_failed = ((len(disallowed_packages) > 0) or (import_seconds > import_budget_seconds))
+        num_failed_modules += int(has_failed)
+        print("{0:<22} {1:>10.1f} {2:<40} {3:>6}".format(module_name, import_seconds * 1000, ", ".join(imported_packages), "FAIL" if has_failed else "ok"))
+        if (len(disallowed_packages) > 0):
+            print("    imports {0}".format(", ".join(disallowed_packages)))
+    return num_failed_modules
+
+#######################
+## BASELINE CHECKING ##
+#######################
+
+#baselines and regressions use the fastest repeat of each benchmark (the least disturbed by anything else running on the machine)
+
+#load recorded baselines ({name: min_ms}), returns None if there are none
+def load_benchmark_baselines(path_to_baselines):
+    if (not os.path.isfile(path_to_baselines)):
+        return None
+    with open(path_to_baselines, "r") as baselines_file:
+        return json.load(baselines_file)["benchmarks"]
+
+#record the fastest repeat of each benchmark as its baseline (merged into any existing baselines, so a filtered run only updates what it ran)
+def save_benchmark_baselines(path_to_baselines, benchmark_results):
+    benchmark_baselines = load_benchmark_baselines(path_to_baselines) or {}
+    benchmark_baselines.update({benchmark_name: benchmark_result["min_ms"] for (benchmark_name, benchmark_result) in benchmark_results.items()})
+    with open(path_to_baselines, "w") as baselines_file:
+        json.dump({"machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__},
+                   "benchmarks": benchmark_baselines}, baselines_file, indent=2, sort_keys=True)
+
+#compare results to baselines, a benchmark regresses when its fastest repeat exceeds baseline * (1 + tolerance) + min_regression_ms
+#(the absolute allowance keeps timer noise on microsecond scale functions from failing the run)
+#returns (names of regressed benchmarks, names of benchmarks without a baseline)
+def find_benchmark_regressions(benchmark_results, benchmark_baselines, tolerance, min_regression_ms):
+    regressed_benchmarks = []
+    unbaselined_benchmarks = []
+    for benchmark_name, benchmark_result in sorted(benchmark_results.items()):
+        baseline_ms = benchmark_baselines.get(benchmark_name)
+        if (baseline_ms is None):
+            unbaselined_benchmarks.append(benchmark_name)
+            print("NO BASELINE {0}".format(benchmark_name))
+            continue
+        if (benchmark_result["min_ms"] > ((baseline_ms * (1 + tolerance)) + min_regression_ms)):
+            regressed_benchmarks.append(benchmark_name)
+            print("REGRESSION {0}: {1:.3f} ms vs baseline {2:.3f} ms ({3:+.0f}%)".format(benchmark_name, benchmark_result["min_ms"], baseline_ms, 100 * ((benchmark_result["min_ms"] / baseline_ms) - 1)))
+    return (regressed_benchmarks, unbaselined_benchmarks)
+
+#parse a resolution argument, e.g. 1280x720
+def parse_resolution(resolution):
+    cols, rows = resolution.lower().split("x")
+    return (int(cols), int(rows))
+
+#run the benchmark command, returns the exit code (0 when nothing regressed)
+def execute_benchmark_command(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic frames and check them against recorded baselines.")
+    parser.add_argument("--baselines", default="benchmark_baselines.json", help="baseline file to check against (or update)")
+    parser.add_argument("--update-baselines", action="store_true", help="record this run as the baselines instead of checking against them")
+    parser.add_argument("--allow-missing-baselines", action="store_true", help="pass when the baseline file is missing or has no baseline for some benchmarks (only recorded ones are checked)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown relative to the baseline (0.25 = 25%%)")
+    parser.add_argument("--min-regression-ms", type=float, default=0.05, help="absolute slowdown always allowed (absorbs timer noise)")
+    parser.add_argument("--repeats", type=int, default=7, help="timed repeats per benchmark (the median and fastest are reported, the fastest is checked)")
+    parser.add_argument("--resolutions", type=parse_resolution, nargs="+", default=list(default_benchmark_resolutions), help="resolutions to benchmark, e.g. 1280x720")
+    parser.add_argument("--filter", default=None, help="only run benchmarks whose name contains this")
+    parser.add_argument("--blur-strategy", default=threshold_processor.gaussian_blur_strategy, choices=gaussian_blur_strategies, help="blur strategy of the pipeline benchmarks")
+    parser.add_argument("--accuracy-report", action="store_true", help="report lane estimate accuracy at reduced processing scales (vs full resolution) instead of benchmarking")
+    parser.add_argument("--accuracy-scales", type=float, nargs="+", default=list(default_accuracy_report_scales), help="processing scales compared with full resolution")
+    parser.add_argument("--accuracy-frames", type=int, default=8, help="frames tracked per synthetic scenario (or the most frames read from --accuracy-video)")
+    parser.add_argument("--accuracy-video", default=None, help="also report on this video (tracked with the calibration and perspective transform in main)")
+    parser.add_argument("--motion-model", action="store_true", help="track with the motion model in the accuracy report")
+    parser.add_argument("--allocation-check", action="store_true", help="check that steady state frames make no image sized allocation in the buffer pooled stages instead of benchmarking")
+    parser.add_argument("--import-check", action="store_true", help="check that the detection path imports only numpy and opencv, and each module imports within budget, instead of benchmarking")
+    parser.add_argument("--import-budget-ms", type=float, default=default_import_budget_seconds * 1000, help="import budget of each module in the import check")
+    arguments = parser.parse_args(argv)
+
+    threshold_processor.set_gaussian_blur_strategy(arguments.blur_strategy)
+    if (arguments.accuracy_report):
+        perspective_transform_components = generate_synthetic_perspective_transform_components(reference_image_size)
+        generate_processing_scale_accuracy_report(generate_synthetic_accuracy_sequences(reference_image_size, perspective_transform_components, arguments.accuracy_frames),
+                                                  generate_synthetic_calibration_components(reference_image_size), perspective_transform_components, arguments.accuracy_scales, arguments.motion_model)
+        if (arguments.accuracy_video is not None):
+            #(imported here as only a real video needs the real camera calibration)
+            import main
+            generate_processing_scale_accuracy_report([read_video_accuracy_sequence(arguments.accuracy_video, arguments.accuracy_frames)], main.generate_camera_calibration_components(),
+                                                      main.generate_road_perspective_transform_components(), arguments.accuracy_scales, arguments.motion_model)
+        return 0
+    if (arguments.allocation_check):
+        num_failed_stages = execute_allocation_check(arguments.resolutions)
+        print("{0} buffer pooled stages made image sized allocations".format(num_failed_stages))
+        return (1 if (num_failed_stages > 0) else 0)
+    if (arguments.import_check):
+        num_failed_modules = execute_import_check(arguments.import_budget_ms / 1000)
+        print("{0} modules failed the import check".format(num_failed_modules))
+        return (1 if (num_failed_modules > 0) else 0)
+    benchmark_results = execute_benchmarks(arguments.resolutions, arguments.repeats, arguments.filter)
+    if (arguments.update_baselines):
+        save_benchmark_baselines(arguments.baselines, benchmark_results)
+        print("baselines saved to {0}".format(arguments.baselines))
+        return 0
+    benchmark_baselines = load_benchmark_baselines(arguments.baselines)
+    #a benchmark without a baseline isn't checked, so a missing or incomplete baseline file fails the run unless that's explicitly allowed
+    if (benchmark_baselines is None):
+        print("no baselines at {0} (run with --update-baselines to record them)".format(arguments.baselines))
+        return (0 if (arguments.allow_missing_baselines) else 1)
+    regressed_benchmarks, unbaselined_benchmarks = find_benchmark_regressions(benchmark_results, benchmark_baselines, arguments.tolerance, arguments.min_regression_ms)
+    print("{0} of {1} benchmarks regressed, {2} have no baseline".format(len(regressed_benchmarks), len(benchmark_results), len(unbaselined_benchmarks)))
+    if ((len(unbaselined_benchmarks) > 0) and (not arguments.allow_missing_baselines)):
+        print("record the missing baselines with --update-baselines (or pass --allow-missing-baselines)")
+        return 1
+    return (1 if (len(regressed_benchmarks) > 0) else 0)
+
+if __name__ == "__main__":
+    sys.exit(execute_benchmark_command())
\ No newline at end of file
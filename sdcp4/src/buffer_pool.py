@@ -0,0 +1,71 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import numpy as np
+
+#the working arrays of a stream's frames (hls channels, gradients, masks, the warped image...) are the same size on every frame, so rather than
+#allocating them afresh on every frame (allocator churn and page faults show up directly in tail latency), each stream keeps a pool of them
+#stage functions accept an optional buffer pool and take each of their working arrays from it by name (writing into them with dst= / out=),
+#without a pool they allocate exactly as before (e.g., in worker processes, whose results are shipped back to the stream anyway)
+
+#a pool of named working arrays owned by a single stream (it's not thread safe, and buffers are only valid until the same name is next retrieved)
+#each name is backed by a flat byte buffer that only grows (to half again the size needed, once it has to grow at all), so a name used at several
+#shapes (e.g., the region of interest mosaic, which varies from frame to frame and can be larger than the frame) settles after a few frames and stops allocating
+#frames returned to the caller (the undistorted image the lane is drawn onto) can't be reused on the next frame as they may still be waiting to be
+#encoded, so they come from a ring of num_output_buffers buffers instead, which must cover every frame the caller holds on to at once
+class FrameBufferPool:
+    __slots__ = ("buffers", "output_buffers", "next_output_buffer_index", "num_buffers_allocated")
+
+    def __init__(self, num_output_buffers=2):
+        #buffer name --> flat byte buffer
+        self.buffers = {}
+        #ring of output frames (None until first used, or when the frame shape changes)
+        self.output_buffers = [None] * max(num_output_buffers, 1)
+        self.next_output_buffer_index = 0
+        #number of buffers allocated over the life of the pool (flat in the steady state)
+        self.num_buffers_allocated = 0
+
+    #retrieve the working array of the supplied name, shape and dtype (its contents are whatever was last written to it)
+    #names whose shape varies from frame to frame can supply a reserve_shape, the size they're typically bounded by, to allocate up front
+    def retrieve_buffer(self, buffer_name, shape, dtype=np.uint8, reserve_shape=None):
+        dtype = np.dtype(dtype)
+        num_bytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        flat_buffer = self.buffers.get(buffer_name)
+        if ((flat_buffer is None) or (len(flat_buffer) < num_bytes)):
+            num_reserved_bytes = 0 if (reserve_shape is None) else (int(np.prod(reserve_shape, dtype=np.int64)) * dtype.itemsize)
+            flat_buffer = np.empty(max(num_bytes if (flat_buffer is None) else (num_bytes + (num_bytes // 2)), num_reserved_bytes), dtype=np.uint8)
+            self.buffers[buffer_name] = flat_buffer
+            self.num_buffers_allocated += 1
+        return flat_buffer[:num_bytes].view(dtype).reshape(shape)
+
+    #retrieve the next output frame of the ring (its contents are a frame returned num_output_buffers frames ago)
+    def retrieve_output_buffer(self, shape, dtype=np.uint8):
+        output_buffer = self.output_buffers[self.next_output_buffer_index]
+        if ((output_buffer is None) or (output_buffer.shape != tuple(shape)) or (output_buffer.dtype != dtype)):
+            output_buffer = np.empty(shape, dtype=dtype)
+            self.output_buffers[self.next_output_buffer_index] = output_buffer
+            self.num_buffers_allocated += 1
+        self.next_output_buffer_index = (self.next_output_buffer_index + 1) % len(self.output_buffers)
+        return output_buffer
+
+    #total size (in bytes) of the buffers held by the pool
+    def compute_pool_size(self):
+        return sum(len(flat_buffer) for flat_buffer in self.buffers.values()) + sum(output_buffer.nbytes for output_buffer in self.output_buffers if (output_buffer is not None))
+
+#retrieve a working array from the supplied buffer pool, or allocate a new one when there's no pool
+def retrieve_frame_buffer(buffer_pool, buffer_name, shape, dtype=np.uint8, reserve_shape=None):
+    if (buffer_pool is None):
+        return np.empty(shape, dtype=dtype)
+    return buffer_pool.retrieve_buffer(buffer_name, shape, dtype, reserve_shape)
+
+#retrieve an output frame from the supplied buffer pool's ring, or allocate a new one when there's no pool
+def retrieve_output_frame_buffer(buffer_pool, shape, dtype=np.uint8):
+    if (buffer_pool is None):
+        return np.empty(shape, dtype=dtype)
+    return buffer_pool.retrieve_output_buffer(shape, dtype)
\ No newline at end of file
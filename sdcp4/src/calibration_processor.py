@@ -8,41 +8,147 @@
 ## IMPORTS ##
 #############
 import numpy as np
-import matplotlib.image as mpimg
 import glob
+import hashlib
+import os
 import cv2
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
-#generate calibration camera matrix and distortion coefficients based on supplied chessboard dimensions and chessboard calibration images
-#http://opencv-python-tutroals.readthedocs.io/en/latest/py_tutorials/py_calib3d/py_calibration/py_calibration.html
-def generate_calibration_components(num_column_points, num_row_points, path_to_calibration_images, camera_image_size): 
-    #lists to store object/image points for all calibration images
-    calibration_object_points = [] #3d points in real world space
-    calibration_image_points = []  #2d points on the image plane
+#version of the on-disk calibration cache layout (bump whenever the layout or the corner detection changes so stale caches are ignored)
+calibration_cache_version = 1
+
+#find the inside corners of the chessboard in a single calibration image (runs inside a worker process)
+#returns a tuple of (allcornersfound, corners), corners is zero filled when the full pattern wasn't found so every image yields the same shape
+def detect_chessboard_corners(calibration_image_file_path, num_column_points, num_row_points):
+    #load image located at calibration_image_file_path (opencv loads as bgr)
+    calibration_image = cv2.imread(calibration_image_file_path)
+    #convert image to grayscale
+    calibration_image_grayscale = cv2.cvtColor(calibration_image, cv2.COLOR_BGR2GRAY)
+    #find image points (inside corners of chessboard) for calibration_image_grayscale
+    allcornersfound, corners = cv2.findChessboardCorners(calibration_image_grayscale, (num_column_points, num_row_points), None)
+    #if not all internal corners were found, substitute an empty corner set
+    if (not allcornersfound):
+        corners = np.zeros(((num_column_points * num_row_points), 1, 2), dtype=np.float32)
+    #return result
+    return (allcornersfound, corners)
+
+#find the inside corners of the chessboard in each supplied calibration image, spreading the images across a process pool
+def detect_chessboard_corners_in_parallel(calibration_image_file_path_list, num_column_points, num_row_points, num_workers=None):
+    #nothing to do
+    if (len(calibration_image_file_path_list) == 0):
+        return []
+    #a single image isn't worth the cost of starting a pool
+    if (len(calibration_image_file_path_list) == 1):
+        return [detect_chessboard_corners(calibration_image_file_path_list[0], num_column_points, num_row_points)]
+    #decode and search each image in its own worker (results are returned in the same order as the supplied file path list)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        return list(executor.map(detect_chessboard_corners, calibration_image_file_path_list, repeat(num_column_points), repeat(num_row_points)))
+
+#derive the camera matrix and distortion coefficients from the image points found in each calibration image
+def compute_calibration_components(num_column_points, num_row_points, calibration_image_points, camera_image_size):
     #a matrix of 3d coordinate values (each row holds an (x, y, z) point with each column being x, y, or z)
     #z will stay 0 since the chessboard is a plane, but we'll generate the x and y coordinates automatically (must be float coordinate points)
     calibration_object_points_template = np.mgrid[0:num_column_points, 0:num_row_points, 0:1].T.reshape(-1, 3).astype(np.float32)
-    #load calibration image file path list (file paths to images of chessboards to calibrate from) 
-    calibration_image_file_path_list = glob.glob(path_to_calibration_images)
-    #enumerate calibration image file path list, loading each image, converting to grayscale, then retrieving inside corner points
-    for cur_calibration_image_file_path in calibration_image_file_path_list:
-        #load image located at cur_calibration_image_file_path
-        cur_calibration_image = mpimg.imread(cur_calibration_image_file_path)
-        #convert image to grayscale
-        cur_calibration_image_grayscale = cv2.cvtColor(cur_calibration_image, cv2.COLOR_RGB2GRAY)
-        #find image points (inside corners of chessboard) for cur_calibration_image_grayscale
-        allcornersfound, corners = cv2.findChessboardCorners(cur_calibration_image_grayscale, (num_column_points, num_row_points), None)
-        #if all internal corners where found (valid chessboard pattern displaying all internal corners)
-        if (allcornersfound):
-            #add image points found for cur_calibration_image_grayscale to image_points list
-            calibration_image_points.append(corners)
-            #add associated objects points for this calibrations image (same for all calibration images)
-            calibration_object_points.append(calibration_object_points_template)
+    #associated objects points for each calibration image (same for all calibration images)
+    calibration_object_points = [calibration_object_points_template] * len(calibration_image_points)
     #derive camera matrix (needed to transform 3d object points to 2d image points) and distortion coefficients
     #based on image and object points derived from calibration images taken on that same camera
     _, camera_matrix, distortion_coeff, _, _ = cv2.calibrateCamera(calibration_object_points, calibration_image_points, camera_image_size, None, None)
     #return components
     return (camera_matrix, distortion_coeff)
 
+#generate calibration camera matrix and distortion coefficients based on supplied chessboard dimensions and chessboard calibration images
+#http://opencv-python-tutroals.readthedocs.io/en/latest/py_tutorials/py_calib3d/py_calibration/py_calibration.html
+def generate_calibration_components(num_column_points, num_row_points, path_to_calibration_images, camera_image_size, num_workers=None): 
+    #load calibration image file path list (file paths to images of chessboards to calibrate from) 
+    calibration_image_file_path_list = sorted(glob.glob(path_to_calibration_images))
+    #retrieve inside corner points for every calibration image
+    detection_results = detect_chessboard_corners_in_parallel(calibration_image_file_path_list, num_column_points, num_row_points, num_workers)
+    #only keep image points for images where all internal corners were found (valid chessboard pattern displaying all internal corners)
+    calibration_image_points = [corners for (allcornersfound, corners) in detection_results if allcornersfound]
+    #return components
+    return compute_calibration_components(num_column_points, num_row_points, calibration_image_points, camera_image_size)
+
+#compute a content hash of a calibration image file (so renamed or touched files don't invalidate the cache, but edited ones do)
+def compute_calibration_image_hash(calibration_image_file_path):
+    with open(calibration_image_file_path, "rb") as file_handle:
+        return hashlib.sha1(file_handle.read()).hexdigest()
+
+#compute the key identifying a calibration run (cache layout version + board dimensions + image size + the content of every calibration image)
+def compute_calibration_cache_key(num_column_points, num_row_points, camera_image_size, calibration_image_hashes):
+    key_source = "{0}|{1}x{2}|{3}x{4}|{5}".format(calibration_cache_version, num_column_points, num_row_points, camera_image_size[0], camera_image_size[1], ",".join(sorted(calibration_image_hashes)))
+    return hashlib.sha1(key_source.encode("ascii")).hexdigest()
+
+#load a previously saved calibration cache, returns None if there is no cache or it was written by a different cache version
+def load_calibration_cache(path_to_calibration_cache):
+    #no cache yet
+    if (not os.path.isfile(path_to_calibration_cache)):
+        return None
+    #load all arrays up front (the file is small) so the handle can be closed immediately
+    try:
+        with np.load(path_to_calibration_cache) as cache_file:
+            calibration_cache = {name: cache_file[name] for name in cache_file.files}
+    except (OSError, ValueError):
+        #unreadable/corrupt cache, treat it as missing (it will be rewritten)
+        return None
+    #ignore caches written with a different layout
+    if (int(calibration_cache["version"]) != calibration_cache_version):
+        return None
+    #return cache contents
+    return calibration_cache
+
+#save the calibration components and per-image corner sets to the cache file (written to a temp file first so a crash can't leave a partial cache behind)
+def save_calibration_cache(path_to_calibration_cache, cache_key, num_column_points, num_row_points, calibration_image_hashes, calibration_corners_found, calibration_corners, calibration_components):
+    temp_path_to_calibration_cache = path_to_calibration_cache + ".tmp"
+    with open(temp_path_to_calibration_cache, "wb") as file_handle:
+        np.savez(file_handle,
+                 version=np.int64(calibration_cache_version),
+                 cache_key=np.array(cache_key),
+                 board_dimensions=np.array([num_column_points, num_row_points]),
+                 image_hashes=np.array(calibration_image_hashes),
+                 corners_found=np.array(calibration_corners_found, dtype=bool),
+                 corners=np.array(calibration_corners, dtype=np.float32).reshape(len(calibration_image_hashes), (num_column_points * num_row_points), 1, 2),
+                 camera_matrix=calibration_components[0],
+                 distortion_coeff=calibration_components[1])
+    os.replace(temp_path_to_calibration_cache, path_to_calibration_cache)
+
+#generate calibration components, reusing the on-disk cache where possible
+#if the calibration images and board dimensions haven't changed, the camera matrix and distortion coefficients are loaded directly from the cache
+#otherwise corners are only detected for images not already in the cache, then calibration is re-run and the cache is rewritten
+def generate_cached_calibration_components(num_column_points, num_row_points, path_to_calibration_images, camera_image_size, path_to_calibration_cache, num_workers=None):
+    #load calibration image file path list (file paths to images of chessboards to calibrate from) 
+    calibration_image_file_path_list = sorted(glob.glob(path_to_calibration_images))
+    #hash the content of each calibration image
+    calibration_image_hashes = [compute_calibration_image_hash(cur_calibration_image_file_path) for cur_calibration_image_file_path in calibration_image_file_path_list]
+    #compute the key for this calibration run
+    cache_key = compute_calibration_cache_key(num_column_points, num_row_points, camera_image_size, calibration_image_hashes)
+    #load existing cache (if any)
+    calibration_cache = load_calibration_cache(path_to_calibration_cache)
+    #if the cache was built from exactly this calibration run, we're done
+    if ((calibration_cache is not None) and (str(calibration_cache["cache_key"]) == cache_key)):
+        return (calibration_cache["camera_matrix"], calibration_cache["distortion_coeff"])
+    #collect the corner sets already known for each image hash (only valid if the board dimensions match)
+    cached_detection_results = {}
+    if ((calibration_cache is not None) and (tuple(calibration_cache["board_dimensions"]) == (num_column_points, num_row_points))):
+        for cur_image_hash, cur_corners_found, cur_corners in zip(calibration_cache["image_hashes"], calibration_cache["corners_found"], calibration_cache["corners"]):
+            cached_detection_results[str(cur_image_hash)] = (bool(cur_corners_found), cur_corners)
+    #detect corners for the images that aren't in the cache
+    uncached_image_list = [(cur_file_path, cur_image_hash) for cur_file_path, cur_image_hash in zip(calibration_image_file_path_list, calibration_image_hashes) if cur_image_hash not in cached_detection_results]
+    uncached_detection_results = detect_chessboard_corners_in_parallel([cur_file_path for (cur_file_path, _) in uncached_image_list], num_column_points, num_row_points, num_workers)
+    for (_, cur_image_hash), cur_detection_result in zip(uncached_image_list, uncached_detection_results):
+        cached_detection_results[cur_image_hash] = cur_detection_result
+    #assemble detection results in file path order
+    detection_results = [cached_detection_results[cur_image_hash] for cur_image_hash in calibration_image_hashes]
+    #only keep image points for images where all internal corners were found
+    calibration_image_points = [corners for (allcornersfound, corners) in detection_results if allcornersfound]
+    #calibrate
+    calibration_components = compute_calibration_components(num_column_points, num_row_points, calibration_image_points, camera_image_size)
+    #persist for the next run
+    save_calibration_cache(path_to_calibration_cache, cache_key, num_column_points, num_row_points, calibration_image_hashes, [allcornersfound for (allcornersfound, _) in detection_results], [corners for (_, corners) in detection_results], calibration_components)
+    #return components
+    return calibration_components
+
 #transform an image to compensate for radial and tangential lens distortion
 #calibration_components[0] is camera_matrix, calibration_components[1] is distortion_coeff 
 def perform_undistort(image, calibration_components):
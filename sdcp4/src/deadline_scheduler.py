@@ -0,0 +1,103 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import logging
+import time
+from lane_tracker import degradation_levels
+
+#degradations and recoveries are logged here (one message per change of level, not per frame)
+deadline_logger = logging.getLogger("deadline_scheduler")
+
+#chooses how much work each frame of a live stream gets so that frames keep finishing within their budget
+#every frame is due frame_budget_seconds after it arrives, the scheduler keeps a running estimate of the cost of each of the degradation_levels
+#(see lane_tracker) and picks the least degraded level expected to finish before the frame is due, stepping back up one level per frame
+#once there's time again (so a level that's only just affordable isn't flipped in and out of on every frame)
+#each change of level is logged, and the number of frames run at each level and the number of times each level was degraded to are counted
+class DeadlineScheduler:
+    __slots__ = ("frame_budget_seconds", "cost_smoothing", "level_cost_estimates", "current_level", "level_frame_counts", "level_degradation_counts", "num_frames_scheduled")
+
+    #cost_smoothing is the weight given to the latest cost of a level in its running (exponentially weighted) estimate
+    def __init__(self, frame_budget_seconds, cost_smoothing=0.25):
+        self.frame_budget_seconds = frame_budget_seconds
+        self.cost_smoothing = cost_smoothing
+        #a level that has never run is assumed to be free (it gets tried, then measured)
+        self.level_cost_estimates = [0.0] * len(degradation_levels)
+        self.current_level = 0
+        self.level_frame_counts = [0] * len(degradation_levels)
+        self.level_degradation_counts = [0] * len(degradation_levels)
+        self.num_frames_scheduled = 0
+
+    #choose the level (an index into degradation_levels) to process a frame at, frame_deadline is the time (perf_counter) the frame is due by
+    def select_degradation_level(self, frame_deadline, now=None):
+        if (now is None):
+            now = time.perf_counter()
+        time_remaining = frame_deadline - now
+        #the least degraded level expected to make the deadline (the cheapest level if none is)
+        degradation_level = len(degradation_levels) - 1
+        for cur_level, cur_level_cost_estimate in enumerate(self.level_cost_estimates):
+            if (cur_level_cost_estimate <= time_remaining):
+                degradation_level = cur_level
+                break
+        #recover one level at a time
+        degradation_level = max(degradation_level, self.current_level - 1)
+        #log and count changes of level
+        if (degradation_level > self.current_level):
+            self.level_degradation_counts[degradation_level] += 1
+            deadline_logger.warning("frame %d: degraded from '%s' to '%s' (%.1f ms left of a %.1f ms budget, '%s' expected to take %.1f ms)",
+                                    self.num_frames_scheduled, degradation_levels[self.current_level], degradation_levels[degradation_level], time_remaining * 1000,
+                                    self.frame_budget_seconds * 1000, degradation_levels[self.current_level], self.level_cost_estimates[self.current_level] * 1000)
+        elif (degradation_level < self.current_level):
+            deadline_logger.info("frame %d: recovered from '%s' to '%s' (%.1f ms left of a %.1f ms budget)",
+                                 self.num_frames_scheduled, degradation_levels[self.current_level], degradation_levels[degradation_level], time_remaining * 1000,
+                                 self.frame_budget_seconds * 1000)
+        self.current_level = degradation_level
+        self.level_frame_counts[degradation_level] += 1
+        self.num_frames_scheduled += 1
+        return degradation_level
+
+    #update the running cost estimate of a level with the time (in seconds) it took to process a frame
+    def record_frame_cost(self, degradation_level, frame_cost):
+        prev_cost_estimate = self.level_cost_estimates[degradation_level]
+        #the first measurement replaces the initial (free) assumption outright
+        if (prev_cost_estimate == 0.0):
+            self.level_cost_estimates[degradation_level] = frame_cost
+        else:
+            self.level_cost_estimates[degradation_level] = prev_cost_estimate + (self.cost_smoothing * (frame_cost - prev_cost_estimate))
+
+    #summarize the run: frames processed and times degraded to at each level, plus the latest cost estimate of each level (in milliseconds)
+    def summarize(self):
+        return {"num_frames": self.num_frames_scheduled, "frame_budget_ms": self.frame_budget_seconds * 1000,
+                "levels": {level_name: {"frames": self.level_frame_counts[level_index], "degradations": self.level_degradation_counts[level_index],
+                                        "cost_estimate_ms": self.level_cost_estimates[level_index] * 1000}
+                           for (level_index, level_name) in enumerate(degradation_levels)}}
+
+    #log the frame counts of the run (a warning if any frame was degraded)
+    def log_summary(self):
+        num_degraded_frames = self.num_frames_scheduled - self.level_frame_counts[0]
+        level_frame_counts = ", ".join("{0}: {1}".format(level_name, level_frame_count) for (level_name, level_frame_count) in zip(degradation_levels, self.level_frame_counts))
+        deadline_logger.log(logging.WARNING if (num_degraded_frames > 0) else logging.INFO, "%d of %d frames degraded to meet a %.1f ms budget (%s)",
+                            num_degraded_frames, self.num_frames_scheduled, self.frame_budget_seconds * 1000, level_frame_counts)
+
+#process a stream's frames serially, choosing the level of each frame with the supplied scheduler
+#frame n is taken to arrive n / fps seconds after the first (as it would from a live camera), and is due frame_budget_seconds after that,
+#so processing that falls behind the stream (or output that backs up) shows up as lateness and the pipeline degrades rather than queueing up
+#a frame started before it would have arrived (frames read from a file are available early) is due frame_budget_seconds after it's started,
+#time saved on earlier frames can't be banked (a live camera wouldn't have delivered the frame any earlier)
+def process_frames_against_deadlines(frames, lane_tracker, deadline_scheduler, fps):
+    stream_start_time = None
+    for frame_index, frame in enumerate(frames):
+        frame_start_time = time.perf_counter()
+        if (stream_start_time is None):
+            stream_start_time = frame_start_time
+        frame_arrival_time = stream_start_time + (frame_index / fps)
+        frame_deadline = min(frame_arrival_time, frame_start_time) + deadline_scheduler.frame_budget_seconds
+        degradation_level = deadline_scheduler.select_degradation_level(frame_deadline, frame_start_time)
+        processed_frame = lane_tracker.process_frame_at_degradation_level(frame, degradation_level)
+        deadline_scheduler.record_frame_cost(degradation_level, time.perf_counter() - frame_start_time)
+        yield processed_frame
\ No newline at end of file
@@ -0,0 +1,105 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import numpy as np
+
+#second order polynomials (f(y) = A(y^2) + By + C) are fit from running sums (moments) of the lane line pixel coordinates rather than the coordinates themselves
+#the least squares solution only depends on the sums of y^k (k = 0..4) and x*y^k (k = 0..2), so pixels can be accumulated as they're found
+#(e.g., window by window) and moments from several sets of pixels can simply be added together before solving
+#moments are stored in a vector: [sum(w), sum(w*v), sum(w*v^2), sum(w*v^3), sum(w*v^4), sum(w*x), sum(w*x*v), sum(w*x*v^2), sum(w*x^2)]
+#where w is the pixel weight (1 for unweighted fits) and v = y / polynomial_moment_y_scale (keeps the sums of y^4 from swamping the normal equations)
+#the trailing sum(w*x^2) isn't needed to solve, but gives the residual of the fit without revisiting the pixels
+polynomial_moment_y_scale = 720.0
+num_polynomial_moments = 9
+
+#accumulate the polynomial moments of the supplied [y, x] pixel coordinates (i.e., row, col format), optionally weighted per pixel
+#if moments are supplied the new sums are added to them (in place), otherwise a new moment vector is returned
+def accumulate_polynomial_moments(pixel_coordinates, weights=None, moments=None):
+    if (moments is None):
+        moments = np.zeros(num_polynomial_moments)
+    #scaled y and raw x coordinates
+    v = pixel_coordinates[:, 0] * (1.0 / polynomial_moment_y_scale)
+    x = pixel_coordinates[:, 1].astype(np.float64)
+    v_squared = v * v
+    #weighted or unweighted sums
+    if (weights is None):
+        weighted_x = x
+        moments[0] += len(v)
+        moments[1] += np.sum(v)
+        moments[2] += np.sum(v_squared)
+        moments[3] += np.dot(v_squared, v)
+        moments[4] += np.dot(v_squared, v_squared)
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        weighted_x = weights * x
+        weighted_v_squared = weights * v_squared
+        moments[0] += np.sum(weights)
+        moments[1] += np.dot(weights, v)
+        moments[2] += np.sum(weighted_v_squared)
+        moments[3] += np.dot(weighted_v_squared, v)
+        moments[4] += np.dot(weighted_v_squared, v_squared)
+    moments[5] += np.sum(weighted_x)
+    moments[6] += np.dot(weighted_x, v)
+    moments[7] += np.dot(weighted_x, v_squared)
+    moments[8] += np.dot(weighted_x, x)
+    #return moments
+    return moments
+
+#build the normal equations (N * [a, b, c] = r) for a batch of moment vectors, shape (..., num_polynomial_moments)
+def generate_normal_equations(moments):
+    moments = np.asarray(moments, dtype=np.float64)
+    normal_matrix = np.stack([np.stack([moments[..., 4], moments[..., 3], moments[..., 2]], axis=-1),
+                              np.stack([moments[..., 3], moments[..., 2], moments[..., 1]], axis=-1),
+                              np.stack([moments[..., 2], moments[..., 1], moments[..., 0]], axis=-1)], axis=-2)
+    normal_rhs = np.stack([moments[..., 7], moments[..., 6], moments[..., 5]], axis=-1)
+    return (normal_matrix, normal_rhs)
+
+#solve for the polynomial coefficients (in scaled y, highest power first) of a batch of moment vectors in a single batched solve
+def solve_scaled_polynomial_coefficients(moments):
+    normal_matrix, normal_rhs = generate_normal_equations(moments)
+    try:
+        return np.linalg.solve(normal_matrix, normal_rhs[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        #too few distinct rows to determine a second order polynomial, fall back to the minimum norm least squares solution (as np.polyfit would)
+        return np.matmul(np.linalg.pinv(normal_matrix), normal_rhs[..., np.newaxis])[..., 0]
+
+#solve for the polynomial coefficients [A, B, C] (f(y) = A(y^2) + By + C, in pixels) of a batch of moment vectors
+def solve_polynomial_coefficients(moments):
+    scaled_coeff = solve_scaled_polynomial_coefficients(moments)
+    #undo the y scaling: a(y/s)^2 + b(y/s) + c = (a/s^2)y^2 + (b/s)y + c
+    return scaled_coeff * np.array([1.0 / (polynomial_moment_y_scale ** 2), 1.0 / polynomial_moment_y_scale, 1.0])
+
+#compute the root mean square residual (in pixels along x) of the polynomial fit described by a batch of moment vectors and their polynomial coefficients
+#expands sum(w * (x - f(y))^2) = sum(w*x^2) - 2 * (coeff . r) + (coeff . N . coeff) so no pixels need to be revisited
+def compute_polynomial_fit_residual(moments, coeff):
+    moments = np.asarray(moments, dtype=np.float64)
+    normal_matrix, normal_rhs = generate_normal_equations(moments)
+    #convert coefficients back to scaled y
+    scaled_coeff = np.asarray(coeff, dtype=np.float64) * np.array([polynomial_moment_y_scale ** 2, polynomial_moment_y_scale, 1.0])
+    residual_sum_of_squares = moments[..., 8] - (2 * np.sum(scaled_coeff * normal_rhs, axis=-1)) + np.einsum('...i,...ij,...j->...', scaled_coeff, normal_matrix, scaled_coeff)
+    #guard against tiny negative values from rounding, and empty fits
+    return np.sqrt(np.maximum(residual_sum_of_squares, 0) / np.maximum(moments[..., 0], 1))
+
+#convert polynomial coefficients (x = f(y)) fit to an image resampled by processing_scale (both axes) to full resolution coefficients
+#x = x_s / s and y = y_s / s, so x = (A_s * s)(y^2) + (B_s)(y) + (C_s / s)
+def convert_coefficients_from_processing_scale(coeff, processing_scale):
+    return np.asarray(coeff, dtype=np.float64) * np.array([processing_scale, 1.0, 1.0 / processing_scale])
+
+#convert full resolution polynomial coefficients (x = f(y)) to an image resampled by processing_scale (the inverse of the above)
+def convert_coefficients_to_processing_scale(coeff, processing_scale):
+    return np.asarray(coeff, dtype=np.float64) * np.array([1.0 / processing_scale, 1.0, processing_scale])
+
+#rescale polynomial coefficients fit in pixel space (x = f(y)) to world space, given the meters per pixel along each axis
+#x_m = mx * x and y_m = my * y, so x_m = (mx * A / my^2)(y_m^2) + (mx * B / my)(y_m) + (mx * C) - no refit required
+def rescale_polynomial_coefficients(coeff, x_meters_per_pixel, y_meters_per_pixel):
+    return np.asarray(coeff, dtype=np.float64) * np.array([x_meters_per_pixel / (y_meters_per_pixel ** 2), x_meters_per_pixel / y_meters_per_pixel, x_meters_per_pixel])
+
+#compute the radius of curvature of a polynomial (f(y) = A(y^2) + By + C) at y
+def compute_radius_of_curvature(coeff, y):
+    return ((1 + ((2 * coeff[..., 0] * y) + coeff[..., 1]) ** 2) ** 1.5) / np.absolute(2 * coeff[..., 0])
\ No newline at end of file
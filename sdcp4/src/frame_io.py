@@ -0,0 +1,152 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import subprocess
+import threading
+import queue
+import numpy as np
+
+#moviepy is only imported when a video is opened (importing it costs far more than the detection stages need, and worker processes and short
+#batch jobs would otherwise pay for it every time they start), moviepy.editor in particular is avoided as it also loads matplotlib and PIL
+
+#a frame source is a tuple of (frame_size, fps, read_frame, close) where frame_size is (cols, rows) and read_frame returns the next rgb frame or None at the end of the stream
+#a frame sink is a tuple of (write_frame, close) where write_frame accepts an rgb frame
+
+#marks the end of the stream on a frame queue
+end_of_stream = None
+
+#generate a frame source that decodes the supplied video through moviepy
+def generate_moviepy_frame_source(path_to_input_video):
+    from moviepy.video.io.VideoFileClip import VideoFileClip
+    clip_handle = VideoFileClip(path_to_input_video, audio=False)
+    frame_iterator = clip_handle.iter_frames()
+    #return the next frame, or None once the clip is exhausted
+    def read_frame():
+        return next(frame_iterator, None)
+    return (tuple(clip_handle.size), clip_handle.fps, read_frame, clip_handle.close)
+
+#generate a frame sink that encodes frames through moviepy
+def generate_moviepy_frame_sink(path_to_output_video, frame_size, fps):
+    from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+    video_writer = FFMPEG_VideoWriter(path_to_output_video, frame_size, fps)
+    return (video_writer.write_frame, video_writer.close)
+
+#generate a frame source that reads raw rgb frames straight off an ffmpeg pipe into preallocated arrays (skips moviepy's per-frame conversions)
+def generate_raw_pipe_frame_source(path_to_input_video):
+    from moviepy.config import get_setting
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    #probe the video for its dimensions and frame rate
+    video_info = ffmpeg_parse_infos(path_to_input_video)
+    frame_size = tuple(video_info["video_size"])
+    fps = video_info["video_fps"]
+    frame_byte_count = frame_size[0] * frame_size[1] * 3
+    #decode to raw rgb24 on stdout
+    ffmpeg_command = [get_setting("FFMPEG_BINARY"), "-loglevel", "error", "-i", path_to_input_video, "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    ffmpeg_process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, bufsize=frame_byte_count)
+    #read the next frame directly into a new array, or return None once the stream is exhausted
+    def read_frame():
+        frame = np.empty((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        frame_buffer = memoryview(frame).cast("B")
+        bytes_read = 0
+        while (bytes_read < frame_byte_count):
+            chunk_byte_count = ffmpeg_process.stdout.readinto(frame_buffer[bytes_read:])
+            if (not chunk_byte_count):
+                return None
+            bytes_read += chunk_byte_count
+        return frame
+    #stop the decoder (it may be blocked writing frames we'll never read, so don't ask it to shut down gracefully) and release the pipe
+    def close():
+        ffmpeg_process.kill()
+        ffmpeg_process.stdout.close()
+        ffmpeg_process.wait()
+    return (frame_size, fps, read_frame, close)
+
+#generate a frame sink that writes raw rgb frames straight into an ffmpeg pipe (skips moviepy's per-frame conversions)
+def generate_raw_pipe_frame_sink(path_to_output_video, frame_size, fps):
+    from moviepy.config import get_setting
+    #encode raw rgb24 from stdin with the same codec settings moviepy uses by default
+    ffmpeg_command = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error",
+                      "-f", "rawvideo", "-vcodec", "rawvideo", "-s", "{0}x{1}".format(frame_size[0], frame_size[1]), "-pix_fmt", "rgb24", "-r", "{0:.02f}".format(fps), "-i", "-",
+                      "-an", "-vcodec", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p", path_to_output_video]
+    ffmpeg_process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    #hand the frame's memory to the pipe without an intermediate copy (as long as it's already contiguous)
+    def write_frame(frame):
+        ffmpeg_process.stdin.write(memoryview(np.ascontiguousarray(frame, dtype=np.uint8)).cast("B"))
+    #flush the encoder and wait for it to finish writing the file
+    def close():
+        ffmpeg_process.stdin.close()
+        ffmpeg_process.wait()
+    return (write_frame, close)
+
+#generate a frame source (raw pipe or moviepy) for the supplied video
+def generate_frame_source(path_to_input_video, use_raw_pipe=False):
+    if (use_raw_pipe):
+        return generate_raw_pipe_frame_source(path_to_input_video)
+    return generate_moviepy_frame_source(path_to_input_video)
+
+#generate a frame sink (raw pipe or moviepy) for the supplied video
+def generate_frame_sink(path_to_output_video, frame_size, fps, use_raw_pipe=False):
+    if (use_raw_pipe):
+        return generate_raw_pipe_frame_sink(path_to_output_video, frame_size, fps)
+    return generate_moviepy_frame_sink(path_to_output_video, frame_size, fps)
+
+#start a decode thread that reads frames from the frame source into a bounded queue (blocks when queue_depth frames are waiting)
+#the queue ends with end_of_stream, if decoding fails the exception is placed on the queue (ahead of end_of_stream) to be re-raised by the consumer
+def start_frame_reader(frame_source, queue_depth):
+    frame_queue = queue.Queue(maxsize=queue_depth)
+    def read_frames():
+        try:
+            frame = frame_source[2]()
+            while (frame is not None):
+                frame_queue.put(frame)
+                frame = frame_source[2]()
+        except Exception as error:
+            frame_queue.put(error)
+        finally:
+            frame_queue.put(end_of_stream)
+    reader_thread = threading.Thread(target=read_frames, name="frame_reader", daemon=True)
+    reader_thread.start()
+    return (frame_queue, reader_thread)
+
+#iterate the frames placed on a frame queue by the decode thread until the end of the stream
+def iterate_frame_queue(frame_queue):
+    frame = frame_queue.get()
+    while (frame is not end_of_stream):
+        #re-raise decode errors on the consuming thread
+        if (isinstance(frame, Exception)):
+            raise frame
+        yield frame
+        frame = frame_queue.get()
+
+#start an encode thread that drains a bounded queue into the frame sink (producers block when queue_depth frames are waiting)
+#put end_of_stream on the returned queue and then call finish_frame_writer to flush the sink
+def start_frame_writer(frame_sink, queue_depth):
+    frame_queue = queue.Queue(maxsize=queue_depth)
+    writer_errors = []
+    def write_frames():
+        frame = frame_queue.get()
+        while (frame is not end_of_stream):
+            #once the sink has failed, keep draining (so producers never block forever) but stop writing
+            if (len(writer_errors) == 0):
+                try:
+                    frame_sink[0](frame)
+                except Exception as error:
+                    writer_errors.append(error)
+            frame = frame_queue.get()
+    writer_thread = threading.Thread(target=write_frames, name="frame_writer", daemon=True)
+    writer_thread.start()
+    return (frame_queue, writer_thread, writer_errors)
+
+#signal the end of the stream to the encode thread, wait for it to drain, close the sink, then re-raise any encode error
+def finish_frame_writer(frame_writer, frame_sink):
+    frame_writer[0].put(end_of_stream)
+    frame_writer[1].join()
+    frame_sink[1]()
+    if (len(frame_writer[2]) > 0):
+        raise frame_writer[2][0]
\ No newline at end of file
@@ -0,0 +1,112 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+#generate the remap tables used to undistort and to (undistort + warp) an image in a single resampling pass each
+#calibration_components[0] is camera_matrix, calibration_components[1] is distortion_coeff
+#perspective_transform_components[0] is warp_perspective_matrix, perspective_transform_components[1] is unwarp_perspective_matrix
+#image_size is (cols, rows), when use_fixed_point_maps is true the maps are converted to the (faster, smaller) fixed-point representation
+#processing_scale sizes the warped image relative to image_size (e.g., 0.5 warps straight to a half resolution bird's eye view), warped pixel (u, v)
+#samples full resolution warped location (u / processing_scale, v / processing_scale), so coordinates convert between the two by a plain scale
+#(the undistorted image is always full resolution, it's what the lane is drawn onto)
+def generate_geometry_components(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps=False, processing_scale=1.0):
+    camera_matrix = calibration_components[0]
+    distortion_coeff = calibration_components[1]
+    #undistort map (undistorted pixel --> distorted source pixel), this is what cv2.undistort rebuilds on every call
+    undistort_map_x, undistort_map_y = cv2.initUndistortRectifyMap(camera_matrix, distortion_coeff, None, camera_matrix, image_size, cv2.CV_32FC1)
+    #generate the (x, y) coordinates of every pixel in the warped (destination) image (in full resolution warped coordinates)
+    warped_image_size = compute_processing_image_size(image_size, processing_scale)
+    if (processing_scale == 1.0):
+        warped_x, warped_y = np.meshgrid(np.arange(image_size[0], dtype=np.float32), np.arange(image_size[1], dtype=np.float32))
+    else:
+        warped_x, warped_y = np.meshgrid((np.arange(warped_image_size[0]) / processing_scale).astype(np.float32), (np.arange(warped_image_size[1]) / processing_scale).astype(np.float32))
+    warped_points = np.dstack((warped_x, warped_y)).reshape(-1, 1, 2)
+    #map each warped pixel back to its location in the undistorted image (this is exactly what warpPerspective does internally)
+    undistorted_points = cv2.perspectiveTransform(warped_points, perspective_transform_components[1])
+    #map each undistorted location back to its location in the distorted (raw camera) image
+    #(normalize with the inverse camera matrix, then re-project through the lens model)
+    normalized_points = cv2.undistortPoints(undistorted_points, camera_matrix, None)
+    object_points = cv2.convertPointsToHomogeneous(normalized_points).astype(np.float64)
+    distorted_points, _ = cv2.projectPoints(object_points, np.zeros(3), np.zeros(3), camera_matrix, distortion_coeff)
+    #reshape into per-pixel lookup tables (one for x, one for y)
+    distorted_points = distorted_points.reshape(warped_image_size[1], warped_image_size[0], 2).astype(np.float32)
+    warp_map_x = np.ascontiguousarray(distorted_points[:, :, 0])
+    warp_map_y = np.ascontiguousarray(distorted_points[:, :, 1])
+    #optionally convert to fixed-point maps (interleaved integer coordinates + interpolation table indices)
+    if (use_fixed_point_maps):
+        undistort_map_x, undistort_map_y = cv2.convertMaps(undistort_map_x, undistort_map_y, cv2.CV_16SC2)
+        warp_map_x, warp_map_y = cv2.convertMaps(warp_map_x, warp_map_y, cv2.CV_16SC2)
+    #return maps packaged in a tuple for easy transport
+    return ((undistort_map_x, undistort_map_y), (warp_map_x, warp_map_y))
+
+#compute the (cols, rows) of an image_size image processed at processing_scale
+def compute_processing_image_size(image_size, processing_scale):
+    return (int(round(image_size[0] * processing_scale)), int(round(image_size[1] * processing_scale)))
+
+#transform an image to compensate for lens distortion using the precomputed undistort map
+#geometry_components[0] is the undistort map pair, geometry_components[1] is the fused undistort + warp map pair
+#dst receives the undistorted image (the shape of the image, allocated if not supplied)
+def perform_geometry_undistort(image, geometry_components, dst=None):
+    return cv2.remap(image, geometry_components[0][0], geometry_components[0][1], cv2.INTER_LINEAR, dst=dst)
+
+#undistort and warp (bird's eye view) a raw camera image in a single resampling pass using the precomputed fused map
+#dst receives the warped image (see compute_warped_image_shape, allocated if not supplied)
+def perform_geometry_warp(image, geometry_components, dst=None):
+    return cv2.remap(image, geometry_components[1][0], geometry_components[1][1], cv2.INTER_LINEAR, dst=dst)
+
+#compute the shape of the warped image perform_geometry_warp produces from an image of the supplied shape (the warp map sets its rows and cols)
+def compute_warped_image_shape(image_shape, geometry_components):
+    return tuple(geometry_components[1][0].shape[:2]) + tuple(image_shape[2:])
+
+#geometry components built by retrieve_geometry_components, keyed by geometry key (most recently used last)
+#lets every stream (and every worker process) that shares a camera reuse one set of remap tables
+geometry_components_cache = OrderedDict()
+max_cached_geometry_components = 16
+#guards the cache (the stateless stages of many streams may run on a thread pool at once, e.g., the lane service)
+geometry_components_cache_lock = threading.Lock()
+
+#generate a compact, picklable description of the geometry components for the supplied calibration and perspective transform
+#returns (geometry_key, calibration_components, perspective_transform_components, image_size, use_fixed_point_maps, processing_scale) where the key is a
+#content hash of everything the remap tables depend on (so the spec can be shipped to worker processes, which rebuild or reuse the tables by key)
+def generate_geometry_spec(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps=False, processing_scale=1.0):
+    calibration_components = (np.asarray(calibration_components[0], dtype=np.float64), np.asarray(calibration_components[1], dtype=np.float64))
+    perspective_transform_components = (np.asarray(perspective_transform_components[0], dtype=np.float64), np.asarray(perspective_transform_components[1], dtype=np.float64))
+    key_hash = hashlib.sha1()
+    for component in (calibration_components + perspective_transform_components):
+        key_hash.update(np.ascontiguousarray(component).tobytes())
+    processing_scale = float(processing_scale)
+    #(the scale is left out of the key at full resolution, so full resolution keys are unchanged)
+    key_source = "{0}x{1}|{2}".format(image_size[0], image_size[1], bool(use_fixed_point_maps))
+    if (processing_scale != 1.0):
+        key_source += "|{0!r}".format(processing_scale)
+    key_hash.update(key_source.encode("ascii"))
+    return (key_hash.hexdigest(), calibration_components, perspective_transform_components, tuple(image_size), bool(use_fixed_point_maps), processing_scale)
+
+#retrieve the geometry components described by a geometry spec (see generate_geometry_spec), generating them only if this process hasn't already
+def retrieve_geometry_components(geometry_spec):
+    geometry_key = geometry_spec[0]
+    with geometry_components_cache_lock:
+        geometry_components = geometry_components_cache.get(geometry_key)
+        if (geometry_components is not None):
+            geometry_components_cache.move_to_end(geometry_key)
+            return geometry_components
+    #build the tables outside the lock (other streams aren't held up), if another thread built the same tables meanwhile, theirs are kept
+    geometry_components = generate_geometry_components(geometry_spec[1], geometry_spec[2], geometry_spec[3], geometry_spec[4], geometry_spec[5])
+    with geometry_components_cache_lock:
+        geometry_components = geometry_components_cache.setdefault(geometry_key, geometry_components)
+        geometry_components_cache.move_to_end(geometry_key)
+        #evict the least recently used tables
+        while (len(geometry_components_cache) > max_cached_geometry_components):
+            geometry_components_cache.popitem(last=False)
+    return geometry_components
\ No newline at end of file
@@ -0,0 +1,238 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import csv
+import json
+import time
+import threading
+import tracemalloc
+import numpy as np
+
+#stages of the pipeline timed per frame (a stage that didn't run for a frame is left as nan, e.g. the search that wasn't used)
+#decode and encode run on their own threads (overlapping the other stages), so they're not included in a frame's total
+pipeline_stages = ("decode", "undistort", "warp", "threshold", "blind_search", "educated_search", "fit", "smoothing", "curvature_offset", "render", "encode")
+pipeline_stage_index = {stage_name: stage_index for (stage_index, stage_name) in enumerate(pipeline_stages)}
+pipeline_processing_stages = tuple(stage_name for stage_name in pipeline_stages if (stage_name not in ("decode", "encode")))
+
+#percentiles reported for each stage
+reported_percentiles = (50, 95, 99)
+
+#mark a stage boundary in code that runs its stages without a StageTimings at hand (e.g., the stateless stages, which may run in a worker process)
+#appends (time, traced bytes, peak transient bytes of the stage that just ended) to stage_marks, allocations are only measured while tracemalloc is
+#tracing in this process (e.g., under StageAllocations), otherwise (and at the first mark) the peak is None
+def mark_stage_boundary(stage_marks):
+    mark_time = time.perf_counter()
+    if (not tracemalloc.is_tracing()):
+        stage_marks.append((mark_time, 0, None))
+        return
+    peak_bytes = None
+    if (len(stage_marks) > 0):
+        peak_bytes = max(tracemalloc.get_traced_memory()[1] - stage_marks[-1][1], 0)
+    #the next stage's peak is measured from here
+    tracemalloc.reset_peak()
+    stage_marks.append((mark_time, tracemalloc.get_traced_memory()[0], peak_bytes))
+
+#convert the marks made at stage boundaries (see mark_stage_boundary) to (duration, peak transient bytes) of each stage (None if nothing was marked)
+def compute_stage_measurements(stage_marks):
+    if (stage_marks is None):
+        return None
+    return tuple(((end_mark[0] - start_mark[0]), end_mark[2]) for (start_mark, end_mark) in zip(stage_marks, stage_marks[1:]))
+
+#records the wall time of each stage of each frame of a run into a preallocated (frames x stages) array
+#instrumentation is switched off simply by not creating one of these (the pipeline then skips every timing call)
+class StageTimings:
+    __slots__ = ("stage_durations", "num_frames", "start_time", "end_time", "record_lock")
+
+    #expected_num_frames sizes the array up front (it doubles if the run turns out to be longer)
+    def __init__(self, expected_num_frames=36000):
+        self.stage_durations = np.full((max(expected_num_frames, 1), len(pipeline_stages)), np.nan)
+        self.num_frames = 0
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        #decode and encode are recorded from their own threads
+        self.record_lock = threading.Lock()
+
+    #record the duration (in seconds) of a stage of a frame, durations recorded for the same stage of the same frame add up
+    #peak_bytes is the stage's peak transient allocation if it was measured where the stage ran (only kept by StageAllocations)
+    def record_stage_duration(self, frame_index, stage_name, duration, peak_bytes=None):
+        stage_index = pipeline_stage_index[stage_name]
+        with self.record_lock:
+            #double the array if the run is longer than expected
+            if (frame_index >= len(self.stage_durations)):
+                grown_stage_durations = np.full((max(2 * len(self.stage_durations), frame_index + 1), len(pipeline_stages)), np.nan)
+                grown_stage_durations[:len(self.stage_durations)] = self.stage_durations
+                self.stage_durations = grown_stage_durations
+            prev_duration = self.stage_durations[frame_index, stage_index]
+            self.stage_durations[frame_index, stage_index] = duration if (prev_duration != prev_duration) else (prev_duration + duration)
+            self.num_frames = max(self.num_frames, frame_index + 1)
+
+    #record the time elapsed since start_time as the duration of a stage of a frame, returns the current time (the start of the next stage)
+    def record_stage_since(self, frame_index, stage_name, start_time):
+        end_time = time.perf_counter()
+        self.record_stage_duration(frame_index, stage_name, end_time - start_time)
+        return end_time
+
+    #mark the end of the run (throughput is measured from construction to here)
+    def finish(self):
+        self.end_time = time.perf_counter()
+
+    #summarize the run: per stage count, mean, percentiles and total (in milliseconds), plus the per frame total of the processing stages and throughput
+    def summarize(self):
+        stage_durations = self.stage_durations[:self.num_frames] * 1000
+        end_time = self.end_time if (self.end_time is not None) else time.perf_counter()
+        wall_seconds = end_time - self.start_time
+        stage_summaries = {}
+        #frame totals only cover the processing stages (nan stages count as zero, they didn't run)
+        processing_stage_indices = [pipeline_stage_index[stage_name] for stage_name in pipeline_processing_stages]
+        frame_totals = np.nansum(stage_durations[:, processing_stage_indices], axis=1)
+        for stage_name, cur_stage_durations in list(zip(pipeline_stages, stage_durations.T)) + [("frame_total", frame_totals)]:
+            cur_stage_durations = cur_stage_durations[~np.isnan(cur_stage_durations)]
+            stage_summary = {"count": int(len(cur_stage_durations))}
+            if (len(cur_stage_durations) > 0):
+                stage_summary["mean_ms"] = float(np.mean(cur_stage_durations))
+                for percentile, percentile_value in zip(reported_percentiles, np.percentile(cur_stage_durations, reported_percentiles)):
+                    stage_summary["p{0}_ms".format(percentile)] = float(percentile_value)
+                stage_summary["total_ms"] = float(np.sum(cur_stage_durations))
+            stage_summaries[stage_name] = stage_summary
+        return {"num_frames": self.num_frames, "wall_seconds": wall_seconds, "frames_per_second": (self.num_frames / wall_seconds) if (wall_seconds > 0) else 0.0, "stages": stage_summaries}
+
+    #export the summary and the per frame stage durations (in milliseconds, null where a stage didn't run) as json
+    def export_json(self, path_to_json):
+        stage_durations = self.stage_durations[:self.num_frames] * 1000
+        frames = [[(None if (duration != duration) else float(duration)) for duration in frame_durations] for frame_durations in stage_durations]
+        with open(path_to_json, "w") as json_file:
+            json.dump({"summary": self.summarize(), "stage_names": list(pipeline_stages), "frames_ms": frames}, json_file, indent=1)
+
+    #export the per frame stage durations (in milliseconds, empty where a stage didn't run) as csv, one row per frame
+    def export_csv(self, path_to_csv):
+        stage_durations = self.stage_durations[:self.num_frames] * 1000
+        with open(path_to_csv, "w", newline="") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(("frame",) + pipeline_stages)
+            for frame_index, frame_durations in enumerate(stage_durations):
+                csv_writer.writerow([frame_index] + [("" if (duration != duration) else "{0:.4f}".format(duration)) for duration in frame_durations])
+
+    #export as json or csv depending on the file extension
+    def export(self, path_to_export):
+        if (path_to_export.lower().endswith(".csv")):
+            self.export_csv(path_to_export)
+        else:
+            self.export_json(path_to_export)
+
+#records how far traced memory rose above its level at the start of each stage of each frame (its peak transient allocation), along with the stage
+#durations (it's a drop-in StageTimings), to show that a stream's steady state frames allocate nothing large (see buffer_pool)
+#a stage's peak bounds the largest single allocation it made, so a stage that peaks below some size made no allocation that large
+#(numpy arrays are traced, including those opencv returns, opencv's internal scratch memory isn't)
+#this is debug instrumentation: tracing every allocation slows the pipeline down, and tracemalloc traces the whole process (every thread), so it's meant
+#for a serial run with nothing else allocating alongside (e.g., benchmark.py --allocation-check), decode and encode are timed but not traced
+#stages whose durations are recorded after they ran (those of perform_stateless_frame_stages) are traced together, and attributed to the first of them
+class StageAllocations(StageTimings):
+    __slots__ = ("stage_peak_bytes", "stage_start_traced_bytes", "tracing_started")
+
+    def __init__(self, expected_num_frames=1000):
+        super().__init__(expected_num_frames)
+        #peak transient bytes of each stage of each frame (-1 where a stage wasn't traced)
+        self.stage_peak_bytes = np.full(self.stage_durations.shape, -1, dtype=np.int64)
+        #only stop tracing at the end of the run if it was started here
+        self.tracing_started = (not tracemalloc.is_tracing())
+        if (self.tracing_started):
+            tracemalloc.start()
+        self.start_stage_trace()
+
+    #start tracing the next stage from the current traced memory (callers that free anything between frames, e.g., the previous frame's output,
+    #should call this before each frame so the free can't mask the first stage's allocations)
+    def start_stage_trace(self):
+        tracemalloc.reset_peak()
+        self.stage_start_traced_bytes = tracemalloc.get_traced_memory()[0]
+
+    #record the duration of a stage of a frame (see StageTimings), and its peak transient allocation (peak_bytes if it was measured where the stage
+    #ran, see mark_stage_boundary, otherwise the peak since the previous stage was recorded)
+    def record_stage_duration(self, frame_index, stage_name, duration, peak_bytes=None):
+        super().record_stage_duration(frame_index, stage_name, duration)
+        if (stage_name in ("decode", "encode")):
+            return
+        if (peak_bytes is None):
+            peak_bytes = max(tracemalloc.get_traced_memory()[1] - self.stage_start_traced_bytes, 0)
+        #grow along with the stage durations
+        if (frame_index >= len(self.stage_peak_bytes)):
+            grown_stage_peak_bytes = np.full(self.stage_durations.shape, -1, dtype=np.int64)
+            grown_stage_peak_bytes[:len(self.stage_peak_bytes)] = self.stage_peak_bytes
+            self.stage_peak_bytes = grown_stage_peak_bytes
+        stage_index = pipeline_stage_index[stage_name]
+        self.stage_peak_bytes[frame_index, stage_index] = max(self.stage_peak_bytes[frame_index, stage_index], peak_bytes)
+        self.start_stage_trace()
+
+    #mark the end of the run (and stop tracing, if it was started here)
+    def finish(self):
+        super().finish()
+        if (self.tracing_started and tracemalloc.is_tracing()):
+            tracemalloc.stop()
+
+    #count the frames (from first_frame on, e.g., to skip warm up frames) in which each stage made an allocation of large_allocation_bytes or more
+    #returns {stage name: (frames counted, max peak bytes)} for each stage that was traced
+    def count_large_allocations(self, large_allocation_bytes, first_frame=0):
+        stage_peak_bytes = self.stage_peak_bytes[first_frame:self.num_frames]
+        large_allocation_counts = {}
+        for stage_name, cur_stage_peak_bytes in zip(pipeline_stages, stage_peak_bytes.T):
+            cur_stage_peak_bytes = cur_stage_peak_bytes[cur_stage_peak_bytes >= 0]
+            if (len(cur_stage_peak_bytes) > 0):
+                large_allocation_counts[stage_name] = (int(np.count_nonzero(cur_stage_peak_bytes >= large_allocation_bytes)), int(np.max(cur_stage_peak_bytes)))
+        return large_allocation_counts
+
+#records the latencies of a long running stream's most recent frames in a fixed-size ring (so its memory stays flat however long the stream runs),
+#along with the count, mean and worst latency over the whole stream, e.g., the per stream latency metrics of lane_service
+class LatencyWindow:
+    __slots__ = ("latencies", "num_latencies", "total_latency", "max_latency")
+
+    #window_length is the number of most recent latencies percentiles are computed over
+    def __init__(self, window_length=1000):
+        self.latencies = np.zeros(max(window_length, 1))
+        self.num_latencies = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    #record a latency (in seconds), replacing the oldest in the window once it's full
+    def record_latency(self, latency):
+        self.latencies[self.num_latencies % len(self.latencies)] = latency
+        self.num_latencies += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    #summarize the latencies (in milliseconds): count, mean and max over the whole stream, percentiles over the window
+    def summarize(self):
+        latency_summary = {"count": self.num_latencies}
+        if (self.num_latencies > 0):
+            window_latencies = self.latencies[:min(self.num_latencies, len(self.latencies))] * 1000
+            latency_summary["mean_ms"] = (self.total_latency / self.num_latencies) * 1000
+            for percentile, percentile_value in zip(reported_percentiles, np.percentile(window_latencies, reported_percentiles)):
+                latency_summary["p{0}_ms".format(percentile)] = float(percentile_value)
+            latency_summary["max_ms"] = self.max_latency * 1000
+        return latency_summary
+
+#wrap a frame source (see frame_io) so that each frame read is recorded as the decode stage of that frame
+def generate_timed_frame_source(frame_source, stage_timings):
+    frame_counter = [0]
+    def read_frame():
+        start_time = time.perf_counter()
+        frame = frame_source[2]()
+        if (frame is not None):
+            stage_timings.record_stage_since(frame_counter[0], "decode", start_time)
+            frame_counter[0] += 1
+        return frame
+    return (frame_source[0], frame_source[1], read_frame, frame_source[3])
+
+#wrap a frame sink (see frame_io) so that each frame written is recorded as the encode stage of that frame
+def generate_timed_frame_sink(frame_sink, stage_timings):
+    frame_counter = [0]
+    def write_frame(frame):
+        start_time = time.perf_counter()
+        frame_sink[0](frame)
+        stage_timings.record_stage_since(frame_counter[0], "encode", start_time)
+        frame_counter[0] += 1
+    return (write_frame, frame_sink[1])
\ No newline at end of file
@@ -0,0 +1,109 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import numpy as np
+
+#a lane line measurement is fully trusted once this many pixels were found for it (trust scales down linearly below)
+full_confidence_pixel_count = 1000
+#rms fit residual (pixels) at which a lane line measurement is only half trusted
+half_confidence_fit_residual = 20.0
+#measurements trusted less than this are treated as misses
+min_measurement_confidence = 0.3
+
+#search margin (pixels either side of the predicted lane line) when tracking is fully confident, and when it isn't confident at all
+min_search_margin = 50
+max_search_margin = 100
+
+#compute how far a lane line measurement can be trusted (0 to 1) from the number of pixels it was fit to and the rms residual of the fit
+def compute_lane_line_measurement_confidence(pixel_count, fit_residual):
+    pixel_count_confidence = min(pixel_count / full_confidence_pixel_count, 1.0)
+    fit_residual_confidence = 1.0 / (1.0 + ((fit_residual / half_confidence_fit_residual) ** 2))
+    return pixel_count_confidence * fit_residual_confidence
+
+#compute the mean horizontal distance (pixels) between two sets of lane line polynomials ([left, right] coefficients) down the height of the image
+#returns the distance of each lane line
+def compute_lane_line_displacement(image_height, lane_line_coeff, other_lane_line_coeff, num_rows=8):
+    y_samples = np.linspace(0, image_height - 1, num_rows)
+    #powers of y for the second order polynomial (A(y^2) + By + C)
+    y_powers = np.stack((y_samples ** 2, y_samples, np.ones_like(y_samples)))
+    return np.mean(np.abs(np.dot(np.asarray(lane_line_coeff) - np.asarray(other_lane_line_coeff), y_powers)), axis=1)
+
+#alpha-beta filter over the polynomial coefficients of the left and right lane lines, under a constant curvature motion model:
+#the lane lines' position (C) and heading (B) drift at a steady per frame rate, their curvature (A) is held (it's corrected, but never extrapolated)
+#each measurement corrects the prediction in proportion to how far it can be trusted, measurements that land further from the prediction than
+#the search band reaches are rejected (the pixels can't have come from the tracked line), and the filter is lost after max_consecutive_misses
+#frames without a single usable measurement (the caller then falls back to a blind search, which reinitializes the filter)
+#tracking confidence (a running mean of the per frame confidence) sets the width of the search band, narrowing it while measurements are good
+class LaneLineMotionModel:
+    __slots__ = ("coeff_state", "coeff_rate", "tracking_confidence", "num_consecutive_misses", "alpha", "beta", "max_consecutive_misses")
+
+    #alpha and beta are the gains applied to the coefficients and their rates (scaled down by the confidence of each measurement)
+    def __init__(self, alpha=0.5, beta=0.15, max_consecutive_misses=5):
+        #[left, right] coefficients and their per frame rate of change (None until the first measurement)
+        self.coeff_state = None
+        self.coeff_rate = np.zeros((2, 3))
+        self.tracking_confidence = 0.0
+        self.num_consecutive_misses = 0
+        self.alpha = alpha
+        self.beta = beta
+        self.max_consecutive_misses = max_consecutive_misses
+
+    #true when there is no usable state (never initialized, or too many frames in a row without a usable measurement)
+    def is_lost(self):
+        return ((self.coeff_state is None) or (self.num_consecutive_misses >= self.max_consecutive_misses))
+
+    #width of the search band either side of the predicted lane lines (narrows as tracking confidence grows)
+    def compute_search_margin(self):
+        return int(round(max_search_margin - ((max_search_margin - min_search_margin) * self.tracking_confidence)))
+
+    #advance the state by one frame, returns the predicted [left, right] coefficients
+    def predict(self):
+        self.coeff_state = self.coeff_state + self.coeff_rate
+        return self.coeff_state
+
+    #restart the filter from a measurement (after a blind search), returns true if the measurement was usable
+    def initialize(self, lane_line_coeff, measurement_confidence):
+        #both lane lines must be usable to start tracking, otherwise stay lost
+        if (np.min(measurement_confidence) < min_measurement_confidence):
+            self.register_miss()
+            return False
+        self.coeff_state = np.array(lane_line_coeff, dtype=np.float64)
+        self.coeff_rate = np.zeros((2, 3))
+        self.tracking_confidence = float(np.min(measurement_confidence))
+        self.num_consecutive_misses = 0
+        return True
+
+    #correct the predicted state with a measurement ([left, right] coefficients) and the confidence of each lane line (0 to 1)
+    #a lane line's measurement is used only if it's trusted enough and it lies within gate_distance (mean pixels) of the prediction
+    #returns which of the lane lines were used (a frame where neither was is a miss)
+    def update(self, lane_line_coeff, measurement_confidence, image_height, gate_distance):
+        lane_line_coeff = np.asarray(lane_line_coeff, dtype=np.float64)
+        measurement_confidence = np.asarray(measurement_confidence, dtype=np.float64)
+        lane_line_displacement = compute_lane_line_displacement(image_height, lane_line_coeff, self.coeff_state)
+        lane_lines_used = (measurement_confidence >= min_measurement_confidence) & (lane_line_displacement <= gate_distance)
+        if (not np.any(lane_lines_used)):
+            self.register_miss()
+            return lane_lines_used
+        #innovation (measurement - prediction) of each lane line, zeroed for lane lines not used
+        gain_scale = np.where(lane_lines_used, measurement_confidence, 0.0)[:, np.newaxis]
+        innovation = lane_line_coeff - self.coeff_state
+        self.coeff_state = self.coeff_state + ((self.alpha * gain_scale) * innovation)
+        self.coeff_rate = self.coeff_rate + ((self.beta * gain_scale) * innovation)
+        #constant curvature: the curvature term never drifts on its own
+        self.coeff_rate[:, 0] = 0.0
+        self.num_consecutive_misses = 0
+        #a lane line that wasn't used counts as no confidence this frame
+        self.tracking_confidence += 0.5 * (float(np.min(gain_scale)) - self.tracking_confidence)
+        return lane_lines_used
+
+    #record a frame without a usable measurement (the rates are halved so the extrapolation settles rather than running away, the band widens)
+    def register_miss(self):
+        self.num_consecutive_misses += 1
+        self.coeff_rate *= 0.5
+        self.tracking_confidence *= 0.5
\ No newline at end of file
@@ -9,18 +9,98 @@
 #############
 import cv2
 import numpy as np
-import matplotlib.pyplot as plt
 from threshold_processor import compute_hot_pixel_density_across_x_axis
+from fit_processor import accumulate_polynomial_moments, solve_polynomial_coefficients, rescale_polynomial_coefficients, compute_radius_of_curvature
+from packed_mask import PackedMask, retrieve_binary_image
 
-#estimate the base location (index) of the lane lines using the hot (value of 1) pixel density across the bottom half of the image
-def estimate_index_of_lane_line_base(image, export_debug_image=False):
+#generate a compact index of the hot (value of 1) pixels in a binary image, so searches can pull out the hot pixels in a window without scanning them all
+#hot pixels are kept as their flat (row-major) indices, which are sorted by row and then by column, so the hot pixels in any row's column range
+#are a contiguous run found by binary search, while an integral image (2d prefix counts) gives the hot pixel count of any rectangle in constant time
+#returns (hot_pixel_flat_indices, hot_pixel_integral_image, image_shape)
+#the image may be a packed mask (see packed_mask), whose counts come from popcounts of the mask itself (it takes the place of the integral image)
+#every search function accepts a packed mask in place of a binary image
+def generate_hot_pixel_index(image):
+    if (isinstance(image, PackedMask)):
+        return (image.retrieve_hot_pixel_flat_indices(), image, image.shape)
+    #flat indices of all hot pixels (row * image width + column)
+    hot_pixel_flat_indices = np.flatnonzero(image)
+    #integral image (entry [y, x] holds the count of hot pixels above and to the left of (y, x))
+    hot_pixel_integral_image = cv2.integral(image)
+    #return index
+    return (hot_pixel_flat_indices, hot_pixel_integral_image, image.shape)
+
+#count the hot pixels within [y_low, y_high) x [x_low, x_high) using the hot pixel index (window bounds are clipped to the image)
+def count_hot_pixels_in_window(hot_pixel_index, y_low, y_high, x_low, x_high):
+    hot_pixel_integral_image = hot_pixel_index[1]
+    image_shape = hot_pixel_index[2]
+    if (isinstance(hot_pixel_integral_image, PackedMask)):
+        return hot_pixel_integral_image.count_hot_pixels(y_low, y_high, x_low, x_high)
+    #clip window to image bounds
+    y_low, y_high = max(y_low, 0), min(y_high, image_shape[0])
+    x_low, x_high = max(x_low, 0), min(x_high, image_shape[1])
+    if ((y_high <= y_low) or (x_high <= x_low)):
+        return 0
+    #sum the rectangle from its four corners in the integral image
+    return int(hot_pixel_integral_image[y_high, x_high] - hot_pixel_integral_image[y_low, x_high] - hot_pixel_integral_image[y_high, x_low] + hot_pixel_integral_image[y_low, x_low])
+
+#compute the density of hot pixels across the x-axis within a y-axis window (same result as compute_hot_pixel_density_across_x_axis) using the hot pixel index
+def compute_hot_pixel_density_from_index(hot_pixel_index, offset, window_size):
+    hot_pixel_integral_image = hot_pixel_index[1]
+    if (isinstance(hot_pixel_integral_image, PackedMask)):
+        return hot_pixel_integral_image.compute_column_histogram(offset, offset + window_size)
+    #per-column counts for all rows above offset + window_size, less the per-column counts for all rows above offset
+    window_column_counts = hot_pixel_integral_image[offset + window_size] - hot_pixel_integral_image[offset]
+    #difference adjacent columns of the cumulative counts to get the count of each column
+    return np.diff(window_column_counts)
+
+#retrieve the [y, x] coordinates (i.e., row, col format) of all hot pixels within [y_low, y_high) x [x_low, x_high) using the hot pixel index
+#coordinates are returned in the same (row-major) order as np.transpose(np.nonzero(image)), and the cost is proportional to the rows and hot pixels in the window
+def retrieve_hot_pixels_in_window(hot_pixel_index, y_low, y_high, x_low, x_high):
+    hot_pixel_flat_indices = hot_pixel_index[0]
+    image_shape = hot_pixel_index[2]
+    #clip window to image bounds
+    y_low, y_high = max(y_low, 0), min(y_high, image_shape[0])
+    x_low, x_high = max(x_low, 0), min(x_high, image_shape[1])
+    if ((y_high <= y_low) or (x_high <= x_low)):
+        return np.empty((0, 2), dtype=np.intp)
+    #flat index at the start of each row in the window
+    row_starts = np.arange(y_low, y_high, dtype=np.intp) * image_shape[1]
+    #locate the run of hot pixels that falls within the window's column range on each row
+    run_starts = np.searchsorted(hot_pixel_flat_indices, row_starts + x_low)
+    run_ends = np.searchsorted(hot_pixel_flat_indices, row_starts + x_high)
+    run_lengths = run_ends - run_starts
+    #gather the runs back to back (the position of each hot pixel is its run's start plus its offset within the run)
+    run_offsets = np.cumsum(run_lengths) - run_lengths
+    window_flat_indices = hot_pixel_flat_indices[np.arange(run_lengths.sum()) + np.repeat(run_starts - run_offsets, run_lengths)]
+    #convert flat indices back to [y, x] coordinates
+    return np.column_stack(np.divmod(window_flat_indices, image_shape[1]))
+
+#retrieve the [y, x] coordinates (i.e., row, col format) of all hot pixels in the image using the hot pixel index
+def retrieve_all_hot_pixels(hot_pixel_index):
+    return np.column_stack(np.divmod(hot_pixel_index[0], hot_pixel_index[2][1]))
+
+#compute the hot (value of 1) pixel density of each column across the bottom half of the image (the histogram the lane line bases are estimated from)
+#if a hot pixel index of the image is supplied, the density is read from it rather than summing the image
+def compute_lane_line_base_density_histogram(image, hot_pixel_index=None):
     #set start position (y position...i.e., starting row number)
     offset = np.int(image.shape[0] / 2)
     #set window size (height...i.e., number of rows) that should be summed per x-axis column
     #this would normally be a fixed 'chunk', but to start, we're looking at the lower half of the image
     window_size = image.shape[0] - offset 
     #compute pixel peaks across the x-axis of the image
-    hot_pixel_density_histogram = compute_hot_pixel_density_across_x_axis(image, offset, window_size)
+    if (hot_pixel_index is not None):
+        hot_pixel_density_histogram = compute_hot_pixel_density_from_index(hot_pixel_index, offset, window_size)
+    elif (isinstance(image, PackedMask)):
+        hot_pixel_density_histogram = image.compute_column_histogram(offset, offset + window_size)
+    else:
+        hot_pixel_density_histogram = compute_hot_pixel_density_across_x_axis(image, offset, window_size)
+    return hot_pixel_density_histogram
+
+#estimate the base location (index) of the lane lines using the hot (value of 1) pixel density across the bottom half of the image
+#if a hot pixel index of the image is supplied, the density is read from it rather than summing the image
+#(the histogram itself can be plotted with render_hot_pixel_density_histogram, see artifact_writer)
+def estimate_index_of_lane_line_base(image, hot_pixel_index=None):
+    hot_pixel_density_histogram = compute_lane_line_base_density_histogram(image, hot_pixel_index)
     #locate the peak of the left and right halves of the histogram
     #these will be the starting point for the left and right lane lines
     #divide the vector in half (get midpoint)
@@ -30,25 +110,48 @@ def estimate_index_of_lane_line_base(image, export_debug_image=False):
     #return the index of the largest value in the vector from (midpoint + 1) to (hot_pixel_density_histogram.shape[0] - 1) ...this should be the base of the right lane line
     #add the midpoint to the returned index to offset it correctly (since we're looking at the second half by itself, the argmax index returned will be wrong)
     right_lane_line_base_index = np.argmax(hot_pixel_density_histogram[midpoint_index:]) + midpoint_index
-    #if true export a debug image
-    if (export_debug_image):
-        #plot result
-        plt.plot(hot_pixel_density_histogram, color='b', linewidth=1)
-        plt.xlabel('Pixel position', fontsize=14)
-        plt.ylabel('Hot pixel density', fontsize=14)
-        plt.savefig("output_images/stage3_hot_pixel_density_histogram_straight_lines1.jpg")
     #return estimated lane line locations
     return (left_lane_line_base_index, right_lane_line_base_index)
 
+#parameters of the lane line searches (at full resolution), hand tuned on the project video (see LaneTracker, None uses these defaults)
+#   window_margin - width of the search windows and bands either side of the lane lines (the widest band a motion model searches)
+#   min_pixel_count_to_recenter - pixels a blind search window must find for the next window up to recenter on them
+#   num_windows - number of windows a blind search stacks up the image
+default_search_parameters = {"window_margin": 100, "min_pixel_count_to_recenter": 50, "num_windows": 9}
+
+#generate a set of search parameters, the defaults with the supplied parameters overridden
+def generate_search_parameters(**parameter_overrides):
+    unknown_parameter_names = sorted(set(parameter_overrides) - set(default_search_parameters))
+    if (len(unknown_parameter_names) > 0):
+        raise ValueError("unknown search parameters {0} (expected any of {1})".format(", ".join(unknown_parameter_names), ", ".join(default_search_parameters)))
+    search_parameters = dict(default_search_parameters)
+    search_parameters.update(parameter_overrides)
+    return search_parameters
+
+#scale the (full resolution) pixel parameters of the lane line searches to an image processed at processing_scale
+#returns (window_margin, min_pixel_count_to_recenter), a margin scales with the image's width while a pixel count scales with its area
+def compute_scaled_search_parameters(processing_scale, window_margin=100, min_pixel_count_to_recenter=50):
+    return (max(int(round(window_margin * processing_scale)), 1), int(round(min_pixel_count_to_recenter * (processing_scale ** 2))))
+
 #compute the polynomial coefficients based on the supplied left and right lane line pixel coordinates
 #each parameter contains the (x, y) coordinates estimated to be associated with the left and right lane
-def compute_lane_line_coefficients(left_lane_line_pixel_coordinates, right_lane_line_pixel_coordinates):
-    #fit (minimize squared error) a second order polynomial to the supplied points for each lane line
+#per pixel weights may optionally be supplied for either lane line (unweighted if None)
+#the coefficients of a lane line without any pixels are None (see compute_lane_line_coefficients_from_moments)
+def compute_lane_line_coefficients(left_lane_line_pixel_coordinates, right_lane_line_pixel_coordinates, left_lane_line_pixel_weights=None, right_lane_line_pixel_weights=None):
+    #accumulate the polynomial moments (running sums of the pixel coordinates) for each lane line
+    left_lane_line_moments = accumulate_polynomial_moments(left_lane_line_pixel_coordinates, left_lane_line_pixel_weights)
+    right_lane_line_moments = accumulate_polynomial_moments(right_lane_line_pixel_coordinates, right_lane_line_pixel_weights)
+    #return polynomial coefficients for the fitted left and right lane lines
+    return compute_lane_line_coefficients_from_moments(left_lane_line_moments, right_lane_line_moments)
+
+#compute the polynomial coefficients of the left and right lane lines from their accumulated polynomial moments (see fit_processor)
+#a lane line whose moments hold no pixels has nothing to fit, its coefficients are None (rather than the all zero solution of empty normal equations)
+def compute_lane_line_coefficients_from_moments(left_lane_line_moments, right_lane_line_moments):
+    #fit (minimize squared error) a second order polynomial to each lane line, solving both sets of normal equations at once
     #fitting for f(y) instead of f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value
-    left_lane_line_coeff = np.polyfit(left_lane_line_pixel_coordinates[:, 0], left_lane_line_pixel_coordinates[:, 1], deg=2)
-    right_lane_line_coeff = np.polyfit(right_lane_line_pixel_coordinates[:, 0], right_lane_line_pixel_coordinates[:, 1], deg=2)
+    lane_line_coeff = solve_polynomial_coefficients(np.stack((left_lane_line_moments, right_lane_line_moments)))
     #return polynomial coefficients for the fitted left and right lane lines
-    return (left_lane_line_coeff, right_lane_line_coeff)
+    return ((lane_line_coeff[0] if (left_lane_line_moments[0] > 0) else None), (lane_line_coeff[1] if (right_lane_line_moments[0] > 0) else None))
 
 #compute the offset of the vehicle in the lane in meters
 def compute_vehicle_offset(image_size, left_lane_line_coeff, right_lane_line_coeff):
@@ -65,28 +168,53 @@ def compute_vehicle_offset(image_size, left_lane_line_coeff, right_lane_line_coe
     #return calculated offset (in meters)
     return ((image_center - lane_center) * meters_per_pixel)
 
-#compute the radius of curvature of the fitted lines in real world space (meters)
-def compute_curvature_of_lane_lines(image_size, left_lane_line_fitted_poly, right_lane_line_fitted_poly):
+#compute the radius of curvature of the fitted lines in real world space (meters) from their polynomial coefficients (pixel space)
+def compute_curvature_of_lane_lines(image_size, left_lane_line_coeff, right_lane_line_coeff):
     #define conversions in x and y from pixels space to meters
     y_meters_per_pixel = 30 / 720 #meters per pixel in y dimension
     x_meters_per_pixel = 3.7 / 700 #meters per pixel in x dimension
-    #generate range of evenly spaced numbers over y interval (0 - 719) matching image height
-    y_linespace = np.linspace(0, (image_size[0] - 1), image_size[0])
-    #fit new polynomials (using polys fit to pixel space) to x, y in world space
-    left_lane_line_coeff_rescaled = np.polyfit((y_linespace * y_meters_per_pixel), (left_lane_line_fitted_poly * x_meters_per_pixel), deg=2)
-    right_lane_line_coeff_rescaled = np.polyfit((y_linespace * y_meters_per_pixel), (right_lane_line_fitted_poly * x_meters_per_pixel), deg=2)
-    #calculate the new radii of curvature    
-    radius_of_curvature_left = ((1 + (2 * left_lane_line_coeff_rescaled[0] * np.max(y_linespace) * y_meters_per_pixel + left_lane_line_coeff_rescaled[1]) ** 2) ** 1.5) / np.absolute(2 * left_lane_line_coeff_rescaled[0])
-    radius_of_curvature_right = ((1 + (2 * right_lane_line_coeff_rescaled[0] * np.max(y_linespace) * y_meters_per_pixel + right_lane_line_coeff_rescaled[1]) ** 2) ** 1.5) / np.absolute(2 * right_lane_line_coeff_rescaled[0])
+    #rescale the polynomials fit in pixel space to world space (closed form, no refit required)
+    left_lane_line_coeff_rescaled = rescale_polynomial_coefficients(left_lane_line_coeff, x_meters_per_pixel, y_meters_per_pixel)
+    right_lane_line_coeff_rescaled = rescale_polynomial_coefficients(right_lane_line_coeff, x_meters_per_pixel, y_meters_per_pixel)
+    #calculate the new radii of curvature at the base of the image (closest to the vehicle)
+    y_eval = (image_size[0] - 1) * y_meters_per_pixel
+    radius_of_curvature_left = compute_radius_of_curvature(left_lane_line_coeff_rescaled, y_eval)
+    radius_of_curvature_right = compute_radius_of_curvature(right_lane_line_coeff_rescaled, y_eval)
     #return curvature of left and right lane lines
     return (radius_of_curvature_left, radius_of_curvature_right)
     
+#generate the rectangular regions ((y_low, y_high, x_low, x_high) tuples) that cover the educated search bands (+/- window_margin around the
+#supplied polynomials), so that only these regions need thresholding
+#each band is split into num_strips horizontal strips of equal height (a curved band is covered more tightly by several short rectangles than one tall one)
+def generate_lane_line_search_regions(image_shape, left_lane_line_coeff, right_lane_line_coeff, window_margin=100, num_strips=6):
+    #generate range of evenly spaced numbers over y interval (0 - 719) matching image height
+    y_linespace = np.arange(0, image_shape[0])
+    regions = []
+    for lane_line_coeff in (left_lane_line_coeff, right_lane_line_coeff):
+        #fitted polynomial (f(y) = A(y^2) + By + C)
+        lane_line_fitted_poly = (lane_line_coeff[0] * (y_linespace ** 2)) + (lane_line_coeff[1] * y_linespace) + lane_line_coeff[2]
+        #split the rows into (nearly) equal strips and bound the band within each
+        for strip_rows in np.array_split(y_linespace, num_strips):
+            strip_poly = lane_line_fitted_poly[strip_rows[0]:(strip_rows[-1] + 1)]
+            x_low = max(int(np.floor(np.min(strip_poly) - window_margin)), 0)
+            x_high = min(int(np.ceil(np.max(strip_poly) + window_margin)) + 1, image_shape[1])
+            #skip strips where the band lies entirely outside the image
+            if (x_high > x_low):
+                regions.append((int(strip_rows[0]), int(strip_rows[-1]) + 1, x_low, x_high))
+    #return regions
+    return regions
+
 #map out the lane line pixel locations using previously computed coefficients as a starting location to mount the search from in the supplied image 
-def perform_educated_lane_line_pixel_search(image, prev_left_lane_line_coeff, prev_right_lane_line_coeff, prev_left_lane_line_fitted_poly=None, prev_right_lane_line_fitted_poly=None, return_debug_image=False):
+#a hot pixel index of the image (see generate_hot_pixel_index) may be supplied if one has already been built
+#window_margin is the width of the search band either side of the previous polynomials (narrower bands admit fewer stray pixels)
+def perform_educated_lane_line_pixel_search(image, prev_left_lane_line_coeff, prev_right_lane_line_coeff, prev_left_lane_line_fitted_poly=None, prev_right_lane_line_fitted_poly=None, return_debug_image=False, hot_pixel_index=None, window_margin=100):
     #return the [y, x] coordinates (i.e., row, col format) of all hot (value of 1) pixels in the binary image
-    hot_pixel_coordinates = np.transpose(np.nonzero(image))
-    #set width of the window +/- margin around left and right fitted polynomials
-    window_margin = 100
+    if (hot_pixel_index is not None):
+        hot_pixel_coordinates = retrieve_all_hot_pixels(hot_pixel_index)
+    elif (isinstance(image, PackedMask)):
+        hot_pixel_coordinates = image.retrieve_hot_pixels()
+    else:
+        hot_pixel_coordinates = np.transpose(np.nonzero(image))
     #if debug is set, the search windows are visualized on a returned debug image
     debug_image = None
     
@@ -106,8 +234,9 @@ def perform_educated_lane_line_pixel_search(image, prev_left_lane_line_coeff, pr
     
     #if true return a debug image
     if (return_debug_image):
-        #create an output image to draw on and visualize the result
-        debug_image = np.dstack((image, image, image)) * 255
+        #create an output image to draw on and visualize the result (a packed mask is unpacked for it)
+        binary_image = retrieve_binary_image(image)
+        debug_image = np.dstack((binary_image, binary_image, binary_image)) * 255
         #we'll draw the window representation on this image and overlay
         window_image = np.zeros_like(debug_image)
         #color all left lane pixels red
@@ -135,26 +264,25 @@ def perform_educated_lane_line_pixel_search(image, prev_left_lane_line_coeff, pr
     return (left_window_pixel_coordinates, right_window_pixel_coordinates, debug_image)
 
 #map out the lane line pixel locations from scratch in the supplied image via windowed search 
-def perform_blind_lane_line_pixel_search(image, return_debug_image=False):
-    #set number of tracking windows (windows that move toward hot pixel density)
-    num_windows = 9
+#each window is answered from a hot pixel index of the image (built here unless one is supplied), so the cost of each window is proportional to its own pixels
+#window_margin is the width of the windows either side of their center, and windows re-center on the pixels they find once more than
+#min_pixel_count_to_recenter are found (both are in pixels, so scale them along with the image, see compute_scaled_search_parameters)
+#num_windows is the number of tracking windows (windows that move toward hot pixel density) stacked up the image
+def perform_blind_lane_line_pixel_search(image, return_debug_image=False, hot_pixel_index=None, window_margin=100, min_pixel_count_to_recenter=50, num_windows=9):
     #set height of the windows
     window_height = np.int(image.shape[0] / num_windows)
-    #set width of the windows +/- margin
-    window_margin = 100
-    #set minimum number of pixels needing to be found to re-center window at their mean location
-    min_pixel_count_to_recenter = 50
     #lists that contain left and right lane pixel coordinates
     all_left_lane_pixel_coordinates = []
     all_right_lane_pixel_coordinates = []
     #if debug is set, the search windows are visualized on a returned debug image
     debug_image = None
    
-    #return the [y, x] coordinates (i.e., row, col format) of all hot (value of 1) pixels in the binary image
-    hot_pixel_coordinates = np.transpose(np.nonzero(image))
+    #index the hot (value of 1) pixels in the binary image
+    if (hot_pixel_index is None):
+        hot_pixel_index = generate_hot_pixel_index(image)
  
     #estimate base location of lane lines using the hot (value of 1) pixel density counts in the lower half of the image
-    left_lane_line_base_index, right_lane_line_base_index = estimate_index_of_lane_line_base(image, export_debug_image=return_debug_image)
+    left_lane_line_base_index, right_lane_line_base_index = estimate_index_of_lane_line_base(image, hot_pixel_index=hot_pixel_index)
    
     #current x-axis index positions for the left and right lane search windows (to be updated as each window migrates position with the density of lane line pixels)
     cur_left_lane_line_x_index = left_lane_line_base_index
@@ -162,8 +290,9 @@ def perform_blind_lane_line_pixel_search(image, return_debug_image=False):
  
     #if true return a debug image
     if (return_debug_image):
-        #create an output image to draw on and visualize the result
-        debug_image = np.dstack((image, image, image)) * 255
+        #create an output image to draw on and visualize the result (a packed mask is unpacked for it)
+        binary_image = retrieve_binary_image(image)
+        debug_image = np.dstack((binary_image, binary_image, binary_image)) * 255
  
     #enumerate each window, identifying and capturing hot pixels located within each
     for cur_window in range(0, num_windows):
@@ -186,12 +315,8 @@ def perform_blind_lane_line_pixel_search(image, return_debug_image=False):
             cv2.rectangle(debug_image, (right_window_x_low, window_y_low), (right_window_x_high, window_y_high), (0, 255, 0), 2)
     
         #retrieve the [y, x] coordinates for all hot pixels located within the bounds of the current left and right windows
-        #selection condition
-        left_window_condition = ((hot_pixel_coordinates[:, 1] >= left_window_x_low) & (hot_pixel_coordinates[:, 1] < left_window_x_high)) & ((hot_pixel_coordinates[:, 0] >= window_y_low) & (hot_pixel_coordinates[:, 0] < window_y_high))  
-        right_window_condition = ((hot_pixel_coordinates[:, 1] >= right_window_x_low) & (hot_pixel_coordinates[:, 1] < right_window_x_high)) & ((hot_pixel_coordinates[:, 0] >= window_y_low) & (hot_pixel_coordinates[:, 0] < window_y_high))
-        #resulting coordinates chosen
-        left_window_pixel_coordinates = hot_pixel_coordinates[left_window_condition]
-        right_window_pixel_coordinates = hot_pixel_coordinates[right_window_condition]
+        left_window_pixel_coordinates = retrieve_hot_pixels_in_window(hot_pixel_index, window_y_low, window_y_high, left_window_x_low, left_window_x_high)
+        right_window_pixel_coordinates = retrieve_hot_pixels_in_window(hot_pixel_index, window_y_low, window_y_high, right_window_x_low, right_window_x_high)
         
         #if greater than min_pixels_count_to_recenter were found, recenter next window on their mean position
         if (len(left_window_pixel_coordinates) > min_pixel_count_to_recenter):
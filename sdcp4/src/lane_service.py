@@ -0,0 +1,539 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import sys
+import json
+import math
+import time
+import socket
+import struct
+import asyncio
+import logging
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
+import threshold_processor
+from lane_tracker import LaneTracker, perform_stateless_frame_stages
+from production_pipeline import initialize_worker
+from buffer_pool import FrameBufferPool
+from instrumentation_processor import LatencyWindow
+
+#local lane detection service: other processes send raw rgb frames tagged with a stream id over a unix domain socket (or localhost tcp), and get back
+#each frame's lane estimate (lane line coefficients, curvature and vehicle offset) rather than a rendered video, e.g.:
+#   python lane_service.py --unix /tmp/lane_service.sock --workers 2
+#   python lane_service.py --tcp 127.0.0.1:8765
+#   python lane_service.py --unix /tmp/lane_service.sock --replay test_video/project_video.mp4     (stream a video through a running service)
+#each stream keeps its own tracking state (a LaneTracker created on the stream's first frame), the frames arriving from every stream are gathered into
+#micro-batches for the stateless stages (undistort, warp, threshold) which run on a pool of worker processes (or threads), and each stream's stateful
+#stages (lane search, fit, smoothing) run in frame order as soon as its frame comes back
+#backpressure: at most max_pending_frames frames are admitted at once across every stream, once that many are pending the service stops reading from
+#its connections (so senders block on a full socket), and a stream may have at most max_stream_frames_in_flight frames admitted at once, any frame beyond
+#that is dropped straight away (and answered as dropped) so a camera that outruns the service keeps getting fresh results rather than a growing queue
+
+#wire protocol (little endian), every message is a fixed-size header followed by the stream id (utf-8) and a payload
+#requests:  message type (u8), stream id length (u16), frame number (u32), rows (u16), cols (u16), then the stream id and (frames only) rows x cols x 3 rgb bytes
+#responses: message type (u8), status (u8), stream id length (u16), frame number (u32), payload length (u32), then the stream id and the payload
+request_header = struct.Struct("<BHIHH")
+response_header = struct.Struct("<BBHII")
+
+#message types
+#   frame   - a frame to process, answered with its lane estimate (the frame number is echoed back, frames of a stream are answered in order)
+#   metrics - the metrics of a stream (of every stream for an empty stream id), answered with a json payload
+#   close   - drop a stream's tracking state, answered once the frames it has pending have been answered
+frame_message_type = 1
+metrics_message_type = 2
+close_message_type = 3
+
+#response statuses
+#   ok      - the payload is the lane estimate (see lane_estimate_payload)
+#   no_lane - no lane has been found on the stream yet (the lane estimate is all nan)
+#   dropped - the stream already had max_stream_frames_in_flight frames pending (the payload is empty)
+#   error   - the request couldn't be handled (the payload is a utf-8 error message)
+ok_status = 0
+no_lane_status = 1
+dropped_status = 2
+error_status = 3
+
+#lane estimate payload: left lane line coefficients (3), right lane line coefficients (3), curvature (meters), vehicle offset (meters), and the time
+#(in seconds) the frame spent in the service, from being read off the connection to being answered
+lane_estimate_payload = struct.Struct("<9d")
+
+service_logger = logging.getLogger("lane_service")
+
+#run the stateless stages of a micro-batch of frames (in a worker), each entry is (image, geometry_spec, use_region_of_interest_thresholding, undistort_image, pack_thresholded_image)
+#returns the outputs of each frame in order, or the exception it raised (so one bad frame doesn't fail the rest of the batch)
+def perform_stateless_frame_stages_batch(frame_batch):
+    batch_outputs = []
+    for image, geometry_spec, use_region_of_interest_thresholding, undistort_image, pack_thresholded_image in frame_batch:
+        try:
+            batch_outputs.append(perform_stateless_frame_stages(image, geometry_spec, use_region_of_interest_thresholding, False, None, undistort_image, None, pack_thresholded_image))
+        except Exception as error:
+            batch_outputs.append(error)
+    return batch_outputs
+
+#encode a lane estimate (see LaneTracker.last_lane_estimate, None for no estimate) and the time a frame spent in the service as a response payload
+def encode_lane_estimate(lane_estimate, service_latency):
+    if (lane_estimate is None):
+        return lane_estimate_payload.pack(*([math.nan] * 8), service_latency)
+    return lane_estimate_payload.pack(*lane_estimate[0], *lane_estimate[1], lane_estimate[2], lane_estimate[3], service_latency)
+
+#decode a lane estimate payload, returns (left_lane_line_coeff, right_lane_line_coeff, curvature, vehicle_offset, service_latency)
+def decode_lane_estimate(payload):
+    lane_estimate = lane_estimate_payload.unpack(payload)
+    return (np.array(lane_estimate[0:3]), np.array(lane_estimate[3:6]), lane_estimate[6], lane_estimate[7], lane_estimate[8])
+
+#the state of a single stream: its tracker, its pending frames (oldest first) and its metrics
+class LaneServiceStream:
+    __slots__ = ("stream_id", "lane_tracker", "image_size", "pending_frames", "pending_frames_available", "closing", "num_frames_answered", "num_frames_dropped",
+                 "num_frames_failed", "latency_window", "stateless_latency_window")
+
+    def __init__(self, stream_id, lane_tracker, image_size, latency_window_length=1000):
+        self.stream_id = stream_id
+        self.lane_tracker = lane_tracker
+        #(cols, rows) of the stream's frames
+        self.image_size = image_size
+        #(frame number, time read, future of the stateless stage outputs, writer to answer on) of each pending frame
+        self.pending_frames = deque()
+        #set whenever a frame is added or the stream is closing (the stream's task waits on it when nothing is pending)
+        self.pending_frames_available = asyncio.Event()
+        self.closing = False
+        self.num_frames_answered = 0
+        self.num_frames_dropped = 0
+        self.num_frames_failed = 0
+        #time from a frame being read to being answered, and to its stateless stages coming back
+        self.latency_window = LatencyWindow(latency_window_length)
+        self.stateless_latency_window = LatencyWindow(latency_window_length)
+
+    #summarize the stream's metrics (latencies in milliseconds)
+    def summarize(self):
+        return {"image_size": list(self.image_size), "frames_answered": self.num_frames_answered, "frames_dropped": self.num_frames_dropped, "frames_failed": self.num_frames_failed,
+                "frames_pending": len(self.pending_frames), "latency": self.latency_window.summarize(), "stateless_latency": self.stateless_latency_window.summarize()}
+
+#serves lane estimates for the frames of any number of streams (see the top of this file)
+#the stateless stages run on stateless_executor (worker processes started with production_pipeline.initialize_worker, or threads) split across num_stateless_workers
+#tasks per micro-batch, the stateful stages run on stateful_executor (threads, so the event loop keeps reading while they run)
+#a micro-batch is dispatched once max_batch_size frames are waiting or max_batch_delay seconds after its first frame arrived
+#the tracker settings are those of LaneTracker, trackers don't render (they only keep the lane estimate), so frames aren't undistorted either
+class LaneService:
+    __slots__ = ("calibration_components", "perspective_transform_components", "stateless_executor", "num_stateless_workers", "stateful_executor", "max_pending_frames",
+                 "max_stream_frames_in_flight", "max_batch_size", "max_batch_delay", "use_region_of_interest_thresholding", "use_fixed_point_maps", "use_motion_model",
+                 "processing_scale", "streams", "stream_tasks", "admission", "num_pending_frames", "batch", "batch_available", "batch_task")
+
+    def __init__(self, calibration_components, perspective_transform_components, stateless_executor, num_stateless_workers, stateful_executor, max_pending_frames=32,
+                 max_stream_frames_in_flight=4, max_batch_size=8, max_batch_delay=0.001, use_region_of_interest_thresholding=False, use_fixed_point_maps=True,
+                 use_motion_model=False, processing_scale=1.0):
+        self.calibration_components = calibration_components
+        self.perspective_transform_components = perspective_transform_components
+        self.stateless_executor = stateless_executor
+        self.num_stateless_workers = max(num_stateless_workers, 1)
+        self.stateful_executor = stateful_executor
+        self.max_pending_frames = max_pending_frames
+        self.max_stream_frames_in_flight = max_stream_frames_in_flight
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.use_region_of_interest_thresholding = use_region_of_interest_thresholding
+        self.use_fixed_point_maps = use_fixed_point_maps
+        self.use_motion_model = use_motion_model
+        self.processing_scale = processing_scale
+        #stream id --> stream, and the task finishing each stream's frames
+        self.streams = {}
+        self.stream_tasks = {}
+        #the event loop objects are created by start (in the loop that serves)
+        self.admission = None
+        self.num_pending_frames = 0
+        #(stateless stage inputs, future of the outputs) of the frames waiting for the next micro-batch
+        self.batch = deque()
+        self.batch_available = None
+        self.batch_task = None
+
+    #start dispatching micro-batches (call from the event loop that serves the connections)
+    def start(self):
+        self.admission = asyncio.Semaphore(self.max_pending_frames)
+        self.batch_available = asyncio.Event()
+        self.batch_task = asyncio.create_task(self.dispatch_batches())
+
+    #stop dispatching micro-batches and finishing streams (frames still pending are abandoned)
+    async def stop(self):
+        tasks = [task for task in ([self.batch_task] + list(self.stream_tasks.values())) if (task is not None)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    #summarize the metrics of a stream (or of every stream when stream_id is None), returns None for an unknown stream
+    def summarize(self, stream_id=None):
+        if (stream_id is None):
+            return {"frames_pending": self.num_pending_frames, "streams": {cur_stream_id: stream.summarize() for (cur_stream_id, stream) in self.streams.items()}}
+        stream = self.streams.get(stream_id)
+        return None if (stream is None) else stream.summarize()
+
+    #log the metrics of every stream
+    def log_summary(self):
+        for stream_id, stream in self.streams.items():
+            latency_summary = stream.latency_window.summarize()
+            service_logger.info("stream '%s': %d frames answered (%d dropped, %d failed), latency mean %.1f ms, p99 %.1f ms, max %.1f ms", stream_id, stream.num_frames_answered,
+                                stream.num_frames_dropped, stream.num_frames_failed, latency_summary.get("mean_ms", math.nan), latency_summary.get("p99_ms", math.nan),
+                                latency_summary.get("max_ms", math.nan))
+
+    #serve the requests of a single connection until it's closed
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    message_type, stream_id_length, frame_number, rows, cols = request_header.unpack(await reader.readexactly(request_header.size))
+                    stream_id = (await reader.readexactly(stream_id_length)).decode("utf-8")
+                except asyncio.IncompleteReadError:
+                    break
+                if (message_type == frame_message_type):
+                    await self.receive_frame(reader, writer, stream_id, frame_number, rows, cols)
+                elif (message_type == metrics_message_type):
+                    metrics = self.summarize(stream_id if (len(stream_id) > 0) else None)
+                    if (metrics is None):
+                        self.send_response(writer, message_type, error_status, stream_id, frame_number, "unknown stream".encode("utf-8"))
+                    else:
+                        self.send_response(writer, message_type, ok_status, stream_id, frame_number, json.dumps(metrics).encode("utf-8"))
+                elif (message_type == close_message_type):
+                    await self.close_stream(stream_id)
+                    self.send_response(writer, message_type, ok_status, stream_id, frame_number, b"")
+                else:
+                    #the rest of the connection can't be parsed
+                    self.send_response(writer, message_type, error_status, stream_id, frame_number, "unknown message type {0}".format(message_type).encode("utf-8"))
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    #read a frame's pixels and queue it on its stream (answering it straight away if it's dropped or can't be processed)
+    async def receive_frame(self, reader, writer, stream_id, frame_number, rows, cols):
+        #wait for room before reading the frame, so a backlog backs up into the senders' sockets rather than into memory
+        await self.admission.acquire()
+        try:
+            frame_bytes = await reader.readexactly(rows * cols * 3)
+        except BaseException:
+            self.admission.release()
+            raise
+        receive_time = time.perf_counter()
+        #the stream (created on its first frame) must still be open, and each of its frames the same size
+        stream = self.streams.get(stream_id)
+        error_message = None
+        if ((rows == 0) or (cols == 0)):
+            error_message = "empty frame"
+        elif (stream is None):
+            stream = self.open_stream(stream_id, (cols, rows))
+        elif (stream.closing):
+            error_message = "stream is closing"
+        elif (stream.image_size != (cols, rows)):
+            error_message = "frame size {0}x{1} differs from the stream's {2}x{3}".format(cols, rows, stream.image_size[0], stream.image_size[1])
+        if (error_message is not None):
+            self.admission.release()
+            self.send_response(writer, frame_message_type, error_status, stream_id, frame_number, error_message.encode("utf-8"))
+            return
+        #drop the frame if the stream is already too far behind
+        if (len(stream.pending_frames) >= self.max_stream_frames_in_flight):
+            self.admission.release()
+            stream.num_frames_dropped += 1
+            self.send_response(writer, frame_message_type, dropped_status, stream_id, frame_number, b"")
+            return
+        #queue the frame's stateless stages for the next micro-batch, and the frame on its stream
+        image = np.frombuffer(frame_bytes, dtype=np.uint8).reshape((rows, cols, 3))
+        stateless_future = asyncio.get_running_loop().create_future()
+        self.batch.append(((image, stream.lane_tracker.geometry_spec, self.use_region_of_interest_thresholding, False, stream.lane_tracker.packed_masks_enabled), stateless_future))
+        self.batch_available.set()
+        stream.pending_frames.append((frame_number, receive_time, stateless_future, writer))
+        stream.pending_frames_available.set()
+        self.num_pending_frames += 1
+
+    #open a stream (its tracker's geometry is built here on the stream's first frame, unless another stream of the same camera already built it)
+    def open_stream(self, stream_id, image_size):
+        lane_tracker = LaneTracker(self.calibration_components, self.perspective_transform_components, image_size, use_fixed_point_maps=self.use_fixed_point_maps,
+                                   use_region_of_interest_thresholding=self.use_region_of_interest_thresholding, use_motion_model=self.use_motion_model,
+                                   processing_scale=self.processing_scale, buffer_pool=FrameBufferPool(), render_lane=False)
+        stream = LaneServiceStream(stream_id, lane_tracker, image_size)
+        self.streams[stream_id] = stream
+        self.stream_tasks[stream_id] = asyncio.create_task(self.finish_stream_frames(stream))
+        service_logger.info("stream '%s' opened (%dx%d)", stream_id, image_size[0], image_size[1])
+        return stream
+
+    #close a stream once the frames it has pending are answered (nothing to do for an unknown stream)
+    async def close_stream(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if (stream is None):
+            return
+        stream.closing = True
+        stream.pending_frames_available.set()
+        await asyncio.shield(self.stream_tasks[stream_id])
+
+    #gather frames into micro-batches and dispatch them to the stateless executor (runs for as long as the service does)
+    async def dispatch_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.batch_available.wait()
+            #give frames from other streams until max_batch_delay after the first one to join the batch (unless it fills up first)
+            batch_deadline = loop.time() + self.max_batch_delay
+            while (len(self.batch) < self.max_batch_size):
+                remaining_delay = batch_deadline - loop.time()
+                if (remaining_delay <= 0):
+                    break
+                self.batch_available.clear()
+                try:
+                    await asyncio.wait_for(self.batch_available.wait(), remaining_delay)
+                except asyncio.TimeoutError:
+                    break
+            frame_batch = [self.batch.popleft() for _ in range(min(len(self.batch), self.max_batch_size))]
+            if (len(self.batch) == 0):
+                self.batch_available.clear()
+            #split the batch evenly across the workers (one task each, rather than one per frame)
+            num_frames_per_task = math.ceil(len(frame_batch) / self.num_stateless_workers)
+            for task_start_index in range(0, len(frame_batch), num_frames_per_task):
+                task_frames = frame_batch[task_start_index:(task_start_index + num_frames_per_task)]
+                task_future = loop.run_in_executor(self.stateless_executor, perform_stateless_frame_stages_batch, [stateless_inputs for (stateless_inputs, _) in task_frames])
+                task_future.add_done_callback(lambda task_future, stateless_futures=[stateless_future for (_, stateless_future) in task_frames]:
+                                              complete_stateless_futures(task_future, stateless_futures))
+
+    #finish a stream's frames in order as their stateless stages come back, answering each with its lane estimate (runs until the stream is closed)
+    async def finish_stream_frames(self, stream):
+        loop = asyncio.get_running_loop()
+        try:
+            while ((len(stream.pending_frames) > 0) or (not stream.closing)):
+                if (len(stream.pending_frames) == 0):
+                    stream.pending_frames_available.clear()
+                    await stream.pending_frames_available.wait()
+                    continue
+                frame_number, receive_time, stateless_future, writer = stream.pending_frames[0]
+                try:
+                    stateless_outputs = await stateless_future
+                    stream.stateless_latency_window.record_latency(time.perf_counter() - receive_time)
+                    await loop.run_in_executor(self.stateful_executor, stream.lane_tracker.perform_stateful_frame_stages, *stateless_outputs)
+                    lane_estimate = stream.lane_tracker.last_lane_estimate
+                    status = ok_status if (lane_estimate is not None) else no_lane_status
+                    error_message = None
+                except Exception as error:
+                    stream.num_frames_failed += 1
+                    status = error_status
+                    error_message = "{0}: {1}".format(type(error).__name__, error)
+                stream.pending_frames.popleft()
+                self.num_pending_frames -= 1
+                self.admission.release()
+                service_latency = time.perf_counter() - receive_time
+                stream.latency_window.record_latency(service_latency)
+                stream.num_frames_answered += 1
+                payload = encode_lane_estimate(lane_estimate, service_latency) if (error_message is None) else error_message.encode("utf-8")
+                self.send_response(writer, frame_message_type, status, stream.stream_id, frame_number, payload)
+        finally:
+            #the stream is gone once its task ends (a later frame with the same id opens a fresh stream)
+            if (self.streams.get(stream.stream_id) is stream):
+                del self.streams[stream.stream_id]
+                del self.stream_tasks[stream.stream_id]
+                service_logger.info("stream '%s' closed", stream.stream_id)
+
+    #send a response on a connection (nothing is sent if the connection has gone away)
+    def send_response(self, writer, message_type, status, stream_id, frame_number, payload):
+        if (writer.is_closing()):
+            return
+        encoded_stream_id = stream_id.encode("utf-8")
+        writer.write(response_header.pack(message_type, status, len(encoded_stream_id), frame_number, len(payload)) + encoded_stream_id + payload)
+
+#hand the outputs of a micro-batch task to the futures of its frames (called in the event loop once the task completes)
+def complete_stateless_futures(task_future, stateless_futures):
+    if (task_future.cancelled()):
+        for stateless_future in stateless_futures:
+            stateless_future.cancel()
+        return
+    task_error = task_future.exception()
+    for frame_index, stateless_future in enumerate(stateless_futures):
+        #(the frame's stream may have been stopped)
+        if (stateless_future.done()):
+            continue
+        frame_outputs = task_error if (task_error is not None) else task_future.result()[frame_index]
+        if (isinstance(frame_outputs, BaseException)):
+            stateless_future.set_exception(frame_outputs)
+        else:
+            stateless_future.set_result(frame_outputs)
+
+#serve a lane service on a unix domain socket (unix_socket_path) or tcp (tcp_address, a (host, port) tuple) until cancelled
+async def serve_lane_service(lane_service, unix_socket_path=None, tcp_address=None):
+    lane_service.start()
+    if (unix_socket_path is not None):
+        #remove the socket left behind by a previous run
+        if (os.path.exists(unix_socket_path)):
+            os.remove(unix_socket_path)
+        server = await asyncio.start_unix_server(lane_service.handle_connection, path=unix_socket_path)
+        service_logger.info("listening on %s", unix_socket_path)
+    else:
+        server = await asyncio.start_server(lane_service.handle_connection, host=tcp_address[0], port=tcp_address[1])
+        service_logger.info("listening on %s:%d", tcp_address[0], tcp_address[1])
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        lane_service.log_summary()
+        await lane_service.stop()
+        if ((unix_socket_path is not None) and os.path.exists(unix_socket_path)):
+            os.remove(unix_socket_path)
+
+#a blocking client of the lane service over a single connection, address is a unix socket path or a (host, port) tuple
+#frames can be sent ahead of their responses (pipelined), each stream's responses come back in the order its frames were sent, but the responses of
+#several streams sharing a connection may interleave, so the single request/response helpers (process_frame, request_metrics, close_stream) expect
+#nothing else to be outstanding on the connection
+class LaneServiceClient:
+    __slots__ = ("connection", "connection_file")
+
+    def __init__(self, address):
+        if (isinstance(address, str)):
+            self.connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.connection.connect(address)
+        else:
+            self.connection = socket.create_connection(address)
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        #buffered reads of whole responses
+        self.connection_file = self.connection.makefile("rb")
+
+    #send a request (image is an rgb frame for frame requests, None otherwise)
+    def send_request(self, message_type, stream_id, frame_number=0, image=None):
+        encoded_stream_id = stream_id.encode("utf-8")
+        rows, cols = (0, 0) if (image is None) else image.shape[:2]
+        self.connection.sendall(request_header.pack(message_type, len(encoded_stream_id), frame_number, rows, cols) + encoded_stream_id)
+        if (image is not None):
+            self.connection.sendall(np.ascontiguousarray(image, dtype=np.uint8))
+
+    #send a frame of a stream without waiting for its response
+    def send_frame(self, stream_id, frame_number, image):
+        self.send_request(frame_message_type, stream_id, frame_number, image)
+
+    #receive the next response, returns (message_type, status, stream_id, frame_number, payload)
+    def receive_response(self):
+        message_type, status, stream_id_length, frame_number, payload_length = response_header.unpack(self.receive_exactly(response_header.size))
+        stream_id = self.receive_exactly(stream_id_length).decode("utf-8")
+        return (message_type, status, stream_id, frame_number, self.receive_exactly(payload_length))
+
+    #receive exactly num_bytes bytes
+    def receive_exactly(self, num_bytes):
+        received_bytes = self.connection_file.read(num_bytes)
+        if (len(received_bytes) < num_bytes):
+            raise ConnectionError("the lane service closed the connection")
+        return received_bytes
+
+    #send a frame and wait for its response, returns (status, lane estimate) where the lane estimate is as decode_lane_estimate returns (None unless
+    #the status is ok or no_lane), raises RuntimeError if the frame couldn't be processed
+    def process_frame(self, stream_id, frame_number, image):
+        self.send_frame(stream_id, frame_number, image)
+        _, status, _, _, payload = self.receive_response()
+        if (status == error_status):
+            raise RuntimeError(payload.decode("utf-8"))
+        return (status, decode_lane_estimate(payload) if (status in (ok_status, no_lane_status)) else None)
+
+    #request the metrics of a stream (of every stream for an empty stream id)
+    def request_metrics(self, stream_id=""):
+        self.send_request(metrics_message_type, stream_id)
+        _, status, _, _, payload = self.receive_response()
+        if (status == error_status):
+            raise RuntimeError(payload.decode("utf-8"))
+        return json.loads(payload.decode("utf-8"))
+
+    #close a stream (dropping its tracking state), returns once its pending frames are answered
+    def close_stream(self, stream_id):
+        self.send_request(close_message_type, stream_id)
+        self.receive_response()
+
+    #close the connection
+    def close(self):
+        self.connection_file.close()
+        self.connection.close()
+
+#stream a video's frames through a running lane service (keeping up to max_frames_in_flight frames sent ahead of their responses) and print the
+#stream's metrics, returns the number of frames answered with a lane estimate
+def execute_lane_service_replay(address, path_to_video, stream_id="replay", max_frames_in_flight=2, max_frames=None):
+    #(imported here as only a replay reads video)
+    from frame_io import generate_frame_source
+    frame_source = generate_frame_source(path_to_video)
+    lane_service_client = LaneServiceClient(address)
+    num_frames_sent = 0
+    num_frames_answered = 0
+    status_counts = [0, 0, 0, 0]
+    try:
+        frame = frame_source[2]()
+        while ((frame is not None) or (num_frames_answered < num_frames_sent)):
+            #keep the window full, then wait for the oldest response
+            if ((frame is not None) and ((num_frames_sent - num_frames_answered) < max_frames_in_flight)):
+                lane_service_client.send_frame(stream_id, num_frames_sent, frame)
+                num_frames_sent += 1
+                frame = frame_source[2]() if ((max_frames is None) or (num_frames_sent < max_frames)) else None
+                continue
+            status_counts[lane_service_client.receive_response()[1]] += 1
+            num_frames_answered += 1
+        print(json.dumps(lane_service_client.request_metrics(stream_id), indent=2))
+        lane_service_client.close_stream(stream_id)
+    finally:
+        lane_service_client.close()
+        frame_source[3]()
+    print("{0} frames: {1} ok, {2} no lane, {3} dropped, {4} failed".format(num_frames_answered, *status_counts))
+    return status_counts[ok_status]
+
+#parse a localhost tcp address, e.g., '127.0.0.1:8765'
+def parse_tcp_address(tcp_address):
+    host, port = tcp_address.rsplit(":", 1)
+    return (host, int(port))
+
+#parse the command line arguments (defaults come from the settings in main)
+def parse_lane_service_arguments(main, argv=None):
+    parser = argparse.ArgumentParser(description="Serve lane estimates for raw frames sent over a unix domain socket or localhost tcp.")
+    address_group = parser.add_mutually_exclusive_group()
+    address_group.add_argument("--unix", default=None, help="unix domain socket to listen on (the default, at lane_service.sock)")
+    address_group.add_argument("--tcp", type=parse_tcp_address, default=None, help="localhost address to listen on instead, e.g. 127.0.0.1:8765")
+    parser.add_argument("--workers", type=int, default=0, help="worker processes running the stateless stages (0 runs them on threads in the service process)")
+    parser.add_argument("--stateless-threads", type=int, default=2, help="threads running the stateless stages when there are no worker processes")
+    parser.add_argument("--stateful-threads", type=int, default=2, help="threads running the stateful stages (each stream's frames still run in order)")
+    parser.add_argument("--max-batch-size", type=int, default=8, help="most frames gathered into a micro-batch")
+    parser.add_argument("--max-batch-delay-ms", type=float, default=1.0, help="longest a frame waits for others to join its micro-batch")
+    parser.add_argument("--max-pending-frames", type=int, default=32, help="most frames admitted at once across every stream (reading stops beyond this)")
+    parser.add_argument("--max-stream-frames-in-flight", type=int, default=4, help="most frames admitted at once per stream (frames beyond this are dropped)")
+    parser.add_argument("--replay", default=None, help="stream this video through a running service at the address instead of serving")
+    main.add_pipeline_arguments(parser, include_raw_pipe=False)
+    arguments = parser.parse_args(argv)
+    if ((arguments.unix is None) and (arguments.tcp is None)):
+        arguments.unix = "lane_service.sock"
+    return arguments
+
+#run the lane service command
+def execute_lane_service_command(argv=None):
+    #(imported here so clients importing this module don't pull in the whole pipeline)
+    import main
+    arguments = parse_lane_service_arguments(main, argv)
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+    if (arguments.replay is not None):
+        return (0 if (execute_lane_service_replay(arguments.unix if (arguments.unix is not None) else arguments.tcp, arguments.replay) > 0) else 1)
+    #the camera every stream is assumed to share
+    calibration_components = main.generate_camera_calibration_components(arguments.calibration_images, arguments.calibration_cache)
+    perspective_transform_components = main.generate_road_perspective_transform_components()
+    threshold_processor.set_gaussian_blur_strategy(arguments.blur_strategy)
+    if (arguments.workers > 0):
+        stateless_executor = ProcessPoolExecutor(max_workers=arguments.workers, initializer=initialize_worker, initargs=(arguments.blur_strategy,))
+        num_stateless_workers = arguments.workers
+    else:
+        stateless_executor = ThreadPoolExecutor(max_workers=arguments.stateless_threads)
+        num_stateless_workers = arguments.stateless_threads
+    stateful_executor = ThreadPoolExecutor(max_workers=arguments.stateful_threads)
+    lane_service = LaneService(calibration_components, perspective_transform_components, stateless_executor, num_stateless_workers, stateful_executor,
+                               max_pending_frames=arguments.max_pending_frames, max_stream_frames_in_flight=arguments.max_stream_frames_in_flight,
+                               max_batch_size=arguments.max_batch_size, max_batch_delay=arguments.max_batch_delay_ms / 1000,
+                               use_region_of_interest_thresholding=arguments.use_region_of_interest_thresholding, use_fixed_point_maps=arguments.use_fixed_point_maps,
+                               use_motion_model=arguments.use_motion_model, processing_scale=arguments.processing_scale)
+    try:
+        asyncio.run(serve_lane_service(lane_service, arguments.unix, arguments.tcp))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stateless_executor.shutdown(wait=True, cancel_futures=True)
+        stateful_executor.shutdown(wait=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(execute_lane_service_command())
\ No newline at end of file
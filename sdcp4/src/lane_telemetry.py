@@ -0,0 +1,119 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import numpy as np
+
+#per-frame lane telemetry, streamed to a .npy file of fixed-width records as a run goes (one record per processed frame), e.g.:
+#   telemetry = load_lane_telemetry("output_video/lane_telemetry.npy")
+#   telemetry["lane_curvature"][1000:2000]
+#the file is a plain npy file of a structured array, so np.load(path, mmap_mode="r") reads it too, load_lane_telemetry also reads a file whose run
+#didn't finish cleanly (the record count in the header is only rewritten when records are flushed)
+#either way the file is memory mapped, so a column (or a range of frames) is read without loading the whole run
+
+#search modes recorded for each frame (none means no lane lines were searched for on the frame, e.g., it was extrapolated or passed through)
+search_mode_none = 0
+search_mode_blind = 1
+search_mode_educated = 2
+
+#one record per frame, coefficients are in full resolution warped pixels, curvature and offset in meters, pixel counts and rms fit residuals in
+#full resolution pixels, raw fields (what was measured on the frame, before smoothing or rejection) are nan on frames with no search
+#smoothed fields are the lane drawn on the frame (nan until there is one), rejected flags are set when a lane line's fit was measured but not used
+lane_telemetry_dtype = np.dtype([("frame_index", "<u4"), ("search_mode", "u1"), ("tracking_confident", "u1"), ("left_rejected", "u1"), ("right_rejected", "u1"),
+                                 ("raw_left_coeff", "<f8", (3,)), ("raw_right_coeff", "<f8", (3,)), ("smoothed_left_coeff", "<f8", (3,)), ("smoothed_right_coeff", "<f8", (3,)),
+                                 ("lane_curvature", "<f8"), ("vehicle_offset", "<f8"), ("left_pixel_count", "<f8"), ("right_pixel_count", "<f8"),
+                                 ("left_fit_residual", "<f8"), ("right_fit_residual", "<f8")])
+
+#npy (version 1.0) magic string
+npy_magic = b"\x93NUMPY\x01\x00"
+
+#generate an npy header for num_records records of lane_telemetry_dtype, always padded to the same length (room for any record count)
+#so it can be rewritten in place as records are appended
+def generate_lane_telemetry_header(num_records):
+    header_text = "{{'descr': {0!r}, 'fortran_order': False, 'shape': ({1},), }}".format(np.lib.format.dtype_to_descr(lane_telemetry_dtype), num_records)
+    #padded (with spaces) to the length of the header of a 20 digit record count, rounded up so the records start on a 64 byte boundary
+    header_length = -(-(len(npy_magic) + 2 + len(header_text) - len(str(num_records)) + 20 + 1) // 64) * 64
+    header_text = header_text.ljust(header_length - len(npy_magic) - 2 - 1) + "\n"
+    return npy_magic + np.uint16(len(header_text)).astype("<u2").tobytes() + header_text.encode("latin1")
+
+#streams one lane telemetry record per frame to an npy file, records are buffered and appended records_per_flush at a time
+class LaneTelemetryWriter:
+    __slots__ = ("telemetry_file", "record_buffer", "num_buffered_records", "num_records")
+
+    def __init__(self, path_to_lane_telemetry, records_per_flush=256):
+        telemetry_directory = os.path.dirname(path_to_lane_telemetry)
+        if (telemetry_directory != ""):
+            os.makedirs(telemetry_directory, exist_ok=True)
+        self.telemetry_file = open(path_to_lane_telemetry, "wb")
+        self.telemetry_file.write(generate_lane_telemetry_header(0))
+        self.record_buffer = np.zeros(records_per_flush, dtype=lane_telemetry_dtype)
+        self.num_buffered_records = 0
+        self.num_records = 0
+
+    #record the frame the lane tracker just processed (call once after each frame, in frame order)
+    def record_frame(self, lane_tracker):
+        record = self.record_buffer[self.num_buffered_records]
+        frame_index = lane_tracker.num_frames_processed - 1
+        record["frame_index"] = frame_index
+        record["tracking_confident"] = lane_tracker.lane_tracking_confident
+        #what was measured on this frame (if lane lines were searched for on it, see LaneTracker.last_lane_measurement)
+        lane_measurement = lane_tracker.last_lane_measurement
+        if ((lane_measurement is not None) and (lane_measurement[6] == frame_index)):
+            record["search_mode"] = search_mode_blind if (lane_measurement[7]) else search_mode_educated
+            record["left_rejected"] = not lane_tracker.last_lane_lines_accepted[0]
+            record["right_rejected"] = not lane_tracker.last_lane_lines_accepted[1]
+            record["raw_left_coeff"], record["raw_right_coeff"] = lane_measurement[0], lane_measurement[1]
+            record["left_pixel_count"], record["right_pixel_count"] = lane_measurement[2], lane_measurement[3]
+            record["left_fit_residual"], record["right_fit_residual"] = lane_measurement[4], lane_measurement[5]
+        else:
+            record["search_mode"] = search_mode_none
+            record["left_rejected"] = record["right_rejected"] = False
+            record["raw_left_coeff"] = record["raw_right_coeff"] = np.nan
+            record["left_pixel_count"] = record["right_pixel_count"] = record["left_fit_residual"] = record["right_fit_residual"] = np.nan
+        #what was drawn on this frame
+        lane_estimate = lane_tracker.last_lane_estimate
+        if (lane_estimate is not None):
+            record["smoothed_left_coeff"], record["smoothed_right_coeff"] = lane_estimate[0], lane_estimate[1]
+            record["lane_curvature"], record["vehicle_offset"] = lane_estimate[2], lane_estimate[3]
+        else:
+            record["smoothed_left_coeff"] = record["smoothed_right_coeff"] = np.nan
+            record["lane_curvature"] = record["vehicle_offset"] = np.nan
+        self.num_buffered_records += 1
+        if (self.num_buffered_records == len(self.record_buffer)):
+            self.flush()
+
+    #append the buffered records to the file and rewrite the header's record count
+    def flush(self):
+        if (self.num_buffered_records == 0):
+            return
+        self.telemetry_file.write(self.record_buffer[:self.num_buffered_records].tobytes())
+        self.num_records += self.num_buffered_records
+        self.num_buffered_records = 0
+        self.telemetry_file.seek(0)
+        self.telemetry_file.write(generate_lane_telemetry_header(self.num_records))
+        self.telemetry_file.seek(0, os.SEEK_END)
+        self.telemetry_file.flush()
+
+    #flush the remaining records and close the file, returns the number of records written
+    def close(self):
+        self.flush()
+        self.telemetry_file.close()
+        return self.num_records
+
+#load a lane telemetry file as a (read only) memory mapped structured array of lane_telemetry_dtype records
+#the record count is taken from the file's size (so a run that didn't finish cleanly still reads up to its last complete record)
+def load_lane_telemetry(path_to_lane_telemetry):
+    with open(path_to_lane_telemetry, "rb") as telemetry_file:
+        np.lib.format.read_magic(telemetry_file)
+        _, _, record_dtype = np.lib.format.read_array_header_1_0(telemetry_file)
+        records_offset = telemetry_file.tell()
+    num_records = (os.path.getsize(path_to_lane_telemetry) - records_offset) // record_dtype.itemsize
+    if (num_records == 0):
+        return np.zeros(0, dtype=record_dtype)
+    return np.memmap(path_to_lane_telemetry, dtype=record_dtype, mode="r", offset=records_offset, shape=(num_records,))
\ No newline at end of file
@@ -0,0 +1,510 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import time
+import cv2
+import numpy as np
+from geometry_processor import generate_geometry_spec, retrieve_geometry_components, perform_geometry_undistort, perform_geometry_warp, compute_warped_image_shape
+from threshold_processor import perform_fused_thresholding, perform_region_of_interest_thresholding, generate_threshold_parameters
+from lane_processor import (perform_educated_lane_line_pixel_search, perform_blind_lane_line_pixel_search, compute_lane_line_coefficients_from_moments, compute_curvature_of_lane_lines,
+                            compute_vehicle_offset, generate_lane_line_search_regions, compute_scaled_search_parameters, generate_search_parameters)
+from fit_processor import accumulate_polynomial_moments, compute_polynomial_fit_residual, convert_coefficients_from_processing_scale, convert_coefficients_to_processing_scale
+from lane_motion_model import LaneLineMotionModel, compute_lane_line_measurement_confidence, max_search_margin
+from overlay_processor import generate_overlay_buffer, compute_lane_overlay_polygons, perform_lane_overlay_rendering
+from buffer_pool import retrieve_frame_buffer, retrieve_output_frame_buffer
+from instrumentation_processor import mark_stage_boundary, compute_stage_measurements
+
+#minimum number of pixels that must be found for each lane line for tracking to be considered confident
+min_lane_line_pixel_count_for_tracking = 1000
+
+#levels of work a frame can be processed at, from the full pipeline down to the cheapest (see process_frame_at_degradation_level)
+#   'full'              - the full pipeline
+#   'reduced_threshold' - only the search bands around the latest lane lines are thresholded (regardless of confidence), with the cheaper box blur
+#   'extrapolate'       - no thresholding or lane detection, the lane is drawn from the smoothed coefficient history (which is left unchanged)
+#   'pass_through'      - the raw frame is passed through with the last lane overlay and text drawn on it (not even undistorted)
+degradation_levels = ("full", "reduced_threshold", "extrapolate", "pass_through")
+
+#blur strategy used by the reduced cost thresholding path (see threshold_processor.gaussian_blur_strategies)
+reduced_cost_blur_strategy = 'box'
+
+#run the stages of the pipeline that carry no state between frames (distortion correction, perspective transform, thresholding)
+#this is a plain function of its arguments (the geometry is looked up by its spec), so any worker process can run it for any stream
+#returns the undistorted image (to project the lane back onto), the warped image, and the thresholded warped image (to search for lane lines in)
+#in region of interest mode thresholding is left to the stateful stages (the thresholded image is None), otherwise the warped image isn't needed (it is None)
+#when record_stage_durations is set, the (duration in seconds, peak transient bytes) of undistort, warp and threshold are returned last (otherwise None),
+#to be recorded by the tracker (each stage's peak is measured on its own, and only while allocations are being traced, see mark_stage_boundary)
+#with a buffer_pool (see buffer_pool) the undistorted image is written into the pool's next output frame and everything else into its working arrays
+#unless undistort_image is set the undistorted image (only needed to draw the lane onto) isn't produced (it is None)
+#threshold_parameters are those of threshold_processor (None uses its defaults), with pack_thresholded_image set the thresholded image is a packed mask
+#(see packed_mask, 8x smaller to ship back from a worker process)
+def perform_stateless_frame_stages(image, geometry_spec, use_region_of_interest_thresholding=False, record_stage_durations=False, buffer_pool=None, undistort_image=True, threshold_parameters=None,
+                                   pack_thresholded_image=False):
+    #remap tables for this stream's camera (generated on first use in this process, then reused)
+    geometry_components = retrieve_geometry_components(geometry_spec)
+    stage_marks = None
+    if (record_stage_durations):
+        stage_marks = []
+        mark_stage_boundary(stage_marks)
+
+    ###################################
+    ## PERFORM DISTORTION CORRECTION ##
+    ###################################
+
+    #undistort image (using the precomputed undistort map, the undistorted image is what we project the lane back onto)
+    undistorted_image = None
+    if (undistort_image):
+        undistorted_image = perform_geometry_undistort(image, geometry_components, retrieve_output_frame_buffer(buffer_pool, image.shape))
+    if (record_stage_durations):
+        mark_stage_boundary(stage_marks)
+
+    ###################################
+    ## PERFORM PERSPECTIVE TRANSFORM ##
+    ###################################
+
+    #transform perspective (warp) - this will squish the depth of field in the source mapping into the height of the image,
+    #which will make the upper 3/4ths blurry, need to adjust dest_upper* y-values to negative to stretch it out and clear the transformed image up
+    #we won't do that as we'll lose right dashes in the 720 pix height of the image frame
+    #the fused map undistorts and warps the raw image in a single resampling pass (rather than warping the undistorted image)
+    warped_undistorted_image = perform_geometry_warp(image, geometry_components, retrieve_frame_buffer(buffer_pool, "warped", compute_warped_image_shape(image.shape, geometry_components)))
+    if (record_stage_durations):
+        mark_stage_boundary(stage_marks)
+
+    #######################################
+    ## PERFORM COLOR/GRADIENT THRESHOLD  ##
+    #######################################
+
+    #thresholding depends on the previous frame's lane lines in region of interest mode (it's performed in the stateful stages)
+    if (use_region_of_interest_thresholding):
+        return (undistorted_image, warped_undistorted_image, None, compute_stage_measurements(stage_marks))
+
+    #apply thresholding to warped image and produce a binary result (fused kernel, identical result to perform_thresholding)
+    thresholded_warped_undistorted_image = perform_fused_thresholding(warped_undistorted_image, processing_scale=geometry_spec[5], buffer_pool=buffer_pool, threshold_parameters=threshold_parameters,
+                                                                       pack_mask=pack_thresholded_image)
+    if (record_stage_durations):
+        mark_stage_boundary(stage_marks)
+
+    #return the inputs to the stateful stages
+    return (undistorted_image, None, thresholded_warped_undistorted_image, compute_stage_measurements(stage_marks))
+
+#tracks the lane lines of a single camera stream from frame to frame
+#all per-stream state lives on the tracker (nothing is global), so one process can track any number of streams and they can all share one worker pool
+#lane line coefficient history is kept in a fixed-size ring buffer, and smoothed with a running sum over it, or (use_motion_model) the lane lines
+#are tracked by an alpha-beta filter (see lane_motion_model) which predicts each frame's search band and only falls back to a blind search once
+#the lane is really lost
+class LaneTracker:
+    __slots__ = ("calibration_components", "perspective_transform_components", "geometry_spec", "geometry_components", "region_of_interest_thresholding_enabled",
+                 "lane_tracking_confident", "coeff_history", "coeff_history_sum", "coeff_history_count", "coeff_history_next_index", "motion_model", "processing_scale", "overlay_buffer",
+                 "last_lane_overlay_polygons", "last_lane_overlay_text", "last_lane_estimate", "last_lane_measurement", "last_lane_lines_accepted", "stage_timings", "buffer_pool", "lane_rendering_enabled",
+                 "threshold_parameters", "search_parameters", "packed_masks_enabled", "num_frames_processed")
+
+    #calibration_components is (camera_matrix, distortion_coeff), perspective_transform_components is (warp_perspective_matrix, unwarp_perspective_matrix)
+    #image_size is (cols, rows) of the stream's frames, history_length is the number of sets of coefficients smoothed over
+    #use_region_of_interest_thresholding only thresholds the search bands around the previous frame's lane lines while tracking is confident
+    #stage_timings (see instrumentation_processor) records how long each stage takes on each frame (None disables instrumentation)
+    #use_motion_model tracks the lane lines with a motion model rather than smoothing over the coefficient history
+    #processing_scale runs the warp, thresholding and lane line searches on a resampled (e.g., 0.5 for half resolution) bird's eye view, the pixel
+    #parameters of those stages are scaled to match, and the fitted lane lines are converted back to full resolution for tracking, drawing and metrics
+    #buffer_pool (see buffer_pool) supplies the working arrays of the stages run in this process, so the steady state allocates nothing image sized,
+    #returned frames then come from its ring of output frames (each is only valid until the ring comes back around to it)
+    #unless render_lane is set, frames are neither undistorted nor drawn on (every process method returns None), only last_lane_estimate is updated
+    #threshold_parameters and search_parameters override the defaults of threshold_processor and lane_processor (see generate_threshold_parameters and
+    #generate_search_parameters), the search's window_margin stands in for the motion model's max_search_margin (its bands are scaled to match)
+    #use_packed_masks thresholds into packed masks (see packed_mask), which are shipped back from worker processes and searched without unpacking
+    def __init__(self, calibration_components, perspective_transform_components, image_size, use_fixed_point_maps=True, history_length=10, use_region_of_interest_thresholding=False, stage_timings=None,
+                 use_motion_model=False, processing_scale=1.0, buffer_pool=None, render_lane=True, threshold_parameters=None, search_parameters=None, use_packed_masks=True):
+        self.calibration_components = calibration_components
+        self.perspective_transform_components = perspective_transform_components
+        #the geometry spec is what gets shipped to worker processes (the remap tables themselves are shared by every tracker of the same camera)
+        self.geometry_spec = generate_geometry_spec(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps, processing_scale)
+        self.geometry_components = retrieve_geometry_components(self.geometry_spec)
+        self.region_of_interest_thresholding_enabled = use_region_of_interest_thresholding
+        self.lane_tracking_confident = False
+        #ring buffer of [left, right] polynomial coefficients, its running sum, number of sets stored, and the slot the next set is written to
+        self.coeff_history = np.zeros((history_length, 2, 3))
+        self.coeff_history_sum = np.zeros((2, 3))
+        self.coeff_history_count = 0
+        self.coeff_history_next_index = 0
+        self.motion_model = LaneLineMotionModel() if (use_motion_model) else None
+        self.processing_scale = float(processing_scale)
+        #reused to draw the lane overlay on every frame (allocated on the first frame)
+        self.overlay_buffer = None
+        #the last lane overlay drawn (projected polygons and text lines), redrawn as is on frames that are passed through
+        self.last_lane_overlay_polygons = None
+        self.last_lane_overlay_text = None
+        #the last lane estimate drawn (left coefficients, right coefficients, curvature, offset) in full resolution warped pixels and meters
+        self.last_lane_estimate = None
+        #the last lane lines measured (left coefficients, right coefficients, left pixel count, right pixel count, left rms fit residual, right rms fit residual,
+        #frame index, blind search performed) in full resolution warped pixels, before smoothing or rejection (a lane line without pixels has nan coefficients and residual)
+        self.last_lane_measurement = None
+        #whether each of the last lane lines measured was [left, right] used by the smoothing (false if its fit was rejected)
+        self.last_lane_lines_accepted = None
+        self.stage_timings = stage_timings
+        self.buffer_pool = buffer_pool
+        self.lane_rendering_enabled = render_lane
+        self.threshold_parameters = generate_threshold_parameters(**(threshold_parameters or {}))
+        self.search_parameters = generate_search_parameters(**(search_parameters or {}))
+        self.packed_masks_enabled = use_packed_masks
+        self.num_frames_processed = 0
+
+    #return the latest (most recently added) set of left and right lane line coefficients
+    def retrieve_latest_coefficients(self):
+        latest_coeff = self.coeff_history[self.coeff_history_next_index - 1]
+        return (latest_coeff[0], latest_coeff[1])
+
+    #add a set of left and right lane line coefficients to the history, replacing the oldest set once the history is full
+    def append_coefficients(self, left_lane_line_coeff, right_lane_line_coeff):
+        history_length = len(self.coeff_history)
+        #drop the oldest set from the running sum (it's about to be overwritten)
+        if (self.coeff_history_count == history_length):
+            self.coeff_history_sum -= self.coeff_history[self.coeff_history_next_index]
+        else:
+            self.coeff_history_count += 1
+        self.coeff_history[self.coeff_history_next_index, 0] = left_lane_line_coeff
+        self.coeff_history[self.coeff_history_next_index, 1] = right_lane_line_coeff
+        self.coeff_history_sum += self.coeff_history[self.coeff_history_next_index]
+        self.coeff_history_next_index = (self.coeff_history_next_index + 1) % history_length
+        #recompute the sum outright each time the buffer wraps, so rounding error can't build up over a long stream
+        if (self.coeff_history_next_index == 0):
+            self.coeff_history_sum = np.sum(self.coeff_history, axis=0)
+
+    #return the smoothed (mean of the history) left and right lane line coefficients
+    def compute_smoothed_coefficients(self):
+        smoothed_coeff = self.coeff_history_sum / self.coeff_history_count
+        return (smoothed_coeff[0], smoothed_coeff[1])
+
+    #return the [left, right] coefficients of the lane lines to search around on this frame and the width of the band to search
+    #(coefficients are None when the lane lines have to be found by a blind search), the motion model is advanced to this frame
+    def predict_search_lane_lines(self):
+        if (self.motion_model is None):
+            if (self.coeff_history_count == 0):
+                return (None, max_search_margin)
+            return (self.retrieve_latest_coefficients(), max_search_margin)
+        #a blind search is only needed when the motion model has lost the lane (rather than whenever a single frame goes wrong)
+        if (self.motion_model.is_lost()):
+            return (None, max_search_margin)
+        return (tuple(self.motion_model.predict()), self.motion_model.compute_search_margin())
+
+    #true if there's an estimate of the lane to draw without detecting it in the current frame
+    #(a motion model that has gone max_consecutive_misses frames without a usable measurement no longer has one)
+    def has_lane_estimate(self):
+        if (self.motion_model is None):
+            return (self.coeff_history_count > 0)
+        return (not self.motion_model.is_lost())
+
+    #add the fitted lane lines to the coefficient history (unless the fit is rejected) and return the smoothed lane lines
+    def update_coefficient_history(self, left_lane_line_coeff, right_lane_line_coeff, left_lane_line_pixel_count, right_lane_line_pixel_count):
+        #tracking is confident if enough pixels were found for both lane lines (and the fit isn't rejected below)
+        self.lane_tracking_confident = ((left_lane_line_pixel_count >= min_lane_line_pixel_count_for_tracking) and (right_lane_line_pixel_count >= min_lane_line_pixel_count_for_tracking))
+
+        #if we have at least one set of previous left and right lane coefficients stored in the history
+        fit_rejected = False
+        if (self.coeff_history_count > 0):
+            prev_left_lane_line_coeff, prev_right_lane_line_coeff = self.retrieve_latest_coefficients()
+            #compute the percentage difference between the current left and right coefficients sets and latest set of coefficients in the history
+            left_percent_difference = np.abs(left_lane_line_coeff - prev_left_lane_line_coeff) / np.mean([left_lane_line_coeff, prev_left_lane_line_coeff])
+            right_percent_difference = np.abs(right_lane_line_coeff - prev_right_lane_line_coeff) / np.mean([left_lane_line_coeff, prev_right_lane_line_coeff])
+            #if the percent difference between any of the coefficients exceeds 3%, reuse the latest set of previous coefficients for each lane line
+            #(the history is left as is, which is the same as taking the latest set off and adding it straight back)
+            if (np.any(left_percent_difference > 3) or np.any(right_percent_difference > 3)):
+                fit_rejected = True
+                #the fit was rejected, don't trust it to place the next frame's search bands
+                self.lane_tracking_confident = False
+        #the lane lines are accepted or rejected together
+        self.last_lane_lines_accepted = (not fit_rejected, not fit_rejected)
+
+        #add the current coefficients to the history for use on the next frame (the oldest set is replaced once the history is full)
+        if (not fit_rejected):
+            self.append_coefficients(left_lane_line_coeff, right_lane_line_coeff)
+
+        #smooth the lines by taking the mean of the sets of coefficients currently in the history
+        return self.compute_smoothed_coefficients()
+
+    #compute how far each lane line's fit can be trusted from the number of pixels it was fit to and its rms residual (see lane_motion_model)
+    #the moments and coefficients are those of the fit at the processing scale, counts and residuals are converted to full resolution first
+    def compute_measurement_confidence(self, left_lane_line_moments, right_lane_line_moments, scaled_left_lane_line_coeff, scaled_right_lane_line_coeff):
+        processing_scale = self.processing_scale
+        return np.array([compute_lane_line_measurement_confidence(lane_line_moments[0] / (processing_scale ** 2), compute_polynomial_fit_residual(lane_line_moments, lane_line_coeff) / processing_scale)
+                         for (lane_line_moments, lane_line_coeff) in ((left_lane_line_moments, scaled_left_lane_line_coeff), (right_lane_line_moments, scaled_right_lane_line_coeff))])
+
+    #correct the motion model with the fitted lane lines (or restart it after a blind search) and return the filtered lane lines
+    #each lane line's fit is trusted according to measurement_confidence (see compute_measurement_confidence), a fit that lands beyond the band
+    #that was searched is rejected
+    def update_motion_model(self, image_height, left_lane_line_coeff, right_lane_line_coeff, measurement_confidence, blind_search_performed, search_margin):
+        if (blind_search_performed):
+            self.lane_tracking_confident = self.motion_model.initialize((left_lane_line_coeff, right_lane_line_coeff), measurement_confidence)
+            self.last_lane_lines_accepted = (self.lane_tracking_confident, self.lane_tracking_confident)
+        else:
+            lane_lines_used = self.motion_model.update((left_lane_line_coeff, right_lane_line_coeff), measurement_confidence, image_height, search_margin)
+            self.last_lane_lines_accepted = (bool(lane_lines_used[0]), bool(lane_lines_used[1]))
+            #only place the next frame's thresholding regions from the model when both lane lines were measured
+            self.lane_tracking_confident = bool(np.all(lane_lines_used))
+        #nothing usable has been measured yet, draw the fit as is
+        if (self.motion_model.coeff_state is None):
+            return (left_lane_line_coeff, right_lane_line_coeff)
+        return (self.motion_model.coeff_state[0], self.motion_model.coeff_state[1])
+
+    #submit the stateless stages of a frame to the supplied executor, returns a future for the inputs to perform_stateful_frame_stages
+    #(the buffer pool isn't shipped with them, worker processes allocate their results as they're sent back anyway)
+    def submit_frame(self, executor, image):
+        return executor.submit(perform_stateless_frame_stages, image, self.geometry_spec, self.region_of_interest_thresholding_enabled, self.stage_timings is not None, None, self.lane_rendering_enabled,
+                               self.threshold_parameters, self.packed_masks_enabled)
+
+    #process a frame of video through the pipeline
+    def process_frame(self, image):
+        #the stateless stages followed by the stateful stages (exactly what the parallel path does, minus the pool)
+        return self.perform_stateful_frame_stages(*perform_stateless_frame_stages(image, self.geometry_spec, self.region_of_interest_thresholding_enabled, self.stage_timings is not None, self.buffer_pool,
+                                                                                  self.lane_rendering_enabled, self.threshold_parameters, self.packed_masks_enabled))
+
+    #process a frame of video at one of the degradation_levels (an index into it), trading accuracy for time when a frame is running late
+    #levels that need lane lines from earlier frames fall back to passing the frame through until the history has a set of coefficients
+    def process_frame_at_degradation_level(self, image, degradation_level):
+        #the full pipeline
+        if (degradation_level == 0):
+            return self.process_frame(image)
+        #reduced cost thresholding (the stateless stages leave thresholding to the stateful stages, just as in region of interest mode)
+        if (degradation_level == 1):
+            return self.perform_stateful_frame_stages(*perform_stateless_frame_stages(image, self.geometry_spec, True, self.stage_timings is not None, self.buffer_pool, self.lane_rendering_enabled),
+                                                      use_reduced_cost_thresholding=True)
+        #skip detection and draw the lane from the smoothed coefficient history
+        if ((degradation_level == 2) and self.has_lane_estimate()):
+            return self.perform_extrapolated_frame_stages(image)
+        #pass the frame through with the last lane overlay
+        return self.perform_pass_through_frame_stages(image)
+
+    #draw the lane from the smoothed coefficient history without looking for lane lines in the frame (the history is left unchanged)
+    #with a motion model, the lane lines are extrapolated to this frame instead (the model is advanced but not corrected, so the frame counts as a miss)
+    def perform_extrapolated_frame_stages(self, image):
+        frame_index = self.num_frames_processed
+        self.num_frames_processed += 1
+        stage_start_time = time.perf_counter()
+        #the lane is still projected onto the undistorted image
+        undistorted_image = None
+        if (self.lane_rendering_enabled):
+            undistorted_image = perform_geometry_undistort(image, self.geometry_components, retrieve_output_frame_buffer(self.buffer_pool, image.shape))
+        if (self.stage_timings is not None):
+            stage_start_time = self.stage_timings.record_stage_since(frame_index, "undistort", stage_start_time)
+        #the smoothed (or extrapolated) coefficients are the best estimate of the lane available without detection
+        if (self.motion_model is not None):
+            left_lane_line_coeff, right_lane_line_coeff = self.motion_model.predict()
+            #nothing was measured on this frame, so the rates decay and max_consecutive_misses applies just as it does to a failed search
+            self.motion_model.register_miss()
+        else:
+            left_lane_line_coeff, right_lane_line_coeff = self.compute_smoothed_coefficients()
+        return self.render_lane_estimate(frame_index, undistorted_image, left_lane_line_coeff, right_lane_line_coeff, stage_start_time)
+
+    #pass a frame through untouched apart from redrawing the last lane overlay and text on it
+    def perform_pass_through_frame_stages(self, image):
+        frame_index = self.num_frames_processed
+        self.num_frames_processed += 1
+        return self.render_last_lane_overlay(frame_index, image, time.perf_counter())
+
+    #redraw the last lane overlay and text onto an image (the image itself if nothing has been drawn yet), stage_start_time is when rendering started
+    def render_last_lane_overlay(self, frame_index, image, stage_start_time):
+        #nothing to draw on
+        if (not self.lane_rendering_enabled):
+            return None
+        #nothing has been drawn yet
+        if (self.last_lane_overlay_polygons is None):
+            return image
+        #decoded frames may be read only views of the decoder's buffer
+        if (not image.flags.writeable):
+            writeable_image = retrieve_output_frame_buffer(self.buffer_pool, image.shape, image.dtype)
+            np.copyto(writeable_image, image)
+            image = writeable_image
+        if ((self.overlay_buffer is None) or (self.overlay_buffer.shape != image.shape)):
+            self.overlay_buffer = generate_overlay_buffer(image.shape)
+        projected_lane = perform_lane_overlay_rendering(image, self.last_lane_overlay_polygons, self.overlay_buffer)
+        self.render_lane_overlay_text(projected_lane, self.last_lane_overlay_text)
+        if (self.stage_timings is not None):
+            self.stage_timings.record_stage_since(frame_index, "render", stage_start_time)
+        return projected_lane
+
+    #run the stages of the pipeline that depend on previous frames (lane detection, smoothing) and project the result back onto the road
+    #frames must be supplied in order, as the coefficient history carries state from one frame to the next
+    #the thresholded image may be a binary image or a packed mask (see packed_mask)
+    #stateless_stage_measurements are the (duration, peak bytes) of undistort, warp and threshold returned by perform_stateless_frame_stages (if recorded)
+    #use_reduced_cost_thresholding thresholds only the search bands around the tracked lane lines (even if tracking isn't confident) with the cheaper
+    #reduced_cost_blur_strategy (the full frame is still thresholded, with the cheaper blur, whenever a blind search is needed)
+    def perform_stateful_frame_stages(self, undistorted_image, warped_undistorted_image, thresholded_warped_undistorted_image, stateless_stage_measurements=None, use_reduced_cost_thresholding=False):
+        #frame number (within this stream) and timing, if instrumented
+        frame_index = self.num_frames_processed
+        self.num_frames_processed += 1
+        stage_timings = self.stage_timings
+        stage_start_time = None
+        if (stage_timings is not None):
+            if (stateless_stage_measurements is not None):
+                for stage_name, (stage_duration, stage_peak_bytes) in zip(("undistort", "warp", "threshold"), stateless_stage_measurements):
+                    stage_timings.record_stage_duration(frame_index, stage_name, stage_duration, stage_peak_bytes)
+            stage_start_time = time.perf_counter()
+
+        #lane lines to search around on this frame and the width of the band searched (advancing the motion model, if tracking with one)
+        search_lane_line_coeff, search_margin = self.predict_search_lane_lines()
+        #the same, at the processing scale (thresholding and searching run on the scaled bird's eye view, everything else at full resolution)
+        processing_scale = self.processing_scale
+        search_parameters = self.search_parameters
+        if (search_parameters["window_margin"] != max_search_margin):
+            search_margin = search_margin * (search_parameters["window_margin"] / max_search_margin)
+        scaled_search_margin, scaled_min_pixel_count_to_recenter = compute_scaled_search_parameters(processing_scale, search_margin, search_parameters["min_pixel_count_to_recenter"])
+        if (search_lane_line_coeff is not None):
+            scaled_search_lane_line_coeff = convert_coefficients_to_processing_scale(np.stack(search_lane_line_coeff), processing_scale)
+
+        ################################################################
+        ## PERFORM COLOR/GRADIENT THRESHOLD (REGION OF INTEREST MODE) ##
+        ################################################################
+
+        #if the stateless stages left thresholding to us
+        if (thresholded_warped_undistorted_image is None):
+            blur_strategy = reduced_cost_blur_strategy if (use_reduced_cost_thresholding) else None
+            #while tracking is confident, only threshold the regions covering the search bands around the lane lines being searched for
+            if ((search_lane_line_coeff is not None) and (self.lane_tracking_confident or use_reduced_cost_thresholding)):
+                search_regions = generate_lane_line_search_regions(warped_undistorted_image.shape, *scaled_search_lane_line_coeff, window_margin=scaled_search_margin, num_strips=4)
+                thresholded_warped_undistorted_image = perform_region_of_interest_thresholding(warped_undistorted_image, search_regions, blur_strategy, processing_scale, self.buffer_pool,
+                                                                                               self.threshold_parameters, self.packed_masks_enabled)
+            #otherwise fall back to thresholding the full frame
+            else:
+                thresholded_warped_undistorted_image = perform_fused_thresholding(warped_undistorted_image, blur_strategy, processing_scale, self.buffer_pool, self.threshold_parameters,
+                                                                                  self.packed_masks_enabled)
+            if (stage_timings is not None):
+                stage_start_time = stage_timings.record_stage_since(frame_index, "threshold", stage_start_time)
+
+        #############################
+        ## PERFORM LANE DETECTION  ##
+        #############################
+
+        #if this is the very first frame (or the motion model has lost the lane), we must do a blind search for the lane lines
+        if (search_lane_line_coeff is None):
+            #map out the left and right lane line pixel locations via windowed search
+            left_lane_pixel_coordinates, right_lane_pixel_coordinates, _ = perform_blind_lane_line_pixel_search(thresholded_warped_undistorted_image, return_debug_image=False, window_margin=scaled_search_margin,
+                                                                                                              min_pixel_count_to_recenter=scaled_min_pixel_count_to_recenter,
+                                                                                                              num_windows=search_parameters["num_windows"])
+            if (stage_timings is not None):
+                stage_start_time = stage_timings.record_stage_since(frame_index, "blind_search", stage_start_time)
+        else:
+            #otherwise use the tracked lane lines as a starting place to accelerate our lane search for this frame
+            #map out the left and right lane line pixel coordinates via windowed search using previous polynomials as starting place
+            left_lane_pixel_coordinates, right_lane_pixel_coordinates, _ = perform_educated_lane_line_pixel_search(thresholded_warped_undistorted_image, scaled_search_lane_line_coeff[0], scaled_search_lane_line_coeff[1], None, None,
+                                                                                                                  return_debug_image=False, window_margin=scaled_search_margin)
+            if (stage_timings is not None):
+                stage_start_time = stage_timings.record_stage_since(frame_index, "educated_search", stage_start_time)
+
+        #compute the polynomial coefficients for each lane line using the x and y pixel locations from the mapping function
+        #we're fitting (computing coefficients of) a second order polynomial: f(y) = A(y^2) + By + C
+        #we're fitting for f(y) rather than f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value
+        #(the moments are kept so the motion model can weigh each fit by its residual)
+        left_lane_line_moments = accumulate_polynomial_moments(left_lane_pixel_coordinates)
+        right_lane_line_moments = accumulate_polynomial_moments(right_lane_pixel_coordinates)
+        scaled_left_lane_line_coeff, scaled_right_lane_line_coeff = compute_lane_line_coefficients_from_moments(left_lane_line_moments, right_lane_line_moments)
+        #a lane line without a single pixel has no fit, the frame is a miss
+        if ((scaled_left_lane_line_coeff is None) or (scaled_right_lane_line_coeff is None)):
+            return self.perform_missed_frame_stages(frame_index, undistorted_image, left_lane_line_moments, right_lane_line_moments, scaled_left_lane_line_coeff, scaled_right_lane_line_coeff,
+                                                    search_lane_line_coeff is None, stage_start_time)
+        #convert the fit back to full resolution
+        left_lane_line_coeff, right_lane_line_coeff = convert_coefficients_from_processing_scale(np.stack((scaled_left_lane_line_coeff, scaled_right_lane_line_coeff)), processing_scale)
+        #keep the measurement (pixel counts and residuals converted to full resolution)
+        self.last_lane_measurement = (left_lane_line_coeff, right_lane_line_coeff, left_lane_line_moments[0] / (processing_scale ** 2), right_lane_line_moments[0] / (processing_scale ** 2),
+                                      float(compute_polynomial_fit_residual(left_lane_line_moments, scaled_left_lane_line_coeff)) / processing_scale,
+                                      float(compute_polynomial_fit_residual(right_lane_line_moments, scaled_right_lane_line_coeff)) / processing_scale,
+                                      frame_index, search_lane_line_coeff is None)
+        if (stage_timings is not None):
+            stage_start_time = stage_timings.record_stage_since(frame_index, "fit", stage_start_time)
+
+        #smooth the lines (trading off line accuracy for reduced jitter), either by filtering them with the motion model
+        if (self.motion_model is not None):
+            measurement_confidence = self.compute_measurement_confidence(left_lane_line_moments, right_lane_line_moments, scaled_left_lane_line_coeff, scaled_right_lane_line_coeff)
+            left_lane_line_coeff, right_lane_line_coeff = self.update_motion_model(self.geometry_spec[3][1], left_lane_line_coeff, right_lane_line_coeff, measurement_confidence,
+                                                                                   search_lane_line_coeff is None, search_margin)
+        #or by taking the mean of the sets of coefficients in the history (pixel counts are converted to full resolution)
+        else:
+            left_lane_line_coeff, right_lane_line_coeff = self.update_coefficient_history(left_lane_line_coeff, right_lane_line_coeff, len(left_lane_pixel_coordinates) / (processing_scale ** 2),
+                                                                                          len(right_lane_pixel_coordinates) / (processing_scale ** 2))
+        if (stage_timings is not None):
+            stage_start_time = stage_timings.record_stage_since(frame_index, "smoothing", stage_start_time)
+
+        #project the smoothed lane lines back onto the road
+        return self.render_lane_estimate(frame_index, undistorted_image, left_lane_line_coeff, right_lane_line_coeff, stage_start_time)
+
+    #finish a frame on which a lane line search found no pixels at all for one of the lane lines (see compute_lane_line_coefficients_from_moments)
+    #the frame counts as a miss: nothing is added to the coefficient history or corrects the motion model (which registers a miss), the measurement is kept
+    #with nan coefficients for the empty lane line, and the lane drawn is the tracked (or smoothed) lane, or the last overlay if there isn't one yet
+    def perform_missed_frame_stages(self, frame_index, undistorted_image, left_lane_line_moments, right_lane_line_moments, scaled_left_lane_line_coeff, scaled_right_lane_line_coeff,
+                                    blind_search_performed, stage_start_time):
+        processing_scale = self.processing_scale
+        lane_line_measurements = [((convert_coefficients_from_processing_scale(lane_line_coeff, processing_scale), float(compute_polynomial_fit_residual(lane_line_moments, lane_line_coeff)) / processing_scale)
+                                   if (lane_line_coeff is not None) else (np.full(3, np.nan), np.nan))
+                                  for (lane_line_moments, lane_line_coeff) in ((left_lane_line_moments, scaled_left_lane_line_coeff), (right_lane_line_moments, scaled_right_lane_line_coeff))]
+        self.last_lane_measurement = (lane_line_measurements[0][0], lane_line_measurements[1][0], left_lane_line_moments[0] / (processing_scale ** 2), right_lane_line_moments[0] / (processing_scale ** 2),
+                                      lane_line_measurements[0][1], lane_line_measurements[1][1], frame_index, blind_search_performed)
+        self.last_lane_lines_accepted = (False, False)
+        self.lane_tracking_confident = False
+        if (self.motion_model is not None):
+            self.motion_model.register_miss()
+        if (self.stage_timings is not None):
+            stage_start_time = self.stage_timings.record_stage_since(frame_index, "fit", stage_start_time)
+        #the lane as it was before this frame
+        if ((self.motion_model is not None) and (self.motion_model.coeff_state is not None)):
+            return self.render_lane_estimate(frame_index, undistorted_image, self.motion_model.coeff_state[0], self.motion_model.coeff_state[1], stage_start_time)
+        if ((self.motion_model is None) and (self.coeff_history_count > 0)):
+            return self.render_lane_estimate(frame_index, undistorted_image, *self.compute_smoothed_coefficients(), stage_start_time)
+        #no lane has been found yet
+        return self.render_last_lane_overlay(frame_index, undistorted_image, stage_start_time)
+
+    #compute the curvature and offset of the supplied (smoothed) lane lines, then draw the lane and tracking text onto the undistorted image (in place)
+    #the projected polygons and text are kept for frames that are passed through, stage_start_time is when the curvature stage started (if instrumented)
+    def render_lane_estimate(self, frame_index, undistorted_image, left_lane_line_coeff, right_lane_line_coeff, stage_start_time=None):
+        stage_timings = self.stage_timings
+        #(rows, cols) of the stream's frames
+        image_shape = (self.geometry_spec[3][1], self.geometry_spec[3][0])
+
+        ## compute lane curvature ##
+        #(the warped image has the same dimensions as the undistorted image)
+        left_curvature, right_curvature = compute_curvature_of_lane_lines(image_shape, left_lane_line_coeff, right_lane_line_coeff)
+
+        ## compute vehicle offset from center ##
+        vehicle_offset = compute_vehicle_offset(image_shape, left_lane_line_coeff, right_lane_line_coeff)
+        lane_curvature = np.mean([left_curvature, right_curvature])
+        self.last_lane_estimate = (left_lane_line_coeff, right_lane_line_coeff, float(lane_curvature), float(vehicle_offset))
+        if (stage_timings is not None):
+            stage_start_time = stage_timings.record_stage_since(frame_index, "curvature_offset", stage_start_time)
+
+        #the estimate is all that's needed
+        if (not self.lane_rendering_enabled):
+            return None
+
+        ########################################
+        ## PERFORM PROJECTION BACK ONTO ROAD  ##
+        ########################################
+
+        #allocate the overlay buffer on the first frame (the warped image has the same dimensions as the undistorted image)
+        if ((self.overlay_buffer is None) or (self.overlay_buffer.shape != undistorted_image.shape)):
+            self.overlay_buffer = generate_overlay_buffer(undistorted_image.shape)
+
+        #project the lane polygon and the lane line strips back to the original perspective (unwarp) - only their vertices are transformed
+        lane_overlay_polygons = compute_lane_overlay_polygons(undistorted_image.shape, left_lane_line_coeff, right_lane_line_coeff, self.perspective_transform_components[1])
+
+        #draw and combine (weight) the lane with the undistorted image (in place, the undistorted image isn't needed after this frame)
+        projected_lane = perform_lane_overlay_rendering(undistorted_image, lane_overlay_polygons, self.overlay_buffer)
+
+        #add tracking text
+        lane_overlay_text = ('Lane curvature: {0:.2f} meters'.format(lane_curvature), 'Vehicle offset: {0:.2f} meters'.format(vehicle_offset))
+        self.render_lane_overlay_text(projected_lane, lane_overlay_text)
+        if (stage_timings is not None):
+            stage_timings.record_stage_since(frame_index, "render", stage_start_time)
+
+        #keep the overlay for frames that are passed through
+        self.last_lane_overlay_polygons = lane_overlay_polygons
+        self.last_lane_overlay_text = lane_overlay_text
+
+        #return processed frame for inclusion in processed video
+        return projected_lane
+
+    #draw the tracking text lines onto an image (in place)
+    def render_lane_overlay_text(self, image, lane_overlay_text):
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        for line_index, text_line in enumerate(lane_overlay_text):
+            cv2.putText(image, text_line, (20, 50 * (line_index + 1)), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
\ No newline at end of file
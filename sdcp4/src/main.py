@@ -7,15 +7,18 @@
 #############
 ## IMPORTS ##
 #############
+import os
+import logging
 import numpy as np
-from calibration_processor import generate_calibration_components
+from calibration_processor import generate_cached_calibration_components
 from perspective_processor import generate_perspective_transform_components
+from threshold_processor import set_gaussian_blur_strategy, gaussian_blur_strategies
 from test_pipeline import execute_test_pipeline
 from production_pipeline import execute_production_pipeline
 
-################################
-## PERFORM CAMERA CALIBRATION ##
-################################
+#################################
+## CAMERA CALIBRATION SETTINGS ##
+#################################
 
 #set image size for the camera we're working with
 camera_image_size = (1280, 720) #(cols, rows)
@@ -27,15 +30,12 @@ num_row_points = 6     #total inside corner points across the y-axis
 #path to calibration images
 path_to_calibration_images = "camera_cal/*.jpg"
 
-#generate calibration componenets used to perform undistort
-camera_matrix, distortion_coeff = generate_calibration_components(num_column_points, num_row_points, path_to_calibration_images, camera_image_size)
-
-#package calibration components in a tuple for easy transport
-calibration_components = (camera_matrix, distortion_coeff)
+#path to the calibration cache (camera matrix, distortion coefficients, and per-image corners from previous runs)
+path_to_calibration_cache = "camera_cal/calibration_cache.npz"
 
-################################
-## PERSPECTIVE TRANSFORM INIT ##
-################################
+####################################
+## PERSPECTIVE TRANSFORM SETTINGS ##
+####################################
 
 #set source vertices for region mask
 src_upper_left =  (517, 478)
@@ -49,36 +49,143 @@ dest_upper_right = (1280, 0)
 dest_lower_left = (0, 720)
 dest_lower_right = (1280, 720)
 
-#package source vertices (points)
-src_vertices = np.float32(
-    [src_upper_left,
-     src_lower_left,
-     src_lower_right,
-     src_upper_right])
+########################
+## THRESHOLD SETTINGS ##
+########################
+
+#blur used ahead of the l-channel gradient filter: 'exact' (full 45x45 gaussian), 'box' (stacked box filters), or 'pyramid' (half resolution blur)
+#see threshold_processor for the accuracy of each approximation
+l_channel_blur_strategy = "exact"
 
-#package destination vertices (points)
-dest_vertices = np.float32(
-    [dest_upper_left,
-     dest_lower_left,
-     dest_lower_right,
-     dest_upper_right])
+#########################
+## PRODUCTION SETTINGS ##
+#########################
 
-#generate perspective transform componenets used to warp/unwarp
-warp_perspective_matrix, unwarp_perspective_matrix = generate_perspective_transform_components(src_vertices, dest_vertices)
+#paths to the video to process and the processed video to produce
+path_to_input_video = "test_video/project_video.mp4"
+path_to_output_video = "output_video/processed_project_video.mp4"
 
-#package perspective transform components in a tuple for easy transport
-perspective_transform_components = (warp_perspective_matrix, unwarp_perspective_matrix)
+#draw the lane onto the video and encode it to path_to_output_video (unset for analytics-only runs, which skip undistortion, drawing and the encoder)
+render_output_video = True
 
-###################
-## TEST PIPELINE ##
-###################
+#stream a record of every frame's lane measurement and estimate here as the video is processed (see lane_telemetry, None disables it)
+path_to_lane_telemetry = None
 
-#test the execution of the pipeline stages (output from each stage is saved to the output_images directory)  
-execute_test_pipeline(calibration_components, perspective_transform_components, (src_upper_left, src_lower_left, src_lower_right, src_upper_right))
+#number of worker processes to run the stateless stages of the pipeline on (1 runs the entire pipeline serially)
+num_pipeline_workers = os.cpu_count()
 
-#########################
-## PRODUCTION PIPELINE ##
-#########################
+#number of frames the decode thread may read ahead of the pipeline, and the encode thread may fall behind it
+decode_queue_depth = 8
+encode_queue_depth = 8
+
+#read/write raw frames directly from/to ffmpeg (bypassing moviepy's per-frame conversions)
+use_raw_pipe = True
+
+#use fixed-point remap tables for the undistort and (fused undistort + warp) geometry (faster, smaller, built once per camera and reused for every frame)
+use_fixed_point_maps = True
+
+#only threshold the search bands around the previous frame's lane lines while tracking is confident (full frame otherwise)
+use_region_of_interest_thresholding = True
+
+#track the lane lines with a motion model (predicted, confidence sized search bands, blind search only once the lane is lost) rather than
+#smoothing over the coefficient history
+use_motion_model = True
+
+#scale the bird's eye view is processed at (warp, thresholding and lane line searches), e.g., 0.5 processes a quarter of the pixels
+#(the lane is still drawn, and curvature and offset measured, at full resolution, see benchmark.py --accuracy-report for the accuracy cost)
+processing_scale = 1.0
+
+#record the duration of every pipeline stage of every frame and export it here at the end of the run (.json or .csv, None disables instrumentation)
+path_to_stage_timings = None
+
+#reuse each stream's working arrays (and output frames) from frame to frame rather than allocating them on every frame (see buffer_pool)
+use_buffer_pool = True
+
+#treat the video as a live feed, giving each frame this many seconds (from when it would have arrived) before degrading the work done on frames
+#that are running late (see deadline_scheduler, None processes every frame with the full pipeline however far behind it gets)
+frame_budget_seconds = None
+
+##########################
+## COMMAND LINE OPTIONS ##
+##########################
+
+#add the options shared by the command line tools built on the pipeline to an argparse parser (defaults come from the settings above)
+#the blur strategy is always added, the rest are left out of tools they don't apply to: the calibration images and cache, reading (and writing) through
+#moviepy rather than raw ffmpeg pipes, region of interest thresholding, and the tracking options (remap tables, motion model and processing scale)
+def add_pipeline_arguments(parser, include_calibration=True, include_raw_pipe=True, include_region_of_interest=True, include_tracking=True):
+    if (include_calibration):
+        parser.add_argument("--calibration-images", default=path_to_calibration_images, help="glob of chessboard calibration images")
+        parser.add_argument("--calibration-cache", default=path_to_calibration_cache, help="calibration cache file")
+    parser.add_argument("--blur-strategy", default=l_channel_blur_strategy, choices=gaussian_blur_strategies, help="blur used ahead of the l-channel gradient filter")
+    if (include_raw_pipe):
+        parser.add_argument("--no-raw-pipe", dest="use_raw_pipe", action="store_false", default=use_raw_pipe, help="decode (and encode) through moviepy rather than raw ffmpeg pipes")
+    if (include_region_of_interest):
+        parser.add_argument("--no-region-of-interest", dest="use_region_of_interest_thresholding", action="store_false", default=use_region_of_interest_thresholding,
+                            help="always threshold the full frame")
+    if (include_tracking):
+        parser.add_argument("--no-fixed-point-maps", dest="use_fixed_point_maps", action="store_false", default=use_fixed_point_maps, help="use floating point remap tables")
+        parser.add_argument("--no-motion-model", dest="use_motion_model", action="store_false", default=use_motion_model, help="smooth over the coefficient history rather than tracking with a motion model")
+        parser.add_argument("--processing-scale", type=float, default=processing_scale, help="scale the bird's eye view is processed at (e.g., 0.5 for half resolution)")
+
+################################
+## PERFORM CAMERA CALIBRATION ##
+################################
+
+#generate calibration components used to perform undistort (loaded from the cache if the calibration images haven't changed)
+def generate_camera_calibration_components(my_path_to_calibration_images=path_to_calibration_images, my_path_to_calibration_cache=path_to_calibration_cache):
+    camera_matrix, distortion_coeff = generate_cached_calibration_components(num_column_points, num_row_points, my_path_to_calibration_images, camera_image_size, my_path_to_calibration_cache)
+    #package calibration components in a tuple for easy transport
+    return (camera_matrix, distortion_coeff)
+
+################################
+## PERSPECTIVE TRANSFORM INIT ##
+################################
 
-#execute the pipeline (producing a video that is saved to the output_video directory)   
-execute_production_pipeline(calibration_components, perspective_transform_components)
\ No newline at end of file
+#generate perspective transform components used to warp/unwarp
+def generate_road_perspective_transform_components():
+    #package source vertices (points)
+    src_vertices = np.float32(
+        [src_upper_left,
+         src_lower_left,
+         src_lower_right,
+         src_upper_right])
+
+    #package destination vertices (points)
+    dest_vertices = np.float32(
+        [dest_upper_left,
+         dest_lower_left,
+         dest_lower_right,
+         dest_upper_right])
+
+    warp_perspective_matrix, unwarp_perspective_matrix = generate_perspective_transform_components(src_vertices, dest_vertices)
+
+    #package perspective transform components in a tuple for easy transport
+    return (warp_perspective_matrix, unwarp_perspective_matrix)
+
+##########
+## MAIN ##
+##########
+
+#calibrate, test the pipeline stages on a single image, then process the configured video
+def main():
+    #report degradations (deadline scheduling)
+    logging.basicConfig(level=logging.INFO, format="%(name)s: %(message)s")
+
+    #build the calibration and perspective transform components
+    calibration_components = generate_camera_calibration_components()
+    perspective_transform_components = generate_road_perspective_transform_components()
+
+    #select the l-channel blur
+    set_gaussian_blur_strategy(l_channel_blur_strategy)
+
+    #test the execution of the pipeline stages (output from each stage is saved to the output_images directory)  
+    execute_test_pipeline(calibration_components, perspective_transform_components, (src_upper_left, src_lower_left, src_lower_right, src_upper_right))
+
+    #execute the pipeline (producing a video that is saved to the output_video directory)   
+    execute_production_pipeline(calibration_components, perspective_transform_components, path_to_input_video, (path_to_output_video if render_output_video else None),
+                                num_workers=num_pipeline_workers, decode_queue_depth=decode_queue_depth, encode_queue_depth=encode_queue_depth, use_raw_pipe=use_raw_pipe,
+                                use_region_of_interest_thresholding=use_region_of_interest_thresholding, use_fixed_point_maps=use_fixed_point_maps, use_motion_model=use_motion_model, processing_scale=processing_scale, path_to_stage_timings=path_to_stage_timings,
+                                frame_budget_seconds=frame_budget_seconds, use_buffer_pool=use_buffer_pool, path_to_lane_telemetry=path_to_lane_telemetry)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,72 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import numpy as np
+import cv2
+
+#the lane overlay is drawn directly on the undistorted frame rather than drawing it on a blank warped canvas and unwarping the whole canvas
+#only the vertices of the lane polygon and the (thick) lane line strips are projected back into the undistorted frame with the unwarp matrix,
+#then they're filled on a preallocated overlay buffer and blended into the frame within their bounding box only
+
+#spacing (in warped rows) of the vertices sampled along each lane line, the projected outline is piecewise linear between them
+overlay_vertex_row_step = 8
+#number of fractional bits used when filling the projected (sub-pixel) vertices
+overlay_fixed_point_shift = 4
+
+#allocate the buffer the overlay is drawn on before blending, image_shape is the shape of the undistorted frame
+#the buffer can be reused for every frame of the same size (only the bounding box of each overlay is cleared and drawn)
+def generate_overlay_buffer(image_shape):
+    return np.zeros(image_shape, dtype=np.uint8)
+
+#compute the lane polygon and the left and right lane line strips (polygons line_thickness wide in warped space) in undistorted image space
+#image_shape is the shape of the warped image, the coefficients are for f(y) = A(y^2) + By + C in warped space
+#returns the projected (x, y) vertices of the (lane polygon, left line strip, right line strip) in a (3, num_vertices, 2) array
+def compute_lane_overlay_polygons(image_shape, left_lane_line_coeff, right_lane_line_coeff, unwarp_perspective_matrix, line_thickness=20):
+    #sample rows from the top to the bottom of the warped image (always including the last row)
+    y_samples = np.append(np.arange(0, (image_shape[0] - 1), overlay_vertex_row_step), (image_shape[0] - 1)).astype(np.float64)
+    #evaluate the fitted polynomials at the sampled rows
+    left_x = (left_lane_line_coeff[0] * (y_samples ** 2)) + (left_lane_line_coeff[1] * y_samples) + left_lane_line_coeff[2]
+    right_x = (right_lane_line_coeff[0] * (y_samples ** 2)) + (right_lane_line_coeff[1] * y_samples) + right_lane_line_coeff[2]
+    half_line_thickness = line_thickness / 2
+    #anything drawn outside the warped image would be dropped by the unwarp, so clip each outline to the warped image before projecting
+    max_x = image_shape[1] - 1
+    #each polygon runs down its left edge and back up its right edge
+    left_edges = np.clip(np.stack((left_x, left_x - half_line_thickness, right_x - half_line_thickness)), 0, max_x)
+    right_edges = np.clip(np.stack((right_x, left_x + half_line_thickness, right_x + half_line_thickness)), 0, max_x)
+    polygon_x = np.hstack((left_edges, right_edges[:, ::-1]))
+    polygon_y = np.broadcast_to(np.hstack((y_samples, y_samples[::-1])), polygon_x.shape)
+    warped_polygons = np.dstack((polygon_x, polygon_y))
+    #project the vertices into the undistorted frame
+    projected_polygons = cv2.perspectiveTransform(warped_polygons.reshape(-1, 1, 2), unwarp_perspective_matrix)
+    #return the projected polygons
+    return projected_polygons.reshape(warped_polygons.shape)
+
+#blend the projected lane overlay polygons (see compute_lane_overlay_polygons) into the supplied image (in place) and return it
+#the polygons are filled on overlay_buffer (see generate_overlay_buffer) and only their bounding box is blended
+def perform_lane_overlay_rendering(image, lane_overlay_polygons, overlay_buffer, lane_color=(152, 251, 152), line_color=(189, 183, 107), overlay_weight=0.3):
+    #bounding box of the overlay, clipped to the image
+    x_low, y_low = np.maximum(np.floor(np.min(lane_overlay_polygons, axis=(0, 1))).astype(np.int32), 0)
+    x_high, y_high = np.minimum(np.ceil(np.max(lane_overlay_polygons, axis=(0, 1))).astype(np.int32) + 1, (image.shape[1], image.shape[0]))
+    #nothing to draw if the overlay falls entirely outside the image
+    if ((x_low >= x_high) or (y_low >= y_high)):
+        return image
+    #clear the bounding box of the buffer (it still holds the previous overlay)
+    overlay_region = overlay_buffer[y_low:y_high, x_low:x_high]
+    overlay_region[:] = 0
+    #shift the vertices into the bounding box and convert them to fixed point for sub-pixel filling
+    fixed_point_polygons = np.round((lane_overlay_polygons - (x_low, y_low)) * (1 << overlay_fixed_point_shift)).astype(np.int32)
+    #draw the lane, then the lane lines over it
+    cv2.fillPoly(overlay_region, [fixed_point_polygons[0]], lane_color, cv2.LINE_8, overlay_fixed_point_shift)
+    cv2.fillPoly(overlay_region, [fixed_point_polygons[1]], line_color, cv2.LINE_AA, overlay_fixed_point_shift)
+    cv2.fillPoly(overlay_region, [fixed_point_polygons[2]], line_color, cv2.LINE_AA, overlay_fixed_point_shift)
+    #combine (weight) the overlay with the image within the bounding box (pixels outside the polygons are left as is, as the buffer is zero there)
+    image_region = image[y_low:y_high, x_low:x_high]
+    cv2.addWeighted(image_region, 1, overlay_region, overlay_weight, 0, dst=image_region)
+    #return the image
+    return image
\ No newline at end of file
@@ -0,0 +1,95 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import numpy as np
+
+#thresholded images only ever hold 0/1, so they can be stored 1 bit per pixel (8x less memory, and 8x less to pickle between worker processes or to
+#cache, see stage_cache), each row is packed on its own (np.packbits along the columns, most significant bit first, the last byte zero padded)
+#so the bits of column x are at byte x // 8, bit 7 - (x % 8) of its row
+#the lane line searches accept packed masks in place of binary images (see lane_processor), answering counts with popcounts and pulling out hot pixels
+#by unpacking only the non-zero bytes, so a mask is never unpacked in full
+
+#number of set bits in each byte value
+byte_popcount_lut = np.array([bin(byte_value).count("1") for byte_value in range(256)], dtype=np.uint8)
+
+#bits of each byte value, most significant first (entry [b, k] is the bit of column 8 * byte + k for a byte of value b)
+byte_bits_lut = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis], axis=1)
+
+#a binary (0/1) image packed 1 bit per pixel (see the top of this file), shape is (rows, cols) of the image it was packed from
+#packed_rows may be read only (e.g., a memory mapped cache entry), nothing here writes to it
+class PackedMask:
+    __slots__ = ("packed_rows", "shape")
+
+    def __init__(self, packed_rows, num_cols):
+        self.packed_rows = packed_rows
+        self.shape = (packed_rows.shape[0], num_cols)
+
+    #size (in bytes) of the packed rows
+    @property
+    def nbytes(self):
+        return self.packed_rows.nbytes
+
+    #unpack into a binary (0/1, uint8) image
+    def unpack(self):
+        return np.unpackbits(self.packed_rows, axis=1, count=self.shape[1])
+
+    #the bytes holding [y_low, y_high) x [x_low, x_high), with the bits of the columns outside the window cleared (bounds are clipped to the image)
+    #returns (window bytes, y_low, x of the first byte's first bit) or None if the window is empty
+    def retrieve_window_bytes(self, y_low, y_high, x_low, x_high):
+        y_low, y_high = max(y_low, 0), min(y_high, self.shape[0])
+        x_low, x_high = max(x_low, 0), min(x_high, self.shape[1])
+        if ((y_high <= y_low) or (x_high <= x_low)):
+            return None
+        byte_low = x_low // 8
+        byte_high = (x_high + 7) // 8
+        window_bytes = self.packed_rows[y_low:y_high, byte_low:byte_high]
+        #clear the bits either side of the window in its first and last bytes (on a copy, the packed rows are left untouched)
+        if (((x_low % 8) != 0) or ((x_high % 8) != 0)):
+            window_bytes = window_bytes.copy()
+            window_bytes[:, 0] &= np.uint8(0xFF >> (x_low % 8))
+            window_bytes[:, -1] &= np.uint8((0xFF << ((8 - (x_high % 8)) % 8)) & 0xFF)
+        return (window_bytes, y_low, byte_low * 8)
+
+    #count the hot pixels within [y_low, y_high) x [x_low, x_high) (the whole image by default) by popcount
+    def count_hot_pixels(self, y_low=0, y_high=None, x_low=0, x_high=None):
+        window = self.retrieve_window_bytes(y_low, self.shape[0] if (y_high is None) else y_high, x_low, self.shape[1] if (x_high is None) else x_high)
+        if (window is None):
+            return 0
+        return int(np.sum(byte_popcount_lut[window[0]], dtype=np.int64))
+
+    #compute the hot pixel count of each column within the rows [y_low, y_high) (same result as summing the unpacked rows column-wise)
+    def compute_column_histogram(self, y_low, y_high):
+        return np.unpackbits(self.packed_rows[y_low:y_high], axis=1, count=self.shape[1]).sum(axis=0, dtype=np.intp)
+
+    #retrieve the [y, x] coordinates (i.e., row, col format) of the hot pixels within [y_low, y_high) x [x_low, x_high) (the whole image by default)
+    #coordinates are returned in row-major order (as np.transpose(np.nonzero(image)) would), only the non-zero bytes are unpacked
+    def retrieve_hot_pixels(self, y_low=0, y_high=None, x_low=0, x_high=None):
+        window = self.retrieve_window_bytes(y_low, self.shape[0] if (y_high is None) else y_high, x_low, self.shape[1] if (x_high is None) else x_high)
+        if (window is None):
+            return np.empty((0, 2), dtype=np.intp)
+        window_bytes, window_y_low, window_x_low = window
+        #locate the non-zero bytes (in row-major order), then the set bits within each (in column order)
+        byte_rows, byte_cols = np.nonzero(window_bytes)
+        byte_indices, bit_indices = np.nonzero(byte_bits_lut[window_bytes[byte_rows, byte_cols]])
+        return np.column_stack(((byte_rows[byte_indices] + window_y_low), ((byte_cols[byte_indices] * 8) + bit_indices + window_x_low)))
+
+    #retrieve the flat (row-major) indices of every hot pixel (as np.flatnonzero on the unpacked image would)
+    def retrieve_hot_pixel_flat_indices(self):
+        hot_pixel_coordinates = self.retrieve_hot_pixels()
+        return (hot_pixel_coordinates[:, 0] * self.shape[1]) + hot_pixel_coordinates[:, 1]
+
+#pack a binary (0/1) image into a packed mask
+def generate_packed_mask(binary_image):
+    return PackedMask(np.packbits(binary_image, axis=1), binary_image.shape[1])
+
+#unpack a packed mask into a binary image, binary images are returned as is (for code that needs the pixels themselves, e.g., debug images)
+def retrieve_binary_image(image):
+    if (isinstance(image, PackedMask)):
+        return image.unpack()
+    return image
\ No newline at end of file
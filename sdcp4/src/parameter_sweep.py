@@ -0,0 +1,332 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import threshold_processor
+from geometry_processor import generate_geometry_spec, retrieve_geometry_components, perform_geometry_warp, compute_warped_image_shape
+from threshold_processor import default_threshold_parameters, compute_fused_threshold_channels, perform_fused_thresholding_from_channels
+from lane_processor import default_search_parameters
+from lane_motion_model import half_confidence_fit_residual
+from lane_tracker import LaneTracker
+from buffer_pool import FrameBufferPool
+from packed_mask import generate_packed_mask
+
+#tune the threshold and search parameters (see threshold_processor.default_threshold_parameters and lane_processor.default_search_parameters) for a
+#camera by tracking sampled clips of its video under every candidate set of parameters and ranking them by quality proxies, e.g.:
+#   python parameter_sweep.py test_video/project_video.mp4 --param l_gradient_low=30,45,60 --param s_value_low=120,150,180       (grid)
+#   python parameter_sweep.py test_video/project_video.mp4 --param l_gradient_low=20:70 --param s_density_limit=0.05:0.3 --num-candidates 64   (random search)
+#clips of clip_length frames are taken every clip_spacing frames, decoded and warped once, and written to a single memory mapped file every worker
+#process reads from, then candidates are split into tasks across the workers, each tracking its candidates side by side through the clips: a frame is
+#converted, blurred and differentiated once per task (none of which depends on the parameters) and only the cutoffs are applied per candidate
+#(see threshold_processor.perform_fused_thresholding_from_channels)
+#the full frame is always thresholded (region of interest thresholding applies the same cutoffs to a subset of it), and lanes aren't rendered
+#quality proxies, measured on each frame's lane lines as fit (before smoothing or rejection):
+#   rejection_rate  - fraction of frames whose fit didn't keep tracking confident (too few pixels, rejected as an outlier, or beyond the search band)
+#   fit_residual_px - mean rms residual of the lane line fits (in full resolution warped pixels)
+#   lane_width_cv   - coefficient of variation of the lane width (at the bottom and top of the warped frame) over each clip, the lane doesn't change width
+#the residual and lane width are only measured on frames where both lane lines were fit (a frame where a lane line had no pixels only counts as rejected)
+#candidates are ranked by score (lower is better), the sum of the proxies with the residual measured against the motion model's half confidence residual
+
+#first lines of a candidate's error message kept in the results
+max_error_message_length = 200
+
+#every parameter that can be swept, with its default value
+sweep_parameter_defaults = dict(default_threshold_parameters, **default_search_parameters)
+
+#parse a value of the supplied parameter (integers stay integers for integer parameters)
+def parse_sweep_parameter_value(parameter_name, value_text):
+    if (isinstance(sweep_parameter_defaults[parameter_name], int)):
+        return int(value_text)
+    return float(value_text)
+
+#parse a parameter spec from the command line: name=v1,v2,... (a grid of values) or name=low:high (a range sampled by random search)
+#returns (parameter_name, ("values", [values]) or ("range", (low, high)))
+def parse_sweep_parameter_spec(parameter_spec_text):
+    parameter_name, _, value_text = parameter_spec_text.partition("=")
+    parameter_name = parameter_name.strip()
+    if (parameter_name not in sweep_parameter_defaults):
+        raise ValueError("unknown parameter '{0}' (expected one of {1})".format(parameter_name, ", ".join(sweep_parameter_defaults)))
+    if (":" in value_text):
+        low_text, high_text = value_text.split(":", 1)
+        return (parameter_name, ("range", (parse_sweep_parameter_value(parameter_name, low_text), parse_sweep_parameter_value(parameter_name, high_text))))
+    return (parameter_name, ("values", [parse_sweep_parameter_value(parameter_name, cur_value_text) for cur_value_text in value_text.split(",") if cur_value_text.strip()]))
+
+#load parameter specs from a json file: {"name": [v1, v2, ...]} for a grid of values, or {"name": {"low": low, "high": high}} for a range
+def load_sweep_parameter_specs(path_to_sweep_spec):
+    with open(path_to_sweep_spec, "r") as sweep_spec_file:
+        sweep_spec = json.load(sweep_spec_file)
+    parameter_specs = []
+    for parameter_name, parameter_spec in sweep_spec.items():
+        if (isinstance(parameter_spec, dict)):
+            parameter_specs.append(parse_sweep_parameter_spec("{0}={1}:{2}".format(parameter_name, parameter_spec["low"], parameter_spec["high"])))
+        else:
+            parameter_specs.append(parse_sweep_parameter_spec("{0}={1}".format(parameter_name, ",".join(str(value) for value in parameter_spec))))
+    return parameter_specs
+
+#generate the candidates (dicts of every sweep parameter) for the supplied parameter specs (see parse_sweep_parameter_spec), the defaults always come first
+#unless a range is supplied or num_random_candidates is set every combination of the values is a candidate (grid search), otherwise num_random_candidates
+#are drawn (ranges uniformly, value lists by choice) with the supplied seed (random search)
+def generate_sweep_candidates(parameter_specs, num_random_candidates=None, seed=0):
+    candidates = [dict(sweep_parameter_defaults)]
+    parameter_names = [parameter_name for (parameter_name, _) in parameter_specs]
+    is_random_search = ((num_random_candidates is not None) or any((parameter_spec[0] == "range") for (_, parameter_spec) in parameter_specs))
+    if (not is_random_search):
+        candidate_values = itertools.product(*[parameter_spec[1] for (_, parameter_spec) in parameter_specs])
+    else:
+        random_generator = np.random.default_rng(seed)
+        candidate_values = []
+        for _ in range(num_random_candidates if (num_random_candidates is not None) else 32):
+            cur_values = []
+            for parameter_name, (spec_type, spec_values) in parameter_specs:
+                if (spec_type == "values"):
+                    cur_values.append(spec_values[random_generator.integers(len(spec_values))])
+                elif (isinstance(sweep_parameter_defaults[parameter_name], int)):
+                    cur_values.append(int(random_generator.integers(spec_values[0], spec_values[1] + 1)))
+                else:
+                    #(rounded so the values read back cleanly on the command line)
+                    cur_values.append(round(float(random_generator.uniform(spec_values[0], spec_values[1])), 4))
+            candidate_values.append(cur_values)
+    #drop duplicates (including those of the defaults)
+    seen_candidates = {tuple(sorted(candidates[0].items()))}
+    for cur_values in candidate_values:
+        candidate = dict(sweep_parameter_defaults, **dict(zip(parameter_names, cur_values)))
+        candidate_key = tuple(sorted(candidate.items()))
+        if (candidate_key not in seen_candidates):
+            seen_candidates.add(candidate_key)
+            candidates.append(candidate)
+    return candidates
+
+#split a candidate into its (threshold parameters, search parameters)
+def split_sweep_candidate(candidate):
+    return ({parameter_name: candidate[parameter_name] for parameter_name in default_threshold_parameters}, {parameter_name: candidate[parameter_name] for parameter_name in default_search_parameters})
+
+#decode the clips sampled from each video (clip_length frames every clip_spacing frames, at most max_clips_per_video per video), warp them, and write them
+#to a memory mapped .npy file of warped frames, returns the [start, end) frame range of each clip within the file
+def generate_sweep_clips(path_to_warped_frames, input_video_paths, geometry_spec, clip_length=30, clip_spacing=150, max_clips_per_video=8, use_raw_pipe=True):
+    #(imported here as only sampling needs video io, worker processes don't)
+    from frame_io import generate_frame_source
+    geometry_components = retrieve_geometry_components(geometry_spec)
+    image_size = geometry_spec[3]
+    clip_length = min(clip_length, clip_spacing)
+    warped_frames = np.lib.format.open_memmap(path_to_warped_frames, mode="w+", dtype=np.uint8,
+                                              shape=((len(input_video_paths) * max_clips_per_video * clip_length),) + compute_warped_image_shape((image_size[1], image_size[0], 3), geometry_components))
+    clip_bounds = []
+    num_frames_sampled = 0
+    for path_to_input_video in input_video_paths:
+        frame_source = generate_frame_source(path_to_input_video, use_raw_pipe)
+        try:
+            if (tuple(frame_source[0]) != tuple(image_size)):
+                raise ValueError("{0} is {1}x{2}, every video swept must be {3}x{4}".format(path_to_input_video, frame_source[0][0], frame_source[0][1], image_size[0], image_size[1]))
+            frame_index = 0
+            #stop decoding once the last clip is complete
+            while (frame_index < (max_clips_per_video * clip_spacing)):
+                frame = frame_source[2]()
+                if (frame is None):
+                    break
+                if ((frame_index % clip_spacing) < clip_length):
+                    #start a new clip
+                    if ((frame_index % clip_spacing) == 0):
+                        clip_bounds.append([num_frames_sampled, num_frames_sampled])
+                    perform_geometry_warp(frame, geometry_components, warped_frames[num_frames_sampled])
+                    num_frames_sampled += 1
+                    clip_bounds[-1][1] = num_frames_sampled
+                frame_index += 1
+        finally:
+            frame_source[3]()
+    warped_frames.flush()
+    return [tuple(cur_clip_bounds) for cur_clip_bounds in clip_bounds]
+
+#warped frames of the sampled clips (memory mapped, read only), opened by initialize_sweep_worker in each worker process
+sweep_warped_frames = None
+
+#initialize a sweep worker process
+def initialize_sweep_worker(path_to_warped_frames, gaussian_blur_strategy):
+    global sweep_warped_frames
+    #workers use the same blur strategy as the parent process
+    threshold_processor.set_gaussian_blur_strategy(gaussian_blur_strategy)
+    sweep_warped_frames = np.load(path_to_warped_frames, mmap_mode='r')
+
+#compute the lane width (in full resolution warped pixels) at the bottom and top of the warped frame from a measurement (see LaneTracker.last_lane_measurement)
+def compute_measured_lane_widths(lane_measurement, image_height):
+    return [np.polyval(lane_measurement[1], y) - np.polyval(lane_measurement[0], y) for y in (image_height - 1, 0)]
+
+#track the sampled clips under each of the supplied candidates (runs in a sweep worker process), returns the quality proxies of each candidate
+#(see the top of this file), or its error if tracking failed under it
+def evaluate_sweep_candidates(calibration_components, perspective_transform_components, image_size, clip_bounds, candidates, use_fixed_point_maps=True,
+                              use_motion_model=False, processing_scale=1.0):
+    image_height = image_size[1]
+    candidate_parameters = [split_sweep_candidate(candidate) for candidate in candidates]
+    #per candidate: number of frames, frames rejected, frames with both lane lines fit, sum of fit residuals, per clip lane width coefficients of variation
+    #(weighted by the number of frames fit in the clip), error
+    num_frames = [0] * len(candidates)
+    num_frames_rejected = [0] * len(candidates)
+    num_frames_fit = [0] * len(candidates)
+    fit_residual_sums = [0.0] * len(candidates)
+    lane_width_cv_sums = [0.0] * len(candidates)
+    candidate_errors = [None] * len(candidates)
+    #the channel and mask buffers are shared by every candidate (each frame's thresholded image is consumed before the next candidate's is computed)
+    buffer_pool = FrameBufferPool()
+    for (clip_start, clip_end) in clip_bounds:
+        #a fresh tracker per candidate per clip (clips aren't contiguous)
+        lane_trackers = [None if (candidate_errors[candidate_index] is not None) else
+                         LaneTracker(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps=use_fixed_point_maps, use_motion_model=use_motion_model,
+                                     processing_scale=processing_scale, render_lane=False, threshold_parameters=threshold_parameters, search_parameters=search_parameters)
+                         for candidate_index, (threshold_parameters, search_parameters) in enumerate(candidate_parameters)]
+        clip_lane_widths = [[] for _ in candidates]
+        for frame_index in range(clip_start, clip_end):
+            #convert, blur and differentiate the frame once for every candidate
+            threshold_channels = compute_fused_threshold_channels(sweep_warped_frames[frame_index], processing_scale=processing_scale, buffer_pool=buffer_pool)
+            for candidate_index, lane_tracker in enumerate(lane_trackers):
+                if (lane_tracker is None):
+                    continue
+                try:
+                    #(packed, as the searches are quicker over a packed mask)
+                    thresholded_image = generate_packed_mask(perform_fused_thresholding_from_channels(threshold_channels, lane_tracker.threshold_parameters, buffer_pool))
+                    lane_tracker.perform_stateful_frame_stages(None, None, thresholded_image)
+                except Exception as error:
+                    candidate_errors[candidate_index] = "{0}: {1}".format(type(error).__name__, str(error))[:max_error_message_length]
+                    lane_trackers[candidate_index] = None
+                    continue
+                lane_measurement = lane_tracker.last_lane_measurement
+                num_frames[candidate_index] += 1
+                num_frames_rejected[candidate_index] += (0 if (lane_tracker.lane_tracking_confident) else 1)
+                #a lane line without pixels has no fit (its residual is nan, see LaneTracker.perform_missed_frame_stages)
+                if (np.isnan(lane_measurement[4]) or np.isnan(lane_measurement[5])):
+                    continue
+                num_frames_fit[candidate_index] += 1
+                fit_residual_sums[candidate_index] += (lane_measurement[4] + lane_measurement[5]) / 2
+                clip_lane_widths[candidate_index].append(compute_measured_lane_widths(lane_measurement, image_height))
+        #lane width variation over the clip (the mean across the bottom and top of the frame)
+        for candidate_index, lane_widths in enumerate(clip_lane_widths):
+            if ((candidate_errors[candidate_index] is None) and (len(lane_widths) > 0)):
+                lane_widths = np.array(lane_widths)
+                lane_width_cv_sums[candidate_index] += len(lane_widths) * np.mean(np.std(lane_widths, axis=0) / np.maximum(np.abs(np.mean(lane_widths, axis=0)), 1.0))
+    #summarize each candidate
+    candidate_results = []
+    for candidate_index in range(len(candidates)):
+        if ((candidate_errors[candidate_index] is not None) or (num_frames_fit[candidate_index] == 0)):
+            candidate_results.append({"frames": num_frames[candidate_index], "score": float("inf"), "error": candidate_errors[candidate_index] or ("no lane lines fit" if (num_frames[candidate_index] > 0) else "no frames")})
+            continue
+        rejection_rate = num_frames_rejected[candidate_index] / num_frames[candidate_index]
+        fit_residual = fit_residual_sums[candidate_index] / num_frames_fit[candidate_index]
+        lane_width_cv = lane_width_cv_sums[candidate_index] / num_frames_fit[candidate_index]
+        candidate_results.append({"frames": num_frames[candidate_index], "rejection_rate": rejection_rate, "fit_residual_px": fit_residual, "lane_width_cv": lane_width_cv,
+                                  "score": rejection_rate + lane_width_cv + (fit_residual / half_confidence_fit_residual), "error": None})
+    return candidate_results
+
+#sweep the supplied candidates (see generate_sweep_candidates) over clips sampled from the supplied videos across a pool of num_jobs worker processes
+#the clips are warped into a temporary directory (in work_directory, if supplied) that's removed afterwards
+#returns [(candidate, results)] ranked by score, best first (see the top of this file)
+def execute_parameter_sweep(calibration_components, perspective_transform_components, input_video_paths, candidates, num_jobs=None, clip_length=30, clip_spacing=150,
+                            max_clips_per_video=8, use_fixed_point_maps=True, use_motion_model=False, processing_scale=1.0, use_raw_pipe=True, gaussian_blur_strategy='exact',
+                            candidates_per_task=None, image_size=(1280, 720), work_directory=None):
+    if (num_jobs is None):
+        num_jobs = os.cpu_count()
+    geometry_spec = generate_geometry_spec(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps, processing_scale)
+    sweep_directory = tempfile.mkdtemp(prefix="parameter_sweep_", dir=work_directory)
+    try:
+        #decode and warp the clips once for every candidate
+        path_to_warped_frames = os.path.join(sweep_directory, "warped_frames.npy")
+        sample_start_time = time.perf_counter()
+        clip_bounds = generate_sweep_clips(path_to_warped_frames, input_video_paths, geometry_spec, clip_length, clip_spacing, max_clips_per_video, use_raw_pipe)
+        num_clip_frames = sum((clip_end - clip_start) for (clip_start, clip_end) in clip_bounds)
+        print("sampled {0} clips ({1} frames) in {2:.1f}s".format(len(clip_bounds), num_clip_frames, time.perf_counter() - sample_start_time))
+        if (num_clip_frames == 0):
+            raise ValueError("no frames could be sampled from the supplied videos")
+        #split the candidates into tasks (enough of them to keep every worker busy, but few enough that each frame's channels are shared by several candidates)
+        if (candidates_per_task is None):
+            candidates_per_task = max(min(-(-len(candidates) // num_jobs), 16), 1)
+        candidate_tasks = [list(range(task_start, min(task_start + candidates_per_task, len(candidates)))) for task_start in range(0, len(candidates), candidates_per_task)]
+        candidate_results = [None] * len(candidates)
+        sweep_start_time = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=num_jobs, initializer=initialize_sweep_worker, initargs=(path_to_warped_frames, gaussian_blur_strategy)) as executor:
+            task_futures = {executor.submit(evaluate_sweep_candidates, calibration_components, perspective_transform_components, image_size, clip_bounds,
+                                            [candidates[candidate_index] for candidate_index in candidate_indices], use_fixed_point_maps, use_motion_model, processing_scale): candidate_indices
+                            for candidate_indices in candidate_tasks}
+            num_candidates_evaluated = 0
+            for task_future in as_completed(task_futures):
+                for candidate_index, cur_candidate_results in zip(task_futures[task_future], task_future.result()):
+                    candidate_results[candidate_index] = cur_candidate_results
+                num_candidates_evaluated += len(task_futures[task_future])
+                print("[{0}/{1}] candidates evaluated ({2:.1f}s)".format(num_candidates_evaluated, len(candidates), time.perf_counter() - sweep_start_time))
+    finally:
+        shutil.rmtree(sweep_directory, ignore_errors=True)
+    return sorted(zip(candidates, candidate_results), key=lambda candidate_and_results: candidate_and_results[1]["score"])
+
+#print the best num_candidates_shown candidates (only the parameters that differ from the defaults are shown)
+def print_sweep_results(ranked_candidates, num_candidates_shown=10):
+    print("{0:>4} {1:>8} {2:>10} {3:>12} {4:>10}  {5}".format("rank", "score", "rejection", "residual_px", "width_cv", "parameters (vs defaults)"))
+    for rank, (candidate, candidate_results) in enumerate(ranked_candidates[:num_candidates_shown], 1):
+        changed_parameters = ", ".join("{0}={1}".format(parameter_name, candidate[parameter_name]) for parameter_name in sweep_parameter_defaults
+                                       if (candidate[parameter_name] != sweep_parameter_defaults[parameter_name])) or "(defaults)"
+        if (candidate_results["error"] is not None):
+            print("{0:>4} {1:>8} {2}  {3}".format(rank, "failed", candidate_results["error"], changed_parameters))
+            continue
+        print("{0:>4} {1:>8.4f} {2:>10.3f} {3:>12.2f} {4:>10.4f}  {5}".format(rank, candidate_results["score"], candidate_results["rejection_rate"], candidate_results["fit_residual_px"],
+                                                                       candidate_results["lane_width_cv"], changed_parameters))
+
+#save the ranked candidates and their results as json
+def save_sweep_results(path_to_sweep_results, ranked_candidates):
+    with open(path_to_sweep_results, "w") as sweep_results_file:
+        json.dump([{"parameters": candidate, "results": {result_name: (None if ((isinstance(result_value, float)) and (not np.isfinite(result_value))) else result_value)
+                                                         for result_name, result_value in candidate_results.items()}}
+                   for (candidate, candidate_results) in ranked_candidates], sweep_results_file, indent=2)
+
+#parse the command line arguments (defaults come from the settings in main)
+def parse_sweep_arguments(main, argv=None):
+    parser = argparse.ArgumentParser(description="Sweep the threshold and lane search parameters over clips sampled from videos, ranking candidates by quality proxies.")
+    parser.add_argument("inputs", nargs="+", help="input videos (every one must be the size of the calibrated camera's frames)")
+    parser.add_argument("--param", dest="parameter_specs", action="append", default=[], help="name=v1,v2,... (grid) or name=low:high (random search), one of: " + ", ".join(sweep_parameter_defaults))
+    parser.add_argument("--spec", default=None, help="json file of parameter specs ({\"name\": [values]} or {\"name\": {\"low\": low, \"high\": high}})")
+    parser.add_argument("--num-candidates", type=int, default=None, help="number of candidates drawn by random search (implied by any range, defaults to 32 then)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random search")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--candidates-per-task", type=int, default=None, help="candidates tracked side by side by each task (sharing each frame's channels)")
+    parser.add_argument("--clip-length", type=int, default=30, help="frames per sampled clip")
+    parser.add_argument("--clip-spacing", type=int, default=150, help="frames from the start of one clip to the next")
+    parser.add_argument("--max-clips", type=int, default=8, help="clips sampled per video")
+    parser.add_argument("--top", type=int, default=10, help="number of candidates printed")
+    parser.add_argument("--output", default=None, help="save every candidate and its results here (.json, best first)")
+    parser.add_argument("--work-dir", default=None, help="directory the sampled clips are warped into (the system temporary directory by default)")
+    main.add_pipeline_arguments(parser, include_region_of_interest=False)
+    return parser.parse_args(argv)
+
+#run the sweep command
+def execute_sweep_command(argv=None):
+    #(imported here so worker processes don't pull in the whole pipeline)
+    import main
+    arguments = parse_sweep_arguments(main, argv)
+    parameter_specs = [parse_sweep_parameter_spec(parameter_spec_text) for parameter_spec_text in arguments.parameter_specs]
+    if (arguments.spec is not None):
+        parameter_specs += load_sweep_parameter_specs(arguments.spec)
+    candidates = generate_sweep_candidates(parameter_specs, arguments.num_candidates, arguments.seed)
+    print("sweeping {0} candidates".format(len(candidates)))
+    calibration_components = main.generate_camera_calibration_components(arguments.calibration_images, arguments.calibration_cache)
+    perspective_transform_components = main.generate_road_perspective_transform_components()
+    ranked_candidates = execute_parameter_sweep(calibration_components, perspective_transform_components, arguments.inputs, candidates, num_jobs=arguments.jobs, clip_length=arguments.clip_length,
+                                                clip_spacing=arguments.clip_spacing, max_clips_per_video=arguments.max_clips, use_fixed_point_maps=arguments.use_fixed_point_maps,
+                                                use_motion_model=arguments.use_motion_model, processing_scale=arguments.processing_scale, use_raw_pipe=arguments.use_raw_pipe,
+                                                gaussian_blur_strategy=arguments.blur_strategy, candidates_per_task=arguments.candidates_per_task, image_size=main.camera_image_size,
+                                                work_directory=arguments.work_dir)
+    print_sweep_results(ranked_candidates, arguments.top)
+    if (arguments.output is not None):
+        save_sweep_results(arguments.output, ranked_candidates)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(execute_sweep_command())
\ No newline at end of file
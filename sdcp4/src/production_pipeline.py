@@ -7,148 +7,158 @@
 #############
 ## IMPORTS ##
 #############
-import cv2
-import numpy as np
+import logging
 from collections import deque
-from moviepy.editor import VideoFileClip
-from calibration_processor import perform_undistort
-from perspective_processor import perform_perspective_transform
-from threshold_processor import perform_thresholding
-from lane_processor import perform_educated_lane_line_pixel_search, perform_blind_lane_line_pixel_search, compute_lane_line_coefficients, compute_curvature_of_lane_lines, compute_vehicle_offset
+from concurrent.futures import ProcessPoolExecutor
+from frame_io import generate_frame_source, generate_frame_sink, start_frame_reader, iterate_frame_queue, start_frame_writer, finish_frame_writer
+import threshold_processor
+from lane_tracker import LaneTracker
+from lane_telemetry import LaneTelemetryWriter
+from buffer_pool import FrameBufferPool
+from instrumentation_processor import StageTimings, generate_timed_frame_source, generate_timed_frame_sink
+from deadline_scheduler import DeadlineScheduler, process_frames_against_deadlines
 
-#globals
-calibration_components = None
-perspective_transform_components = None #perspective_transform_components[0] is warp_perspective_matrix, perspective_transform_components[1] is unwarp_perspective_matrix
-prev_left_lane_line_coeff_queue = None
-prev_right_lane_line_coeff_queue = None
+#failures releasing a run's resources after the run itself already failed are logged here (the run's own exception is the one raised)
+pipeline_logger = logging.getLogger("production_pipeline")
 
-#run the pipeline on the provided video
-def execute_production_pipeline(my_calibration_components, my_perspective_transform_components):
-    #establish ability to set globals
-    global calibration_components
-    global perspective_transform_components
-    global prev_left_lane_line_coeff_queue
-    global prev_right_lane_line_coeff_queue
-
-    #set globals
-    calibration_components = my_calibration_components
-    perspective_transform_components= my_perspective_transform_components
-    #initialize queues (storing a max of 10 sets of polynomial coefficients for both the left and right lanes
-    prev_left_lane_line_coeff_queue = deque(maxlen=10)
-    prev_right_lane_line_coeff_queue = deque(maxlen=10)
-
-    #generate video
-    clip_handle = VideoFileClip("test_video/project_video.mp4")
-    image_handle = clip_handle.fl_image(process_frame)
-    image_handle.write_videofile("output_video/processed_project_video.mp4", audio=False)
-
-#process a frame of video through the pipeline
-def process_frame(image):
-    
-    ###################################
-    ## PERFORM DISTORTION CORRECTION ##
-    ###################################
-    
-    #undistort image
-    undistorted_image = perform_undistort(image, calibration_components)
-    
-    ###################################
-    ## PERFORM PERSPECTIVE TRANSFORM ##
-    ###################################
-
-    #transform perspective (warp) - this will squish the depth of field in the source mapping into the height of the image, 
-    #which will make the upper 3/4ths blurry, need to adjust dest_upper* y-values to negative to stretch it out and clear the transformed image up
-    #we won't do that as we'll lose right dashes in the 720 pix height of the image frame 
-    warped_undistorted_image = perform_perspective_transform(undistorted_image, perspective_transform_components[0])
-    
-    #######################################
-    ## PERFORM COLOR/GRADIENT THRESHOLD  ##
-    #######################################
+#release the resources of a pipeline run in order, each is a (description, release function) tuple and each is released even if an earlier one fails
+#if the run already failed (processing_error), a failure releasing them is logged rather than raised so it can't replace the run's exception,
+#otherwise the first failure is raised once everything has been released (and any later ones are logged)
+def release_pipeline_resources(resource_releases, processing_error=None):
+    first_release_error = None
+    for release_description, release in resource_releases:
+        try:
+            release()
+        except Exception as release_error:
+            if ((processing_error is None) and (first_release_error is None)):
+                first_release_error = release_error
+            else:
+                pipeline_logger.error("failed to %s after an earlier error: %s: %s", release_description, type(release_error).__name__, release_error)
+    if (first_release_error is not None):
+        raise first_release_error
 
-    #apply thresholding to warped image and produce a binary result
-    thresholded_warped_undistorted_image = perform_thresholding(warped_undistorted_image)
-    
-    #############################
-    ## PERFORM LANE DETECTION  ##
-    #############################
-    
-    #if this is the very first frame, we must do a blind search for the lane lines
-    if ((len(prev_left_lane_line_coeff_queue) == 0) and (len(prev_right_lane_line_coeff_queue) == 0)):
-        #map out the left and right lane line pixel locations via windowed search
-        left_lane_pixel_coordinates, right_lane_pixel_coordinates, _ = perform_blind_lane_line_pixel_search(thresholded_warped_undistorted_image, return_debug_image=False)    
-    else:
-        #if we have previous coefficients in the queues, use the latest (rightmost) set as a starting place to accelerate our lane search for this frame
-        #map out the left and right lane line pixel coordinates via windowed search using previous polynomials as starting place
-        left_lane_pixel_coordinates, right_lane_pixel_coordinates, _ = perform_educated_lane_line_pixel_search(thresholded_warped_undistorted_image, prev_left_lane_line_coeff_queue[-1], prev_right_lane_line_coeff_queue[-1], None, None, return_debug_image=False)
-    
-    #compute the polynomial coefficients for each lane line using the x and y pixel locations from the mapping function
-    #we're fitting (computing coefficients of) a second order polynomial: f(y) = A(y^2) + By + C
-    #we're fitting for f(y) rather than f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value 
-    left_lane_line_coeff, right_lane_line_coeff = compute_lane_line_coefficients(left_lane_pixel_coordinates, right_lane_pixel_coordinates)
-    
-    #if we have at least one set of previous left and right lane coefficients stored in the queues
-    if ((len(prev_left_lane_line_coeff_queue) > 0) and (len(prev_right_lane_line_coeff_queue) > 0)):
-        #compute the percentage difference between the current left and right coefficients sets and latest (rightmost) set of coefficients in each queue 
-        left_percent_difference = np.abs(left_lane_line_coeff - prev_left_lane_line_coeff_queue[-1]) / np.mean([left_lane_line_coeff, prev_left_lane_line_coeff_queue[-1]])
-        right_percent_difference = np.abs(right_lane_line_coeff - prev_right_lane_line_coeff_queue[-1]) / np.mean([left_lane_line_coeff, prev_right_lane_line_coeff_queue[-1]])
-        #if the percent difference between any of the coefficients exceeds 3%, use the latest (rightmost) set of previous coefficients in the queue for each lane line (last added to the queue)
-        if (np.any(left_percent_difference > 3) or np.any(right_percent_difference > 3)):
-            #pop off the newest (rightmost) set of coefficients from the queue
-            left_lane_line_coeff = prev_left_lane_line_coeff_queue.pop()
-            right_lane_line_coeff = prev_right_lane_line_coeff_queue.pop()
-            
-    #append the current coefficients to the queue for use on the next frame
-    #the queue will automatically pop off the oldest set of coefficients from each queue if maxlength is reach (that way we only keep 10 sets at all time)
-    prev_left_lane_line_coeff_queue.append(left_lane_line_coeff)
-    prev_right_lane_line_coeff_queue.append(right_lane_line_coeff)
-    
-    #smooth the lines (trading off line accuracy for reduced jitter) by taking the mean of the sets of coefficients currently in the queue
-    left_lane_line_coeff = np.mean(prev_left_lane_line_coeff_queue, axis=0)
-    right_lane_line_coeff = np.mean(prev_right_lane_line_coeff_queue, axis=0)
-    
-    #generate range of evenly spaced numbers over y interval (0 - 719) matching image height
-    y_linespace = np.linspace(0, (thresholded_warped_undistorted_image.shape[0] - 1), thresholded_warped_undistorted_image.shape[0])
-    
-    #left lane fitted polynomial (f(y) = A(y^2) + By + C)
-    left_lane_line_fitted_poly = (left_lane_line_coeff[0] * (y_linespace ** 2)) + (left_lane_line_coeff[1] * y_linespace) + left_lane_line_coeff[2]
-    #right lane fitted polynomial (f(y) = A(y^2) + By + C)
-    right_lane_line_fitted_poly = (right_lane_line_coeff[0] * (y_linespace ** 2)) + (right_lane_line_coeff[1] * y_linespace) + right_lane_line_coeff[2]
-    
-    ## compute lane curvature ##
-    left_curvature, right_curvature = compute_curvature_of_lane_lines(thresholded_warped_undistorted_image.shape, left_lane_line_fitted_poly, right_lane_line_fitted_poly)
-    
-    ## compute vehicle offset from center ##
-    vehicle_offset = compute_vehicle_offset(thresholded_warped_undistorted_image.shape, left_lane_line_coeff, right_lane_line_coeff)
-    
-    ########################################
-    ## PERFORM PROJECTION BACK ONTO ROAD  ##
-    ########################################
-    
-    #create an image to draw the lines on
-    warped_lane = np.zeros_like(warped_undistorted_image).astype(np.uint8)
-
-    #recast the x and y points into usable format for fillPoly and polylines
-    pts_left = np.array([np.transpose(np.vstack([left_lane_line_fitted_poly, y_linespace]))])
-    pts_right = np.array([np.flipud(np.transpose(np.vstack([right_lane_line_fitted_poly, y_linespace])))])
-    pts = np.hstack((pts_left, pts_right))
-
-    #draw the lane onto the warped blank image
-    cv2.fillPoly(warped_lane, np.int_([pts]), (152, 251, 152))
-    
-    #draw fitted lines on image
-    cv2.polylines(warped_lane, np.int_([pts_left]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
-    cv2.polylines(warped_lane, np.int_([pts_right]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
-
-    #transform perspective back to original (unwarp)
-    warped_to_original_perspective = perform_perspective_transform(warped_lane, perspective_transform_components[1])
-
-    #combine (weight) result with the original image
-    projected_lane = cv2.addWeighted(undistorted_image, 1, warped_to_original_perspective, 0.3, 0)
+#run the pipeline on the provided video
+#all per-stream state lives on a LaneTracker (built here for the video's frame size), so several pipelines can run in one process at once
+#frames are decoded on a background thread (up to decode_queue_depth frames ahead) and encoded on another (up to encode_queue_depth frames behind),
+#use_raw_pipe reads/writes raw rgb frames straight from/to ffmpeg rather than going through moviepy
+#when num_workers > 1, the stateless stages (undistort, warp, threshold) are fanned out to a pool of worker processes with at most
+#max_frames_in_flight frames outstanding, while the stateful stages (lane search, smoothing, projection) run serially and in frame order
+#an existing executor may be supplied instead (e.g., one pool shared by many streams), its workers should be started with initialize_worker
+#use_region_of_interest_thresholding only thresholds the search bands around the previous frame's lane lines (falling back to the full frame
+#whenever tracking isn't confident), this depends on the previous frame so thresholding then runs in the stateful stages
+#use_motion_model tracks the lane lines with a motion model rather than smoothing over their coefficient history (see lane_tracker)
+#processing_scale runs the warp, thresholding and lane line searches at a reduced resolution (e.g., 0.5), the lane is still drawn at full resolution
+#when path_to_stage_timings is set, the duration of every stage of every frame is recorded and exported there at the end of the run (.json or .csv)
+#when frame_budget_seconds is set, the video is treated as a live feed: each frame is due that long after it would have arrived from a camera running
+#at the video's frame rate, and frames that are running late are processed at a degraded level (see deadline_scheduler), frames are processed serially
+#in this mode (num_workers and executor are ignored) as the level of each frame is chosen when it's started
+#use_buffer_pool gives the stream a buffer pool (see buffer_pool) so the stages run in this process reuse their working arrays from frame to frame,
+#its ring of output frames covers every processed frame that can be held at once (encode_queue_depth queued, one being encoded and one being queued)
+#when path_to_lane_telemetry is set, a record of every frame's lane measurement and estimate is streamed there as the video is processed (see lane_telemetry)
+#a path_to_output_video of None renders nothing (frames are neither undistorted nor drawn on, and no encoder is started), for analytics-only runs
+#returns the number of frames processed
+def execute_production_pipeline(calibration_components, perspective_transform_components, path_to_input_video="test_video/project_video.mp4", path_to_output_video="output_video/processed_project_video.mp4", 
+                                num_workers=1, max_frames_in_flight=None, decode_queue_depth=8, encode_queue_depth=8, use_raw_pipe=False, use_region_of_interest_thresholding=False,
+                                use_fixed_point_maps=True, use_motion_model=False, processing_scale=1.0, executor=None, path_to_stage_timings=None, frame_budget_seconds=None,
+                                use_buffer_pool=True, path_to_lane_telemetry=None):
+    #open the video source and sink (if rendering)
+    frame_source = generate_frame_source(path_to_input_video, use_raw_pipe)
+    frame_sink = None
+    if (path_to_output_video is not None):
+        frame_sink = generate_frame_sink(path_to_output_video, frame_source[0], frame_source[1], use_raw_pipe)
+    #time decode and encode too when instrumented
+    stage_timings = None
+    if (path_to_stage_timings is not None):
+        stage_timings = StageTimings()
+        frame_source = generate_timed_frame_source(frame_source, stage_timings)
+        if (frame_sink is not None):
+            frame_sink = generate_timed_frame_sink(frame_sink, stage_timings)
+    #start decoding and encoding on background threads
+    frame_reader = start_frame_reader(frame_source, decode_queue_depth)
+    frame_writer = None
+    if (frame_sink is not None):
+        frame_writer = start_frame_writer(frame_sink, encode_queue_depth)
+    lane_telemetry_writer = None
+    if (path_to_lane_telemetry is not None):
+        lane_telemetry_writer = LaneTelemetryWriter(path_to_lane_telemetry)
+    #hand a processed frame to the encoder and record the lane telemetry of the frame
+    def finish_processed_frame(processed_frame):
+        if (frame_writer is not None):
+            frame_writer[0].put(processed_frame)
+        if (lane_telemetry_writer is not None):
+            lane_telemetry_writer.record_frame(lane_tracker)
+    num_frames_processed = 0
+    processing_error = None
+    try:
+        #track the lanes of this video (calibration, geometry, and coefficient history)
+        lane_tracker = LaneTracker(calibration_components, perspective_transform_components, frame_source[0], use_fixed_point_maps=use_fixed_point_maps,
+                                   use_region_of_interest_thresholding=use_region_of_interest_thresholding, stage_timings=stage_timings,
+                                   use_motion_model=use_motion_model, processing_scale=processing_scale,
+                                   buffer_pool=(FrameBufferPool(num_output_buffers=encode_queue_depth + 2) if use_buffer_pool else None), render_lane=(frame_sink is not None))
+        #deadline scheduled (serial) execution
+        if (frame_budget_seconds is not None):
+            deadline_scheduler = DeadlineScheduler(frame_budget_seconds)
+            for processed_frame in process_frames_against_deadlines(iterate_frame_queue(frame_reader[0]), lane_tracker, deadline_scheduler, frame_source[1]):
+                finish_processed_frame(processed_frame)
+                num_frames_processed += 1
+            deadline_scheduler.log_summary()
+        #parallel execution on a shared pool
+        elif (executor is not None):
+            if (max_frames_in_flight is None):
+                max_frames_in_flight = 2 * max(num_workers, 1)
+            for processed_frame in process_frames_in_parallel(iterate_frame_queue(frame_reader[0]), lane_tracker, executor, max_frames_in_flight):
+                finish_processed_frame(processed_frame)
+                num_frames_processed += 1
+        #serial execution
+        elif (num_workers <= 1):
+            for frame in iterate_frame_queue(frame_reader[0]):
+                finish_processed_frame(lane_tracker.process_frame(frame))
+                num_frames_processed += 1
+        #parallel execution
+        else:
+            #default to keeping each worker busy with two frames (one being processed, one queued)
+            if (max_frames_in_flight is None):
+                max_frames_in_flight = 2 * num_workers
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=initialize_worker, initargs=(threshold_processor.gaussian_blur_strategy,)) as executor:
+                for processed_frame in process_frames_in_parallel(iterate_frame_queue(frame_reader[0]), lane_tracker, executor, max_frames_in_flight):
+                    finish_processed_frame(processed_frame)
+                    num_frames_processed += 1
+    except BaseException as error:
+        processing_error = error
+        raise
+    finally:
+        #flush the encoder and the lane telemetry, and release the decoder (an encoder that fails to close can't hide why processing failed)
+        resource_releases = []
+        if (frame_writer is not None):
+            resource_releases.append(("flush the encoder", lambda: finish_frame_writer(frame_writer, frame_sink)))
+        if (lane_telemetry_writer is not None):
+            resource_releases.append(("close the lane telemetry", lane_telemetry_writer.close))
+        resource_releases.append(("release the decoder", frame_source[3]))
+        release_pipeline_resources(resource_releases, processing_error)
+    #export the stage timings
+    if (stage_timings is not None):
+        stage_timings.finish()
+        stage_timings.export(path_to_stage_timings)
+    #return the number of frames processed
+    return num_frames_processed
 
-    #add tracking text
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    cv2.putText(projected_lane, 'Lane curvature: {0:.2f} meters'.format(np.mean([left_curvature, right_curvature])), (20, 50), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
-    cv2.putText(projected_lane, 'Vehicle offset: {0:.2f} meters'.format(vehicle_offset), (20, 100), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
+#prepare a worker process to run the stateless stages of any stream (called once when each worker process starts)
+#workers look up each stream's geometry by the spec submitted with its frames, so nothing stream specific is set here
+def initialize_worker(gaussian_blur_strategy):
+    #workers use the same blur strategy as the parent process
+    threshold_processor.set_gaussian_blur_strategy(gaussian_blur_strategy)
 
-    #return processed frame for inclusion in processed video    
-    return projected_lane 
\ No newline at end of file
+#process a sequence of frames from one stream, running the stateless stages on the supplied executor and the stateful stages serially in frame order
+#frames are submitted ahead of the one currently being finished, but never more than max_frames_in_flight at a time (bounding memory use)
+def process_frames_in_parallel(frames, lane_tracker, executor, max_frames_in_flight):
+    #futures for the stateless stages of submitted frames, oldest (leftmost) first
+    frames_in_flight = deque()
+    for frame in frames:
+        #submit the frame's stateless stages to the pool
+        frames_in_flight.append(lane_tracker.submit_frame(executor, frame))
+        #once the window is full, finish the oldest frame before submitting another
+        if (len(frames_in_flight) >= max_frames_in_flight):
+            yield lane_tracker.perform_stateful_frame_stages(*frames_in_flight.popleft().result())
+    #drain the frames still in flight
+    while (len(frames_in_flight) > 0):
+        yield lane_tracker.perform_stateful_frame_stages(*frames_in_flight.popleft().result())
\ No newline at end of file
@@ -0,0 +1,298 @@
+####################################################
+## AUTHOR: James Beasley                          ##
+## DATE: February 18, 2017                        ##
+## UDACITY SDC: Project 4 (Advanced Lane Finding) ##
+####################################################
+
+#############
+## IMPORTS ##
+#############
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import OrderedDict
+import numpy as np
+import geometry_processor
+import threshold_processor
+import buffer_pool
+import packed_mask
+from geometry_processor import retrieve_geometry_components, perform_geometry_warp
+from threshold_processor import perform_fused_thresholding, generate_threshold_parameters
+from lane_tracker import LaneTracker
+from packed_mask import PackedMask
+
+#content addressed cache of the stateless stages' outputs, so iterating on the lane logic (search, fit, smoothing, rejection) re-runs a video in seconds:
+#   python stage_cache.py test_video/project_video.mp4       (the first run fills the cache, the next ones only run the lane logic)
+#each frame is keyed by a hash of its pixels, and each stage's output by the frame's key plus everything the stage depends on: the geometry key
+#(calibration, perspective transform, frame size, remap table type and processing scale), the blur strategy and threshold parameters, and the source code
+#of every module the stage runs (see warp_code_modules and threshold_code_modules), so editing lane_processor or lane_tracker reuses every entry, while editing threshold_processor (or switching blur strategy)
+#only re-runs thresholding on the cached warped frames, and a change to the geometry re-runs both
+#entries are .npy files (warped frames as is, thresholded frames as the rows of packed masks, see packed_mask) loaded memory mapped, so a frame only reads the parts it
+#uses (e.g., region of interest thresholding only reads the search bands of the warped frame), and the cache is held under max_cache_bytes by evicting
+#the least recently used entries
+#each video decoded in full also gets an index of its frames' keys (keyed by a hash of the video file), so once every entry a run needs is cached the
+#video isn't even decoded
+
+#version of the cache layout (bump whenever the layout changes so stale entries are never read)
+stage_cache_version = 1
+
+#hash of the source code of the supplied modules (the code version of the stages they implement)
+def compute_source_version(*modules):
+    source_hash = hashlib.sha1()
+    for module in modules:
+        with open(module.__file__, "rb") as source_file:
+            source_hash.update(source_file.read())
+    return source_hash.hexdigest()
+
+#every module of this project each cached stage runs (keep these in step with the stages' imports, an edit to any of them invalidates the stage's entries)
+warp_code_modules = (geometry_processor,)
+threshold_code_modules = (threshold_processor, buffer_pool, packed_mask)
+
+#code versions of the cached stages (thresholding also depends on the geometry it's applied to, through the warp key)
+warp_code_version = compute_source_version(*warp_code_modules)
+threshold_code_version = compute_source_version(*threshold_code_modules)
+
+#compute the key of a frame (a hash of its dimensions and pixels)
+def compute_frame_key(image):
+    frame_hash = hashlib.blake2b(digest_size=20)
+    frame_hash.update("{0}".format(image.shape).encode("ascii"))
+    frame_hash.update(np.ascontiguousarray(image).data)
+    return frame_hash.hexdigest()
+
+#compute the key of a stage's output from everything it depends on
+def compute_stage_key(stage_name, *key_parts):
+    return hashlib.sha1("|".join([str(stage_cache_version), stage_name] + [str(key_part) for key_part in key_parts]).encode("utf-8")).hexdigest()
+
+#compute the (warp key, threshold key) of a frame's stateless stages for the supplied geometry spec, blur strategy and threshold parameters
+#(see threshold_processor.generate_threshold_parameters, None is the defaults)
+def compute_frame_stage_keys(frame_key, geometry_spec, blur_strategy, threshold_parameters=None):
+    warp_key = compute_stage_key("warp", warp_code_version, frame_key, geometry_spec[0])
+    threshold_parameters = generate_threshold_parameters(**(threshold_parameters or {}))
+    return (warp_key, compute_stage_key("threshold", threshold_code_version, warp_key, blur_strategy, json.dumps(threshold_parameters, sort_keys=True)))
+
+#compute the key of a video (a hash of the video file's content, renamed or touched files keep their key)
+def compute_video_key(path_to_video):
+    video_hash = hashlib.sha1()
+    with open(path_to_video, "rb") as video_file:
+        for video_chunk in iter(lambda: video_file.read(1 << 20), b""):
+            video_hash.update(video_chunk)
+    return compute_stage_key("video", video_hash.hexdigest())
+
+#a size bounded, content addressed store of arrays (see the top of this file), entries are named by stage and key
+#entries are written to a temporary file and renamed into place, and an entry evicted by another process sharing the directory just reads as a miss
+class StageCache:
+    __slots__ = ("cache_directory", "max_cache_bytes", "entry_sizes", "cache_bytes", "stage_hit_counts", "stage_miss_counts", "num_entries_evicted")
+
+    def __init__(self, cache_directory="stage_cache", max_cache_bytes=4 * (1024 ** 3)):
+        self.cache_directory = cache_directory
+        self.max_cache_bytes = max_cache_bytes
+        #entry path --> size in bytes, least recently used first (ordered by modification time on disk, which is bumped on every hit)
+        self.entry_sizes = OrderedDict()
+        entry_mtimes = []
+        for stage_directory, _, file_names in os.walk(cache_directory):
+            for file_name in file_names:
+                if (file_name.endswith(".npy")):
+                    entry_stat = os.stat(os.path.join(stage_directory, file_name))
+                    entry_mtimes.append((entry_stat.st_mtime_ns, os.path.join(stage_directory, file_name), entry_stat.st_size))
+        for _, path_to_entry, entry_size in sorted(entry_mtimes):
+            self.entry_sizes[path_to_entry] = entry_size
+        self.cache_bytes = sum(self.entry_sizes.values())
+        #stage name --> number of hits, and of misses
+        self.stage_hit_counts = {}
+        self.stage_miss_counts = {}
+        self.num_entries_evicted = 0
+
+    #path of an entry
+    def generate_entry_path(self, stage_name, entry_key):
+        return os.path.join(self.cache_directory, stage_name, entry_key + ".npy")
+
+    #true if the entry is cached
+    def contains_entry(self, stage_name, entry_key):
+        return os.path.isfile(self.generate_entry_path(stage_name, entry_key))
+
+    #load an entry (memory mapped, read only), returns None on a miss
+    def load_entry(self, stage_name, entry_key):
+        path_to_entry = self.generate_entry_path(stage_name, entry_key)
+        try:
+            entry = np.load(path_to_entry, mmap_mode='r')
+            #mark it as the most recently used
+            os.utime(path_to_entry)
+        except (FileNotFoundError, ValueError):
+            self.stage_miss_counts[stage_name] = self.stage_miss_counts.get(stage_name, 0) + 1
+            return None
+        if (path_to_entry in self.entry_sizes):
+            self.entry_sizes.move_to_end(path_to_entry)
+        self.stage_hit_counts[stage_name] = self.stage_hit_counts.get(stage_name, 0) + 1
+        return entry
+
+    #save an entry, then evict the least recently used entries until the cache fits within max_cache_bytes again
+    def save_entry(self, stage_name, entry_key, entry):
+        path_to_entry = self.generate_entry_path(stage_name, entry_key)
+        os.makedirs(os.path.dirname(path_to_entry), exist_ok=True)
+        #(the temporary file is unique to this process, in case several are filling the same cache)
+        temp_path_to_entry = "{0}.{1}.tmp".format(path_to_entry, os.getpid())
+        with open(temp_path_to_entry, "wb") as entry_file:
+            np.save(entry_file, entry)
+        os.replace(temp_path_to_entry, path_to_entry)
+        self.cache_bytes -= self.entry_sizes.pop(path_to_entry, 0)
+        self.entry_sizes[path_to_entry] = os.path.getsize(path_to_entry)
+        self.cache_bytes += self.entry_sizes[path_to_entry]
+        self.evict_entries()
+
+    #evict the least recently used entries (never the most recent one) until the cache fits within max_cache_bytes
+    def evict_entries(self):
+        while ((self.cache_bytes > self.max_cache_bytes) and (len(self.entry_sizes) > 1)):
+            path_to_entry, entry_size = self.entry_sizes.popitem(last=False)
+            self.cache_bytes -= entry_size
+            self.num_entries_evicted += 1
+            try:
+                os.remove(path_to_entry)
+            except FileNotFoundError:
+                pass
+
+    #summarize the cache: size, and per stage hits and misses
+    def summarize(self):
+        stage_names = sorted(set(self.stage_hit_counts) | set(self.stage_miss_counts))
+        return {"entries": len(self.entry_sizes), "cache_bytes": self.cache_bytes, "max_cache_bytes": self.max_cache_bytes, "entries_evicted": self.num_entries_evicted,
+                "stages": {stage_name: {"hits": self.stage_hit_counts.get(stage_name, 0), "misses": self.stage_miss_counts.get(stage_name, 0)} for stage_name in stage_names}}
+
+#the stateless stages of a frame (see lane_tracker.perform_stateless_frame_stages, the undistorted image is never produced) served from the cache where
+#possible, and computed and cached otherwise, frame_stage_keys are the frame's keys (see compute_frame_stage_keys)
+#image is only read on a miss, so it can be None when the entries are known to be cached (a miss then raises KeyError)
+#threshold_parameters must be those the frame's keys were computed with
+#in region of interest mode only the warped frame is needed (thresholding depends on the previous frame), otherwise only the thresholded frame is
+#(returned as a packed mask straight over the memory mapped entry, which the lane line searches read without unpacking)
+def perform_cached_stateless_frame_stages(stage_cache, frame_stage_keys, image, geometry_spec, use_region_of_interest_thresholding=False, threshold_parameters=None):
+    warp_key, threshold_key = frame_stage_keys
+    #the thresholded frame
+    if (not use_region_of_interest_thresholding):
+        packed_rows = stage_cache.load_entry("threshold", threshold_key)
+        if (packed_rows is not None):
+            #(the warp map sets the width of the warped frame)
+            return (None, None, PackedMask(packed_rows, retrieve_geometry_components(geometry_spec)[1][0].shape[1]), None)
+    #the warped frame (needed either way on a thresholding miss)
+    warped_image = stage_cache.load_entry("warp", warp_key)
+    if (warped_image is None):
+        if (image is None):
+            raise KeyError("warp entry {0} isn't cached".format(warp_key))
+        warped_image = perform_geometry_warp(image, retrieve_geometry_components(geometry_spec))
+        stage_cache.save_entry("warp", warp_key, warped_image)
+    if (use_region_of_interest_thresholding):
+        return (None, warped_image, None, None)
+    #threshold the warped frame (the packed mask's rows are what's cached)
+    thresholded_image = perform_fused_thresholding(warped_image, processing_scale=geometry_spec[5], threshold_parameters=threshold_parameters, pack_mask=True)
+    stage_cache.save_entry("threshold", threshold_key, thresholded_image.packed_rows)
+    return (None, None, thresholded_image, None)
+
+#load the index of a video's frame keys, returns (image_size, frame_keys) or None if the video hasn't been decoded in full
+def load_video_frame_index(stage_cache, video_key):
+    video_frame_index = stage_cache.load_entry("video", video_key)
+    if (video_frame_index is None):
+        return None
+    video_frame_index = json.loads(bytes(video_frame_index).decode("utf-8"))
+    return (tuple(video_frame_index["image_size"]), video_frame_index["frame_keys"])
+
+#save the index of a video's frame keys (stored as the utf-8 bytes of a json document)
+def save_video_frame_index(stage_cache, video_key, image_size, frame_keys):
+    stage_cache.save_entry("video", video_key, np.frombuffer(json.dumps({"image_size": list(image_size), "frame_keys": frame_keys}).encode("utf-8"), dtype=np.uint8))
+
+#track the lane lines of a video with its stateless stages served from the stage cache (see the top of this file), the tracker settings are those of
+#LaneTracker (lanes are estimated but not rendered, threshold_parameters as in LaneTracker), the video is only decoded if an entry the run needs isn't cached
+#returns the lane estimate of each frame (see LaneTracker.last_lane_estimate)
+def execute_cached_lane_tracking(calibration_components, perspective_transform_components, path_to_input_video, stage_cache, use_region_of_interest_thresholding=False,
+                                 use_fixed_point_maps=True, use_motion_model=False, processing_scale=1.0, use_raw_pipe=True, threshold_parameters=None):
+    video_key = compute_video_key(path_to_input_video)
+    video_frame_index = load_video_frame_index(stage_cache, video_key)
+    #everything needed is cached, run straight from the cache
+    if (video_frame_index is not None):
+        image_size, frame_keys = video_frame_index
+        lane_tracker = LaneTracker(calibration_components, perspective_transform_components, image_size, use_fixed_point_maps=use_fixed_point_maps,
+                                   use_region_of_interest_thresholding=use_region_of_interest_thresholding, use_motion_model=use_motion_model,
+                                   processing_scale=processing_scale, render_lane=False, threshold_parameters=threshold_parameters)
+        frame_stage_keys = [compute_frame_stage_keys(frame_key, lane_tracker.geometry_spec, threshold_processor.gaussian_blur_strategy, lane_tracker.threshold_parameters)
+                            for frame_key in frame_keys]
+        #(region of interest mode needs the warped frames, otherwise only the thresholded frames)
+        if (all(stage_cache.contains_entry("warp", warp_key) if (use_region_of_interest_thresholding) else stage_cache.contains_entry("threshold", threshold_key)
+                for (warp_key, threshold_key) in frame_stage_keys)):
+            try:
+                lane_estimates = []
+                for cur_frame_stage_keys in frame_stage_keys:
+                    lane_tracker.perform_stateful_frame_stages(*perform_cached_stateless_frame_stages(stage_cache, cur_frame_stage_keys, None, lane_tracker.geometry_spec,
+                                                                                                     use_region_of_interest_thresholding, lane_tracker.threshold_parameters))
+                    lane_estimates.append(lane_tracker.last_lane_estimate)
+                return lane_estimates
+            except KeyError:
+                #an entry was evicted (by another process) part way through, start over from the video
+                pass
+    #otherwise decode the video, computing (and caching) whatever isn't cached
+    #(imported here as only a run that decodes needs video io)
+    from frame_io import generate_frame_source
+    frame_source = generate_frame_source(path_to_input_video, use_raw_pipe)
+    try:
+        lane_tracker = LaneTracker(calibration_components, perspective_transform_components, frame_source[0], use_fixed_point_maps=use_fixed_point_maps,
+                                   use_region_of_interest_thresholding=use_region_of_interest_thresholding, use_motion_model=use_motion_model,
+                                   processing_scale=processing_scale, render_lane=False, threshold_parameters=threshold_parameters)
+        frame_keys = []
+        lane_estimates = []
+        frame = frame_source[2]()
+        while (frame is not None):
+            frame_keys.append(compute_frame_key(frame))
+            cur_frame_stage_keys = compute_frame_stage_keys(frame_keys[-1], lane_tracker.geometry_spec, threshold_processor.gaussian_blur_strategy, lane_tracker.threshold_parameters)
+            lane_tracker.perform_stateful_frame_stages(*perform_cached_stateless_frame_stages(stage_cache, cur_frame_stage_keys, frame, lane_tracker.geometry_spec,
+                                                                                             use_region_of_interest_thresholding, lane_tracker.threshold_parameters))
+            lane_estimates.append(lane_tracker.last_lane_estimate)
+            frame = frame_source[2]()
+    finally:
+        frame_source[3]()
+    save_video_frame_index(stage_cache, video_key, frame_source[0], frame_keys)
+    return lane_estimates
+
+#save lane estimates (see execute_cached_lane_tracking) as an npz of per frame left and right coefficients, curvature and offset (nan before the first estimate)
+def save_lane_estimates(path_to_lane_estimates, lane_estimates):
+    lane_line_coeff = np.full((len(lane_estimates), 2, 3), np.nan)
+    curvature_and_offset = np.full((len(lane_estimates), 2), np.nan)
+    for frame_index, lane_estimate in enumerate(lane_estimates):
+        if (lane_estimate is not None):
+            lane_line_coeff[frame_index] = lane_estimate[:2]
+            curvature_and_offset[frame_index] = lane_estimate[2:]
+    np.savez(path_to_lane_estimates, lane_line_coeff=lane_line_coeff, curvature=curvature_and_offset[:, 0], vehicle_offset=curvature_and_offset[:, 1])
+
+#parse the command line arguments (defaults come from the settings in main)
+def parse_stage_cache_arguments(main, argv=None):
+    parser = argparse.ArgumentParser(description="Track the lane lines of a video with the stateless stages served from a content addressed stage cache.")
+    parser.add_argument("input", help="input video")
+    parser.add_argument("--cache-dir", default="stage_cache", help="directory of the stage cache")
+    parser.add_argument("--max-cache-gb", type=float, default=4.0, help="size the cache is held under (least recently used entries are evicted)")
+    parser.add_argument("--output", default=None, help="save the lane estimate of every frame here (.npz)")
+    main.add_pipeline_arguments(parser)
+    return parser.parse_args(argv)
+
+#run the stage cache command
+def execute_stage_cache_command(argv=None):
+    #(imported here so the cache can be used without pulling in the whole pipeline)
+    import main
+    arguments = parse_stage_cache_arguments(main, argv)
+    calibration_components = main.generate_camera_calibration_components(arguments.calibration_images, arguments.calibration_cache)
+    perspective_transform_components = main.generate_road_perspective_transform_components()
+    threshold_processor.set_gaussian_blur_strategy(arguments.blur_strategy)
+    stage_cache = StageCache(arguments.cache_dir, int(arguments.max_cache_gb * (1024 ** 3)))
+    start_time = time.perf_counter()
+    lane_estimates = execute_cached_lane_tracking(calibration_components, perspective_transform_components, arguments.input, stage_cache,
+                                                  use_region_of_interest_thresholding=arguments.use_region_of_interest_thresholding, use_fixed_point_maps=arguments.use_fixed_point_maps,
+                                                  use_motion_model=arguments.use_motion_model, processing_scale=arguments.processing_scale, use_raw_pipe=arguments.use_raw_pipe)
+    elapsed_seconds = time.perf_counter() - start_time
+    if (arguments.output is not None):
+        save_lane_estimates(arguments.output, lane_estimates)
+    cache_summary = stage_cache.summarize()
+    print("tracked {0} frames in {1:.1f}s ({2:.1f} fps)".format(len(lane_estimates), elapsed_seconds, len(lane_estimates) / max(elapsed_seconds, 1e-9)))
+    print("cache: {0} entries, {1:.2f} of {2:.2f} GB, {3} evicted".format(cache_summary["entries"], cache_summary["cache_bytes"] / (1024 ** 3), cache_summary["max_cache_bytes"] / (1024 ** 3),
+                                                                      cache_summary["entries_evicted"]))
+    for stage_name, stage_summary in cache_summary["stages"].items():
+        print("  {0:<10} {1:>6} hits {2:>6} misses".format(stage_name, stage_summary["hits"], stage_summary["misses"]))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(execute_stage_cache_command())
\ No newline at end of file
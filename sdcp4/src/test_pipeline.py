@@ -7,37 +7,104 @@
 #############
 ## IMPORTS ##
 #############
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import cv2
 import numpy as np
-import matplotlib.image as mpimg
+import threshold_processor
 from calibration_processor import perform_undistort
 from perspective_processor import perform_perspective_transform
-from threshold_processor import perform_thresholding
-from lane_processor import perform_educated_lane_line_pixel_search, perform_blind_lane_line_pixel_search, compute_lane_line_coefficients, compute_curvature_of_lane_lines, compute_vehicle_offset
+from threshold_processor import perform_thresholding, perform_fused_thresholding, gaussian_blur_strategies
+from lane_processor import perform_educated_lane_line_pixel_search, perform_blind_lane_line_pixel_search, compute_lane_line_coefficients, compute_curvature_of_lane_lines, compute_vehicle_offset, compute_lane_line_base_density_histogram
+from artifact_writer import ArtifactWriter, is_artifact_selected, render_hot_pixel_density_histogram
+from frame_io import generate_frame_source
+from production_pipeline import initialize_worker
 
-#test the pipeline components and produce outputs in the output_images directory
+#run the pipeline stages over road images and produce a debug artifact (image) from each stage in the output_images directory, e.g.:
+#   python test_pipeline.py test_images/ --jobs 4 --artifacts stage2 stage3_blind_search_fitted_polynomials
+#   python test_pipeline.py test_video/project_video.mp4 --video-stride 10
+#   python test_pipeline.py test_images/ --parity-check     (exits non-zero if the fused thresholding kernel differs from perform_thresholding)
+#the input is a single road image, a directory of road images, or a video (sampled every video_frame_stride frames)
+#road images are processed across a pool of worker processes, and the artifacts are encoded and written on a pool of background threads (see ArtifactWriter)
+#only the selected artifacts are rendered and written (by name or by stage, see is_artifact_selected)
+
+#artifacts produced for each road image, in stage order (artifact <name> of road image <image> is written to output_images/<name>_<image>.jpg)
+test_pipeline_artifacts = ("stage0_undistorted", "stage1_src_vertices", "stage1_warped", "stage1_lane_alignment_warped", "stage2_thresholded_warped",
+                           "stage3_hot_pixel_density_histogram", "stage3_blind_search_fitted_polynomials", "stage3_educated_search_fitted_polynomials",
+                           "stage4_warped_lane", "stage4_projected_lane")
+
+#image file extensions picked up when a directory is supplied as the input
+road_image_file_extensions = (".jpg", ".jpeg", ".png")
+
+#read an image file as an rgb image
+def read_rgb_image(path_to_image):
+    image = cv2.imread(path_to_image, cv2.IMREAD_COLOR)
+    if (image is None):
+        raise IOError("unable to read {0}".format(path_to_image))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+#generate the road images to test from the input (a road image, a directory of road images, or a video)
+#yields (image name, road image), where the road image is the path to an image file (read by the worker processing it) or a decoded video frame
+#a video is sampled every video_frame_stride frames (at most max_video_frames are sampled, None samples the whole video)
+def generate_test_road_images(input_path, video_frame_stride=30, max_video_frames=None):
+    if (os.path.isdir(input_path)):
+        for file_name in sorted(os.listdir(input_path)):
+            if (file_name.lower().endswith(road_image_file_extensions)):
+                yield (os.path.splitext(file_name)[0], os.path.join(input_path, file_name))
+    elif (input_path.lower().endswith(road_image_file_extensions)):
+        yield (os.path.splitext(os.path.basename(input_path))[0], input_path)
+    else:
+        video_name = os.path.splitext(os.path.basename(input_path))[0]
+        frame_source = generate_frame_source(input_path)
+        try:
+            num_frames_sampled = 0
+            frame_index = 0
+            frame = frame_source[2]()
+            while ((frame is not None) and ((max_video_frames is None) or (num_frames_sampled < max_video_frames))):
+                if ((frame_index % video_frame_stride) == 0):
+                    #the source may reuse its frame buffers, keep a copy
+                    yield ("{0}_frame{1:05d}".format(video_name, frame_index), np.array(frame))
+                    num_frames_sampled += 1
+                frame_index += 1
+                frame = frame_source[2]()
+        finally:
+            frame_source[3]()
+
+#draw the fitted polynomials of the left and right lane lines on the supplied (search debug) image
+def draw_fitted_lane_line_polynomials(debug_image, pts_left, pts_right):
+    cv2.polylines(debug_image, np.int_([pts_left]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
+    cv2.polylines(debug_image, np.int_([pts_right]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
+
+#compute the fitted polynomial (f(y) = A(y^2) + By + C) of the left and right lane lines over the y interval of the image
+#returns (left fitted polynomial, right fitted polynomial, pts_left, pts_right), the pts are recast into the format used by polylines and fillPoly
+def compute_fitted_lane_line_polynomials(y_linespace, left_lane_line_coeff, right_lane_line_coeff):
+    #left lane fitted polynomial (f(y) = A(y^2) + By + C)
+    left_lane_line_fitted_poly = (left_lane_line_coeff[0] * (y_linespace ** 2)) + (left_lane_line_coeff[1] * y_linespace) + left_lane_line_coeff[2]
+    #right lane fitted polynomial (f(y) = A(y^2) + By + C)
+    right_lane_line_fitted_poly = (right_lane_line_coeff[0] * (y_linespace ** 2)) + (right_lane_line_coeff[1] * y_linespace) + right_lane_line_coeff[2]
+    #recast the x and y points into usable format for polylines and fillPoly
+    pts_left = np.array([np.transpose(np.vstack([left_lane_line_fitted_poly, y_linespace]))])
+    pts_right = np.array([np.flipud(np.transpose(np.vstack([right_lane_line_fitted_poly, y_linespace])))])
+    return (left_lane_line_fitted_poly, right_lane_line_fitted_poly, pts_left, pts_right)
+
+#run the pipeline stages over a road image, returns a list of (artifact name, artifact image) for the selected artifacts (see test_pipeline_artifacts)
+#every stage runs regardless of the selection (later stages depend on earlier ones), only the rendering of unselected artifacts is skipped
 #perspective_transform_components[0] is warp_perspective_matrix, perspective_transform_components[1] is unwarp_perspective_matrix
-def execute_test_pipeline(calibration_components, perspective_transform_components, src_vertices):
-    
+def generate_test_road_image_artifacts(test_road_image, calibration_components, perspective_transform_components, src_vertices, selected_artifacts=None):
+    artifacts = []
+
     #############################
     ## TEST CAMERA CALIBRATION ##
     #############################
-    
-    #test camera calibration by undistorting a test chessboard image
-    #load image
-    test_chessboard_image = mpimg.imread("camera_cal/calibration1.jpg")
-    #undistort image
-    undistorted_test_chessboard_image = perform_undistort(test_chessboard_image, calibration_components)
-    #save image
-    mpimg.imsave("output_images/stage0_undistorted_calibration1.jpg", undistorted_test_chessboard_image)
-
-    #test camera calibration by undistorting a test road image
-    #load image
-    test_road_image = mpimg.imread("test_images/straight_lines1.jpg")
-    #undistort image - this undistorted image will be used to demonstrate the production_pipeline along the way (all outputs will be placed in 'output_images' folder)
+
+    #test camera calibration by undistorting the road image
+    #this undistorted image will be used to demonstrate the production_pipeline along the way
     undistorted_test_road_image = perform_undistort(test_road_image, calibration_components)
-    #save image
-    mpimg.imsave("output_images/stage0_undistorted_straight_lines1.jpg", undistorted_test_road_image)
+    artifacts.append(("stage0_undistorted", undistorted_test_road_image))
 
     ################################
     ## TEST PERSPECTIVE TRANSFORM ##
@@ -47,36 +114,35 @@ def execute_test_pipeline(calibration_components, perspective_transform_componen
     line_color = [255, 0, 0] #red
     line_thickness = 3
 
-    #draw lines on test road image to display source vertices 
-    src_vertices_image = undistorted_test_road_image.copy() #copy as not to affect original image
-    cv2.line(src_vertices_image, src_vertices[0], src_vertices[3], line_color, line_thickness)
-    cv2.line(src_vertices_image, src_vertices[0], src_vertices[1], line_color, line_thickness)
-    cv2.line(src_vertices_image, src_vertices[3], src_vertices[2], line_color, line_thickness)
-    cv2.line(src_vertices_image, src_vertices[1], src_vertices[2], line_color, line_thickness)
-    #save image
-    mpimg.imsave("output_images/stage1_src_vertices_straight_lines1.jpg", src_vertices_image)
+    #draw lines on test road image to display source vertices
+    if (is_artifact_selected("stage1_src_vertices", selected_artifacts)):
+        src_vertices_image = undistorted_test_road_image.copy() #copy as not to affect original image
+        cv2.line(src_vertices_image, src_vertices[0], src_vertices[3], line_color, line_thickness)
+        cv2.line(src_vertices_image, src_vertices[0], src_vertices[1], line_color, line_thickness)
+        cv2.line(src_vertices_image, src_vertices[3], src_vertices[2], line_color, line_thickness)
+        cv2.line(src_vertices_image, src_vertices[1], src_vertices[2], line_color, line_thickness)
+        artifacts.append(("stage1_src_vertices", src_vertices_image))
 
-    #transform perspective (warp) - this will squish the depth of field in the source mapping into the height of the image, 
+    #transform perspective (warp) - this will squish the depth of field in the source mapping into the height of the image,
     #which will make the upper 3/4ths blurry, need to adjust dest_upper* y-values to negative to stretch it out and clear the transformed image up
-    #we won't do that as we'll lose right dashes in the 720 pix height of the image frame 
+    #we won't do that as we'll lose right dashes in the 720 pix height of the image frame
     warped_undistorted_test_road_image = perform_perspective_transform(undistorted_test_road_image, perspective_transform_components[0])
-    #save image
-    mpimg.imsave("output_images/stage1_warped_straight_lines1.jpg", warped_undistorted_test_road_image)
+    artifacts.append(("stage1_warped", warped_undistorted_test_road_image))
 
     #draw lines on warped test road image to check alignment of lanes
-    lane_alignment_warped_undistorted_test_road_image = warped_undistorted_test_road_image.copy() #copy as not to affect original image
-    #set lane alignment verticies to check correctness of perspective transform
-    lane_alignment_upper_left = (205, 0)
-    lane_alignment_upper_right = (1105, 0)
-    lane_alignment_lower_left = (205, 720)
-    lane_alignment_lower_right = (1105, 720)
-    #draw lane alignment lines on warped image
-    cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_left, lane_alignment_upper_right, line_color, line_thickness)
-    cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_left, lane_alignment_lower_left, line_color, line_thickness)
-    cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_right, lane_alignment_lower_right, line_color, line_thickness)
-    cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_lower_left, lane_alignment_lower_right, line_color, line_thickness)
-    #save image
-    mpimg.imsave("output_images/stage1_lane_alignment_warped_straight_lines1.jpg", lane_alignment_warped_undistorted_test_road_image)
+    if (is_artifact_selected("stage1_lane_alignment_warped", selected_artifacts)):
+        lane_alignment_warped_undistorted_test_road_image = warped_undistorted_test_road_image.copy() #copy as not to affect original image
+        #set lane alignment verticies to check correctness of perspective transform
+        lane_alignment_upper_left = (205, 0)
+        lane_alignment_upper_right = (1105, 0)
+        lane_alignment_lower_left = (205, 720)
+        lane_alignment_lower_right = (1105, 720)
+        #draw lane alignment lines on warped image
+        cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_left, lane_alignment_upper_right, line_color, line_thickness)
+        cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_left, lane_alignment_lower_left, line_color, line_thickness)
+        cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_upper_right, lane_alignment_lower_right, line_color, line_thickness)
+        cv2.line(lane_alignment_warped_undistorted_test_road_image, lane_alignment_lower_left, lane_alignment_lower_right, line_color, line_thickness)
+        artifacts.append(("stage1_lane_alignment_warped", lane_alignment_warped_undistorted_test_road_image))
 
     ####################################
     ## TEST COLOR/GRADIENT THRESHOLD  ##
@@ -84,106 +150,231 @@ def execute_test_pipeline(calibration_components, perspective_transform_componen
 
     #apply thresholding to warped image and produce a binary result
     thresholded_warped_undistorted_test_road_image = perform_thresholding(warped_undistorted_test_road_image)
-    
-    #export as black and white image (instead of current single channel binary image which would be visualized as blue (representing zeros) and red (representing positive values 1 or 255) 
-    #scale to 8-bit (0 - 255) then convert to type = np.uint8
-    thresholded_warped_undistorted_test_road_image_scaled = np.uint8((255 * thresholded_warped_undistorted_test_road_image) / np.max(thresholded_warped_undistorted_test_road_image))
-    #stack to create final black and white image
-    thresholded_warped_undistorted_test_road_image_bw = np.dstack((thresholded_warped_undistorted_test_road_image_scaled, thresholded_warped_undistorted_test_road_image_scaled, thresholded_warped_undistorted_test_road_image_scaled))
-    #save image
-    mpimg.imsave("output_images/stage2_thresholded_warped_straight_lines1.jpg", thresholded_warped_undistorted_test_road_image_bw)
-    
+
+    #export as black and white image (instead of current single channel binary image which would be visualized as blue (representing zeros) and red (representing positive values 1 or 255)
+    if (is_artifact_selected("stage2_thresholded_warped", selected_artifacts)):
+        #scale to 8-bit (0 - 255) then convert to type = np.uint8 (an image without a single hot pixel stays black)
+        thresholded_warped_undistorted_test_road_image_scaled = np.uint8((255 * thresholded_warped_undistorted_test_road_image) / max(np.max(thresholded_warped_undistorted_test_road_image), 1))
+        #stack to create final black and white image
+        thresholded_warped_undistorted_test_road_image_bw = np.dstack((thresholded_warped_undistorted_test_road_image_scaled, thresholded_warped_undistorted_test_road_image_scaled, thresholded_warped_undistorted_test_road_image_scaled))
+        artifacts.append(("stage2_thresholded_warped", thresholded_warped_undistorted_test_road_image_bw))
+
     #########################
     ## TEST LANE DETECTION ##
     #########################
-    
+
     ## BLIND SEARCH ##
-    
+
+    #plot the hot pixel density histogram the blind search estimates the lane line bases from (on its own figure, see render_hot_pixel_density_histogram)
+    if (is_artifact_selected("stage3_hot_pixel_density_histogram", selected_artifacts)):
+        artifacts.append(("stage3_hot_pixel_density_histogram", render_hot_pixel_density_histogram(compute_lane_line_base_density_histogram(thresholded_warped_undistorted_test_road_image))))
+
     #map out the left and right lane line pixel coordinates via windowed search
-    left_lane_pixel_coordinates, right_lane_pixel_coordinates, blind_debug_image = perform_blind_lane_line_pixel_search(thresholded_warped_undistorted_test_road_image, return_debug_image=True)
-    
+    left_lane_pixel_coordinates, right_lane_pixel_coordinates, blind_debug_image = perform_blind_lane_line_pixel_search(thresholded_warped_undistorted_test_road_image,
+                                                                                                                         return_debug_image=is_artifact_selected("stage3_blind_search_fitted_polynomials", selected_artifacts))
+
     #compute the polynomial coefficients for each lane line using the x and y pixel locations from the mapping function
     #we're fitting (computing coefficients of) a second order polynomial: f(y) = A(y^2) + By + C
-    #we're fitting for f(y) rather than f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value 
+    #we're fitting for f(y) rather than f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value
     left_lane_line_coeff, right_lane_line_coeff = compute_lane_line_coefficients(left_lane_pixel_coordinates, right_lane_pixel_coordinates)
-    
+    if ((left_lane_line_coeff is None) or (right_lane_line_coeff is None)):
+        raise RuntimeError("the blind search found no pixels for the {0} lane line".format("left" if (left_lane_line_coeff is None) else "right"))
+
     #generate range of evenly spaced numbers over y interval (0 - 719) matching image height
     y_linespace = np.linspace(0, (thresholded_warped_undistorted_test_road_image.shape[0] - 1), thresholded_warped_undistorted_test_road_image.shape[0])
-    
-    #left lane fitted polynomial (f(y) = A(y^2) + By + C)
-    left_lane_line_fitted_poly = (left_lane_line_coeff[0] * (y_linespace ** 2)) + (left_lane_line_coeff[1] * y_linespace) + left_lane_line_coeff[2]
-    #right lane fitted polynomial (f(y) = A(y^2) + By + C)
-    right_lane_line_fitted_poly = (right_lane_line_coeff[0] * (y_linespace ** 2)) + (right_lane_line_coeff[1] * y_linespace) + right_lane_line_coeff[2]
 
-    #draw the fitted polynomials on the debug_image and export
-    #recast the x and y points into usable format for polylines and fillPoly
-    pts_left = np.array([np.transpose(np.vstack([left_lane_line_fitted_poly, y_linespace]))])
-    pts_right = np.array([np.flipud(np.transpose(np.vstack([right_lane_line_fitted_poly, y_linespace])))])
-    #draw lines (on the blind search debug image)
-    cv2.polylines(blind_debug_image, np.int_([pts_left]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-    cv2.polylines(blind_debug_image, np.int_([pts_right]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-    #save image
-    mpimg.imsave("output_images/stage3_blind_search_fitted_polynomials_straight_lines1.jpg", blind_debug_image)
-    
+    #fit the polynomials over the y interval
+    left_lane_line_fitted_poly, right_lane_line_fitted_poly, pts_left, pts_right = compute_fitted_lane_line_polynomials(y_linespace, left_lane_line_coeff, right_lane_line_coeff)
+
+    #draw the fitted polynomials on the blind search debug image
+    if (blind_debug_image is not None):
+        draw_fitted_lane_line_polynomials(blind_debug_image, pts_left, pts_right)
+        artifacts.append(("stage3_blind_search_fitted_polynomials", blind_debug_image))
+
     ## EDUCATED SEARCH ##
-    
+
     #map out the left and right lane line pixel coordinates via windowed search
-    left_lane_pixel_coordinates, right_lane_pixel_coordinates, educated_debug_image = perform_educated_lane_line_pixel_search(thresholded_warped_undistorted_test_road_image, left_lane_line_coeff, right_lane_line_coeff, left_lane_line_fitted_poly, right_lane_line_fitted_poly, return_debug_image=True)
-    
+    left_lane_pixel_coordinates, right_lane_pixel_coordinates, educated_debug_image = perform_educated_lane_line_pixel_search(thresholded_warped_undistorted_test_road_image, left_lane_line_coeff, right_lane_line_coeff, left_lane_line_fitted_poly, right_lane_line_fitted_poly,
+                                                                                                                               return_debug_image=is_artifact_selected("stage3_educated_search_fitted_polynomials", selected_artifacts))
+
     #compute the polynomial coefficients for each lane line using the x and y pixel locations from the mapping function
-    #we're fitting (computing coefficients of) a second order polynomial: f(y) = A(y^2) + By + C
-    #we're fitting for f(y) rather than f(x), as the lane lines in the warped image are near vertical and may have the same x value for more than one y value 
     left_lane_line_coeff, right_lane_line_coeff = compute_lane_line_coefficients(left_lane_pixel_coordinates, right_lane_pixel_coordinates)
-    
-    #left lane fitted polynomial (f(y) = A(y^2) + By + C)
-    left_lane_line_fitted_poly = (left_lane_line_coeff[0] * (y_linespace ** 2)) + (left_lane_line_coeff[1] * y_linespace) + left_lane_line_coeff[2]
-    #right lane fitted polynomial (f(y) = A(y^2) + By + C)
-    right_lane_line_fitted_poly = (right_lane_line_coeff[0] * (y_linespace ** 2)) + (right_lane_line_coeff[1] * y_linespace) + right_lane_line_coeff[2]
+    if ((left_lane_line_coeff is None) or (right_lane_line_coeff is None)):
+        raise RuntimeError("the educated search found no pixels for the {0} lane line".format("left" if (left_lane_line_coeff is None) else "right"))
+
+    #fit the polynomials over the y interval
+    left_lane_line_fitted_poly, right_lane_line_fitted_poly, pts_left, pts_right = compute_fitted_lane_line_polynomials(y_linespace, left_lane_line_coeff, right_lane_line_coeff)
+
+    #draw the fitted polynomials on the educated search debug image
+    if (educated_debug_image is not None):
+        draw_fitted_lane_line_polynomials(educated_debug_image, pts_left, pts_right)
+        artifacts.append(("stage3_educated_search_fitted_polynomials", educated_debug_image))
 
-    #draw the fitted polynomials on the debug_image and export
-    #recast the x and y points into usable format for polylines and fillPoly
-    pts_left = np.array([np.transpose(np.vstack([left_lane_line_fitted_poly, y_linespace]))])
-    pts_right = np.array([np.flipud(np.transpose(np.vstack([right_lane_line_fitted_poly, y_linespace])))])
-    #draw lines (on the educated search debug image)
-    cv2.polylines(educated_debug_image, np.int_([pts_left]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-    cv2.polylines(educated_debug_image, np.int_([pts_right]), False, color=(255, 255, 0), thickness=2, lineType=cv2.LINE_AA)
-    #save image
-    mpimg.imsave("output_images/stage3_educated_search_fitted_polynomials_straight_lines1.jpg", educated_debug_image)
-    
     ## compute left and right lane curvature ##
-    left_curvature, right_curvature = compute_curvature_of_lane_lines(thresholded_warped_undistorted_test_road_image.shape, left_lane_line_fitted_poly, right_lane_line_fitted_poly)
-    
+    left_curvature, right_curvature = compute_curvature_of_lane_lines(thresholded_warped_undistorted_test_road_image.shape, left_lane_line_coeff, right_lane_line_coeff)
+
     ## compute vehicle offset from center ##
     vehicle_offset = compute_vehicle_offset(thresholded_warped_undistorted_test_road_image.shape, left_lane_line_coeff, right_lane_line_coeff)
-    
+
     #####################################
     ## TEST PROJECTION BACK ONTO ROAD  ##
     #####################################
-    
-    #create an image to draw the lines on
-    warped_lane = np.zeros_like(warped_undistorted_test_road_image).astype(np.uint8)
-
-    #draw the lane onto the warped blank image
-    pts = np.hstack((pts_left, pts_right))
-    cv2.fillPoly(warped_lane, np.int_([pts]), (152, 251, 152))
-    
-    #draw fitted lines on image
-    cv2.polylines(warped_lane, np.int_([pts_left]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
-    cv2.polylines(warped_lane, np.int_([pts_right]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
-
-    #save image
-    mpimg.imsave("output_images/stage4_warped_lane_straight_lines1.jpg", warped_lane)
-
-    #transform perspective back to original (unwarp)
-    warped_to_original_perspective = perform_perspective_transform(warped_lane, perspective_transform_components[1])
-
-    #combine (weight) the result with the original image
-    projected_lane = cv2.addWeighted(undistorted_test_road_image, 1, warped_to_original_perspective, 0.3, 0)
-    
-    #add tracking text
-    font = cv2.FONT_HERSHEY_SIMPLEX
-    cv2.putText(projected_lane, 'Lane curvature: {0:.2f} meters'.format(np.mean([left_curvature, right_curvature])), (20, 50), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
-    cv2.putText(projected_lane, 'Vehicle offset: {0:.2f} meters'.format(vehicle_offset), (20, 100), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
-    
-    #save image
-    mpimg.imsave("output_images/stage4_projected_lane_straight_lines1.jpg", projected_lane)
\ No newline at end of file
+
+    #the projection is only rendered for its artifacts
+    if (is_artifact_selected("stage4_warped_lane", selected_artifacts) or is_artifact_selected("stage4_projected_lane", selected_artifacts)):
+        #create an image to draw the lines on
+        warped_lane = np.zeros_like(warped_undistorted_test_road_image).astype(np.uint8)
+
+        #draw the lane onto the warped blank image
+        pts = np.hstack((pts_left, pts_right))
+        cv2.fillPoly(warped_lane, np.int_([pts]), (152, 251, 152))
+
+        #draw fitted lines on image
+        cv2.polylines(warped_lane, np.int_([pts_left]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
+        cv2.polylines(warped_lane, np.int_([pts_right]), False, color=(189,183,107), thickness=20, lineType=cv2.LINE_AA)
+        artifacts.append(("stage4_warped_lane", warped_lane))
+
+        #transform perspective back to original (unwarp)
+        warped_to_original_perspective = perform_perspective_transform(warped_lane, perspective_transform_components[1])
+
+        #combine (weight) the result with the original image
+        projected_lane = cv2.addWeighted(undistorted_test_road_image, 1, warped_to_original_perspective, 0.3, 0)
+
+        #add tracking text
+        font = cv2.FONT_HERSHEY_SIMPLEX
+        cv2.putText(projected_lane, 'Lane curvature: {0:.2f} meters'.format(np.mean([left_curvature, right_curvature])), (20, 50), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
+        cv2.putText(projected_lane, 'Vehicle offset: {0:.2f} meters'.format(vehicle_offset), (20, 100), font, 1, (255, 255, 255), 2, cv2.LINE_AA)
+        artifacts.append(("stage4_projected_lane", projected_lane))
+
+    #the undistorted and warped images are needed by later stages whether or not they were selected, drop them now if they weren't
+    return [(artifact_name, artifact_image) for (artifact_name, artifact_image) in artifacts if is_artifact_selected(artifact_name, selected_artifacts)]
+
+#process a single road image (runs in a test pipeline worker process), returns (image name, artifacts)
+#test_road_image is either a path to an image file or a decoded image
+def process_test_road_image(image_name, test_road_image, calibration_components, perspective_transform_components, src_vertices, selected_artifacts):
+    if (isinstance(test_road_image, str)):
+        test_road_image = read_rgb_image(test_road_image)
+    return (image_name, generate_test_road_image_artifacts(test_road_image, calibration_components, perspective_transform_components, src_vertices, selected_artifacts))
+
+#test the pipeline components and produce outputs in the output_images directory
+#by default a chessboard and a single road image are tested (input_path can also be a directory of road images or a video, see generate_test_road_images)
+#road images are processed across num_workers worker processes (1 processes them in this process), and artifacts are written on num_writer_threads background threads
+#selected_artifacts limits the artifacts produced (see is_artifact_selected), an image that fails is reported and the rest are still processed
+#returns the number of artifacts written (raises once every image was processed if any of them failed)
+def execute_test_pipeline(calibration_components, perspective_transform_components, src_vertices, input_path="test_images/straight_lines1.jpg", output_directory="output_images",
+                          selected_artifacts=None, num_workers=1, num_writer_threads=4, video_frame_stride=30, max_video_frames=None, path_to_test_chessboard_image="camera_cal/calibration1.jpg"):
+    artifact_writer = ArtifactWriter(output_directory, selected_artifacts, num_writer_threads)
+    num_test_road_images = 0
+    failed_image_names = []
+    start_time = time.perf_counter()
+    try:
+        #test camera calibration by undistorting a test chessboard image
+        if ((path_to_test_chessboard_image is not None) and artifact_writer.is_artifact_selected("stage0_undistorted")):
+            test_chessboard_image = read_rgb_image(path_to_test_chessboard_image)
+            artifact_writer.submit_artifact("stage0_undistorted", os.path.splitext(os.path.basename(path_to_test_chessboard_image))[0], perform_undistort(test_chessboard_image, calibration_components))
+
+        #hand the artifacts of each road image to the writer as soon as its stages complete
+        def submit_test_road_image_artifacts(image_name, artifacts):
+            for artifact_name, artifact_image in artifacts:
+                artifact_writer.submit_artifact(artifact_name, image_name, artifact_image)
+        def report_failed_test_road_image(image_name, error):
+            failed_image_names.append(image_name)
+            print("{0} failed: {1}: {2}".format(image_name, type(error).__name__, (str(error).splitlines() or [""])[0]))
+
+        test_road_images = generate_test_road_images(input_path, video_frame_stride, max_video_frames)
+        if (num_workers <= 1):
+            for image_name, test_road_image in test_road_images:
+                num_test_road_images += 1
+                try:
+                    submit_test_road_image_artifacts(*process_test_road_image(image_name, test_road_image, calibration_components, perspective_transform_components, src_vertices, selected_artifacts))
+                except Exception as error:
+                    report_failed_test_road_image(image_name, error)
+        else:
+            #workers use the same blur strategy as this process, and never more than 2 images per worker are in flight (bounding memory use with sampled video frames)
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=initialize_worker, initargs=(threshold_processor.gaussian_blur_strategy,)) as executor:
+                #futures of submitted images, oldest (leftmost) first
+                images_in_flight = deque()
+                def finish_oldest_test_road_image():
+                    image_name, image_future = images_in_flight.popleft()
+                    try:
+                        submit_test_road_image_artifacts(*image_future.result())
+                    except Exception as error:
+                        report_failed_test_road_image(image_name, error)
+                for image_name, test_road_image in test_road_images:
+                    num_test_road_images += 1
+                    images_in_flight.append((image_name, executor.submit(process_test_road_image, image_name, test_road_image, calibration_components, perspective_transform_components,
+                                                                         src_vertices, selected_artifacts)))
+                    if (len(images_in_flight) >= (2 * num_workers)):
+                        finish_oldest_test_road_image()
+                while (len(images_in_flight) > 0):
+                    finish_oldest_test_road_image()
+    finally:
+        num_artifacts_written = artifact_writer.close()
+
+    print("tested {0} road images: {1} artifacts written to {2} in {3:.1f}s".format(num_test_road_images, num_artifacts_written, output_directory, time.perf_counter() - start_time))
+    if (len(failed_image_names) > 0):
+        raise RuntimeError("{0} of {1} road images failed the test pipeline: {2}".format(len(failed_image_names), num_test_road_images, ", ".join(failed_image_names)))
+    return num_artifacts_written
+
+#check that the fused thresholding kernel the production pipeline uses (perform_fused_thresholding) produces exactly the binary image of perform_thresholding
+#on every road image of the input (see generate_test_road_images) warped as the pipeline warps it, under each of the blur strategies
+#prints each mismatch and a summary, returns the number of (road image, blur strategy) pairs that didn't match
+def execute_thresholding_parity_check(calibration_components, perspective_transform_components, input_path="test_images", blur_strategies=gaussian_blur_strategies,
+                                      video_frame_stride=30, max_video_frames=None):
+    num_checked = 0
+    num_mismatched = 0
+    #perform_thresholding blurs with the selected strategy, restore the caller's once done
+    previous_blur_strategy = threshold_processor.gaussian_blur_strategy
+    try:
+        for image_name, test_road_image in generate_test_road_images(input_path, video_frame_stride, max_video_frames):
+            if (isinstance(test_road_image, str)):
+                test_road_image = read_rgb_image(test_road_image)
+            warped_undistorted_test_road_image = perform_perspective_transform(perform_undistort(test_road_image, calibration_components), perspective_transform_components[0])
+            for blur_strategy in blur_strategies:
+                threshold_processor.set_gaussian_blur_strategy(blur_strategy)
+                thresholded_image = perform_thresholding(warped_undistorted_test_road_image)
+                fused_thresholded_image = perform_fused_thresholding(warped_undistorted_test_road_image, blur_strategy)
+                num_checked += 1
+                if (not np.array_equal(fused_thresholded_image, thresholded_image)):
+                    num_mismatched += 1
+                    print("{0} ({1}): fused thresholding differs at {2} of {3} pixels".format(image_name, blur_strategy, np.count_nonzero(fused_thresholded_image != thresholded_image), thresholded_image.size))
+    finally:
+        threshold_processor.set_gaussian_blur_strategy(previous_blur_strategy)
+    print("{0} of {1} road image and blur strategy pairs differ between fused and reference thresholding".format(num_mismatched, num_checked))
+    return num_mismatched
+
+#parse the command line arguments (defaults come from the settings in main)
+def parse_test_pipeline_arguments(argv, main):
+    parser = argparse.ArgumentParser(description="Run the pipeline stages over road images and write a debug image from each stage.")
+    parser.add_argument("input", nargs="?", default="test_images", help="road image, directory of road images, or video (sampled every --video-stride frames)")
+    parser.add_argument("--output-dir", default="output_images", help="directory the stage images are written to")
+    parser.add_argument("--artifacts", nargs="+", default=None, help="artifacts to write, by name or stage (e.g., stage3 or stage1_warped), defaults to all of: " + ", ".join(test_pipeline_artifacts))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="number of road images processed at once")
+    parser.add_argument("--writer-threads", type=int, default=4, help="number of threads encoding and writing stage images")
+    parser.add_argument("--video-stride", type=int, default=30, help="sample every nth frame of a video")
+    parser.add_argument("--max-video-frames", type=int, default=None, help="maximum number of video frames sampled")
+    parser.add_argument("--parity-check", action="store_true", help="check that fused thresholding matches perform_thresholding on every input image under every blur strategy instead of writing stage images")
+    main.add_pipeline_arguments(parser, include_calibration=False, include_raw_pipe=False, include_region_of_interest=False, include_tracking=False)
+    return parser.parse_args(argv)
+
+#run the test pipeline command
+def execute_test_pipeline_command(argv=None):
+    #main imports this module, so it's imported here rather than at the top
+    import main
+    arguments = parse_test_pipeline_arguments(argv, main)
+    threshold_processor.set_gaussian_blur_strategy(arguments.blur_strategy)
+    calibration_components = main.generate_camera_calibration_components()
+    perspective_transform_components = main.generate_road_perspective_transform_components()
+    if (arguments.parity_check):
+        num_mismatched = execute_thresholding_parity_check(calibration_components, perspective_transform_components, arguments.input, gaussian_blur_strategies, arguments.video_stride, arguments.max_video_frames)
+        return (1 if (num_mismatched > 0) else 0)
+    try:
+        execute_test_pipeline(calibration_components, perspective_transform_components, (main.src_upper_left, main.src_lower_left, main.src_lower_right, main.src_upper_right),
+                              arguments.input, arguments.output_dir, arguments.artifacts, arguments.jobs, arguments.writer_threads, arguments.video_stride, arguments.max_video_frames)
+    except RuntimeError as error:
+        print(error)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(execute_test_pipeline_command())
\ No newline at end of file
